@@ -0,0 +1,136 @@
+"""Vectorized trend analytics over a window of completions.
+
+Completed days arrive as columnar arrays of habit index and day offset
+into the window, and are scattered into a dense ``habits x days`` boolean
+matrix. Every aggregate below is then a few NumPy reductions over that
+matrix, whatever the number of habits.
+
+A habit counts towards a day's denominator from the day it was created,
+or from its first completion in the window when that is earlier
+(imported history). Rates are percentages with one decimal.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+ROLLING_WINDOWS = (7, 30)
+STREAK_BUCKETS = ((1, 1), (2, 3), (4, 7), (8, 14), (15, 30), (31, 90), (91, None))
+
+
+def completion_matrix(habit_index: np.ndarray, day_offset: np.ndarray, habit_count: int, days: int) -> np.ndarray:
+    """Dense habits x days matrix of completed flags"""
+    matrix = np.zeros((habit_count, days), dtype=bool)
+    inside = (day_offset >= 0) & (day_offset < days)
+    matrix[habit_index[inside], day_offset[inside]] = True
+    return matrix
+
+
+def active_from(matrix: np.ndarray, created_offset: np.ndarray) -> np.ndarray:
+    """First day offset each habit counts towards the denominators"""
+    days = matrix.shape[1]
+    first_completion = np.where(matrix.any(axis=1), matrix.argmax(axis=1), days)
+    return np.clip(np.minimum(created_offset, first_completion), 0, days)
+
+
+def percent(numerator, denominator) -> np.ndarray:
+    """numerator / denominator as a percentage, 0 where the denominator is 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    result = np.divide(numerator * 100, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+    return np.round(result, 1)
+
+
+def rolling_sum(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing sums over the last axis; the first days use the days available"""
+    cumulative = np.cumsum(values, axis=-1)
+    shifted = np.zeros_like(cumulative)
+    shifted[..., window:] = cumulative[..., :-window]
+    return cumulative - shifted
+
+
+def streak_runs(matrix: np.ndarray):
+    """Habit row and length of every completed run in the window"""
+    padded = np.pad(matrix.astype(np.int8), ((0, 0), (1, 1)))
+    steps = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(steps == 1)
+    _, ends = np.nonzero(steps == -1)
+    return rows, ends - starts
+
+
+def streak_label(low: int, high) -> str:
+    return str(low) if low == high else f"{low}+" if high is None else f"{low}-{high}"
+
+
+def streak_histograms(lengths: np.ndarray, groups: np.ndarray, group_count: int) -> np.ndarray:
+    """Runs per group and length bucket, as a groups x buckets count matrix"""
+    edges = np.array([low for low, _ in STREAK_BUCKETS[1:]])
+    buckets = np.searchsorted(edges, lengths, side="right")
+    flat = np.bincount(groups * len(STREAK_BUCKETS) + buckets, minlength=group_count * len(STREAK_BUCKETS))
+    return flat.reshape(group_count, len(STREAK_BUCKETS))
+
+
+def summarize_rows(completed: np.ndarray, active: np.ndarray, weekdays: np.ndarray) -> Dict[str, list]:
+    """Rate series and weekday rates for each row of per-day counts"""
+    weekday_onehot = np.eye(7, dtype=np.int64)[weekdays]
+    summary = {
+        "completion_rate": percent(completed.sum(axis=-1), active.sum(axis=-1)),
+        "daily_rate": percent(completed, active),
+        "weekday_rates": percent(completed @ weekday_onehot, active @ weekday_onehot),
+    }
+    for window in ROLLING_WINDOWS:
+        summary[f"rolling_{window}"] = percent(rolling_sum(completed, window), rolling_sum(active, window))
+    return {name: values.tolist() for name, values in summary.items()}
+
+
+def trends(matrix: np.ndarray, created_offset: np.ndarray, group_keys: Sequence[str], start_ordinal: int) -> Dict:
+    """Per-group and overall trends for a habits x days completion matrix
+
+    ``group_keys`` holds one group key per habit row; ``start_ordinal`` is
+    the ``date.toordinal()`` of the first day in the window.
+    """
+    habit_count, days = matrix.shape
+    weekdays = (start_ordinal + np.arange(days) - 1) % 7
+    keys, group_of = np.unique(np.asarray(group_keys, dtype=str), return_inverse=True)
+    group_count = len(keys)
+    first_day = active_from(matrix, np.asarray(created_offset, dtype=np.int64))
+
+    # Completed and active habits per group and day: rows sorted by group
+    # are summed per group, and habits join the active count on first_day
+    order = np.argsort(group_of, kind="stable")
+    habits_per_group = np.bincount(group_of, minlength=group_count)
+    if habit_count:
+        boundaries = np.concatenate(([0], np.cumsum(habits_per_group)[:-1]))
+        completed = np.add.reduceat(matrix[order], boundaries, axis=0, dtype=np.int64)
+    else:
+        completed = np.zeros((0, days), dtype=np.int64)
+    starts = np.bincount(group_of * (days + 1) + first_day, minlength=group_count * (days + 1))
+    active = np.cumsum(starts.reshape(group_count, days + 1), axis=1)[:, :days]
+
+    run_rows, run_lengths = streak_runs(matrix)
+    histograms = streak_histograms(run_lengths, group_of[run_rows], group_count)
+    labels = [streak_label(low, high) for low, high in STREAK_BUCKETS]
+    overall_histogram = histograms.sum(axis=0).tolist()
+    histograms = histograms.tolist()
+    completed_days = completed.sum(axis=1).tolist()
+    active_days = active.sum(axis=1).tolist()
+
+    per_group = summarize_rows(completed, active, weekdays)
+    groups: List[Dict] = [
+        {
+            "key": key,
+            "habits": int(habits_per_group[index]),
+            "completed_days": completed_days[index],
+            "active_days": active_days[index],
+            **{name: values[index] for name, values in per_group.items()},
+            "streaks": dict(zip(labels, histograms[index])),
+        }
+        for index, key in enumerate(keys.tolist())
+    ]
+    overall = {
+        "habits": habit_count,
+        "completed_days": int(completed.sum()),
+        "active_days": int(active.sum()),
+        **summarize_rows(completed.sum(axis=0), active.sum(axis=0), weekdays),
+        "streaks": dict(zip(labels, overall_histogram)),
+    }
+    return {"overall": overall, "groups": groups}
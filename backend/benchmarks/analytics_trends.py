@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""Benchmark the trend analytics on year-scale windows, load step included.
+
+For each habit count it seeds a random year of completions and times:
+
+- ``load``: ``completed_day_offsets`` on a SQLite repository (a temporary
+  file), i.e. the read the /analytics/trends endpoint makes
+- ``bitmaps``: decoding the same completions from per-year bitmap
+  documents, as the Mongo repository does with COMPLETION_STORAGE=bitmap
+- ``matrix``: scattering the loaded days into the completion matrix
+- ``trends`` grouped by category (8 groups) and by habit
+
+``total`` is load + matrix + trends by category: one uncached request.
+
+Usage: python backend/benchmarks/analytics_trends.py [--days N] [--habits N,N,...]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import timeit
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from analytics import completion_matrix, trends  # noqa: E402
+from completion_bitmaps import completed_day_offsets, encode_history  # noqa: E402
+from sqlite_repository import SqliteRepository  # noqa: E402
+
+HABIT_COUNTS = [10, 1_000, 5_000]
+CATEGORIES = 8
+SEED_BATCH_SIZE = 50_000
+
+
+def best_of(statement, number: int) -> float:
+    """Best per-call time in milliseconds over a few repeats"""
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e3
+
+
+async def best_of_async(call, number: int) -> float:
+    """best_of for a coroutine function"""
+    samples = []
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(number):
+            await call()
+        samples.append((time.perf_counter() - started) / number * 1e3)
+    return min(samples)
+
+
+async def measure(habits: int, days: int, rng) -> dict:
+    end = date.today()
+    start = end - timedelta(days=days - 1)
+    habit_ids = [f"habit-{i:05}" for i in range(habits)]
+    completed = rng.random((habits, days)) < 0.7
+    day_strs = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    rows, offsets = np.nonzero(completed)
+    records = [(habit_ids[row], day_strs[offset], True) for row, offset in zip(rows.tolist(), offsets.tolist())]
+    bitmaps = [
+        (row, {"year": year, **bitmap})
+        for row in range(habits)
+        for year, bitmap in encode_history((day_strs[offset], True) for offset in np.flatnonzero(completed[row])).items()
+    ]
+    number = max(1, 1_000 // habits)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        repository = SqliteRepository(os.path.join(workdir, "trends.sqlite3"))
+        await repository.open()
+        try:
+            for batch_start in range(0, len(records), SEED_BATCH_SIZE):
+                await repository.set_completions("bench", records[batch_start:batch_start + SEED_BATCH_SIZE])
+            load_ms = await best_of_async(
+                lambda: repository.completed_day_offsets("bench", habit_ids, start, end), number
+            )
+            habit_index, day_offset = await repository.completed_day_offsets("bench", habit_ids, start, end)
+        finally:
+            await repository.close()
+
+    created = np.zeros(habits, dtype=np.int64)
+    categories = [f"category-{i % CATEGORIES}" for i in range(habits)]
+    matrix = completion_matrix(habit_index, day_offset, habits, days)
+    assert (matrix == completed).all()
+    result = {
+        "load": load_ms,
+        "bitmaps": best_of(lambda: completed_day_offsets(bitmaps, start, end), number),
+        "matrix": best_of(lambda: completion_matrix(habit_index, day_offset, habits, days), number),
+        "category": best_of(lambda: trends(matrix, created, categories, start.toordinal()), number),
+        "habit": best_of(lambda: trends(matrix, created, habit_ids, start.toordinal()), number),
+    }
+    result["total"] = result["load"] + result["matrix"] + result["category"]
+    return result
+
+
+async def run(args):
+    rng = np.random.default_rng(0)
+    print(f"{'habits':>8} {'load ms':>9} {'bitmaps ms':>11} {'matrix ms':>10} {'category ms':>12} "
+          f"{'habit ms':>9} {'total ms':>9}")
+    for habits in args.habits:
+        result = await measure(habits, args.days, rng)
+        print(f"{habits:>8} {result['load']:>9.1f} {result['bitmaps']:>11.1f} {result['matrix']:>10.1f} "
+              f"{result['category']:>12.1f} {result['habit']:>9.1f} {result['total']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365, help="window length in days")
+    parser.add_argument("--habits", type=lambda value: [int(count) for count in value.split(",")],
+                        default=HABIT_COUNTS, help="comma-separated habit counts")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
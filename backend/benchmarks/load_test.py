@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Load-test the API in-process and fail on latency regressions.
+
+Seeds users x habits x days of completions, then drives the FastAPI app
+through ``httpx.AsyncClient`` at a fixed concurrency, one endpoint at a
+time, and reports p50/p95/p99 latency and throughput per endpoint from
+the best of ``--rounds`` rounds.
+
+Storage is a temporary SQLite file (``--storage sqlite``, the default,
+so a run needs no database server), a throwaway ``<DB_NAME>_bench``
+database on MONGO_URL (``--storage mongo``) or an in-memory mongomock
+stand-in (``--storage mongomock``, needs ``pip install mongomock-motor``).
+The response cache is disabled unless ``--cache`` is given, so every
+request does the full work.
+
+Results are compared with the stored baseline for the same configuration:
+the run fails when the p95 of a guarded endpoint exceeds the baseline by
+more than ``--tolerance``, when any request fails, or when there is no
+baseline for the configuration. ``--update-baseline`` records the current
+run instead; baselines/load_test.json holds one for the default
+configuration.
+
+Usage: python backend/benchmarks/load_test.py [--users N] [--habits N] [--days N]
+       [--concurrency N] [--requests N] [--storage sqlite|mongo|mongomock]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from sqlite_repository import SqliteRepository  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "load_test.json"
+GUARDED_ENDPOINTS = ("GET /api/habits", "GET /api/habits/stats")
+
+
+def seed_documents(users: int, habits: int, days: int, seed: int):
+    """Habit and completion documents for every user, about 80% completed"""
+    rng = random.Random(seed)
+    today = date.today()
+    habit_docs, completion_docs = [], []
+    for user in range(users):
+        user_id = f"bench-user-{user}"
+        for index in range(habits):
+            habit_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            habit_docs.append({
+                "id": habit_id,
+                "user_id": user_id,
+                "name": f"Habit {index}",
+                "description": None,
+                "category": ("health", "fitness", "mindfulness", "learning")[index % 4],
+                "icon": "🏃",
+                "color": "bg-blue-100",
+                "created_at": datetime.utcnow() - timedelta(days=days),
+            })
+            completion_docs.extend(
+                {
+                    "id": str(uuid.UUID(int=rng.getrandbits(128))),
+                    "user_id": user_id,
+                    "habit_id": habit_id,
+                    "date": (today - timedelta(days=offset)).isoformat(),
+                    "completed": rng.random() < 0.8,
+                }
+                for offset in range(days)
+            )
+    return habit_docs, completion_docs
+
+
+async def seed(repository, habit_docs, completion_docs):
+    for habit in habit_docs:
+        await repository.insert_habit(habit)
+    for start in range(0, len(completion_docs), 10_000):
+        records = defaultdict(list)
+        for completion in completion_docs[start:start + 10_000]:
+            records[completion["user_id"]].append((completion["habit_id"], completion["date"], completion["completed"]))
+        for user_id, user_records in records.items():
+            await repository.set_completions(user_id, user_records)
+    await server.rebuild_stats_for_habits()
+
+
+def endpoint_requests(habit_docs, days: int):
+    """Request factories per endpoint; each returns (method, url, headers, body)"""
+    window_start = (date.today() - timedelta(days=min(days, 365))).isoformat()
+    today = date.today().isoformat()
+
+    def pick():
+        habit = random.choice(habit_docs)
+        return habit, {"X-User-Id": habit["user_id"]}
+
+    def list_habits():
+        _, headers = pick()
+        return "GET", f"/api/habits?from={window_start}", headers, None
+
+    def stats():
+        _, headers = pick()
+        return "GET", "/api/habits/stats", headers, None
+
+    def get_habit():
+        habit, headers = pick()
+        return "GET", f"/api/habits/{habit['id']}?from={window_start}", headers, None
+
+    def batch():
+        habit, headers = pick()
+        ids = [other['id'] for other in habit_docs if other['user_id'] == habit['user_id']][:5]
+        return "GET", f"/api/habits/batch?ids={','.join(ids)}&from={window_start}", headers, None
+
+    def toggle():
+        habit, headers = pick()
+        return "POST", f"/api/habits/{habit['id']}/completions", headers, {
+            "date": today, "completed": random.random() < 0.5
+        }
+
+    def trends():
+        _, headers = pick()
+        return "GET", "/api/analytics/trends?window=365", headers, None
+
+    return {
+        "GET /api/habits": list_habits,
+        "GET /api/habits/stats": stats,
+        "GET /api/habits/{habit_id}": get_habit,
+        "GET /api/habits/batch": batch,
+        "POST /api/habits/{habit_id}/completions": toggle,
+        "GET /api/analytics/trends": trends,
+    }
+
+
+async def drive(client: httpx.AsyncClient, make_request, total: int, concurrency: int):
+    """Issue total requests from concurrency workers; returns latencies and failures"""
+    latencies, failures = [], 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal failures
+        for _ in remaining:
+            method, url, headers, body = make_request()
+            started = time.perf_counter()
+            response = await client.request(method, url, headers=headers, json=body)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, failures, time.perf_counter() - started
+
+
+def summarize(latencies, failures: int, elapsed: float) -> dict:
+    p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return {
+        "requests": len(latencies),
+        "failures": failures,
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of guarded endpoints against the baseline results"""
+    regressions = []
+    for endpoint in GUARDED_ENDPOINTS:
+        current, previous = results.get(endpoint), baseline.get(endpoint)
+        if current and previous and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{endpoint}: p95 {current['p95_ms']}ms > baseline {previous['p95_ms']}ms "
+                               f"+{tolerance:.0%}")
+    return regressions
+
+
+def mongo_client(storage: str):
+    if storage == "mongomock":
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("--storage mongomock needs mongomock-motor (pip install mongomock-motor)")
+        return mongomock_motor.AsyncMongoMockClient()
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(os.environ["MONGO_URL"])
+
+
+async def run(args) -> dict:
+    if args.storage == "sqlite":
+        workdir = tempfile.TemporaryDirectory()
+        server.bind_repository(SqliteRepository(os.path.join(workdir.name, "bench.sqlite3")))
+
+        async def cleanup():
+            await server.repository.close()
+            workdir.cleanup()
+    else:
+        client = mongo_client(args.storage)
+        db_name = f"{os.environ['DB_NAME']}_bench"
+        await client.drop_database(db_name)
+        server.use_database(client[db_name])
+
+        async def cleanup():
+            await client.drop_database(db_name)
+    if not args.cache:
+        server.response_cache = ResponseCache(max_entries=0)
+
+    try:
+        await server.repository.open()
+        if args.storage == "mongo":
+            await server.ensure_indexes()
+        habit_docs, completion_docs = seed_documents(args.users, args.habits, args.days, args.seed)
+        started = time.perf_counter()
+        await seed(server.repository, habit_docs, completion_docs)
+        print(f"Seeded {len(habit_docs)} habits and {len(completion_docs)} completions "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        random.seed(args.seed)
+        results = {}
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            for endpoint, make_request in endpoint_requests(habit_docs, args.days).items():
+                await drive(http, make_request, args.concurrency, args.concurrency)  # warm-up
+                # Best of a few rounds, as with timeit, to keep noise out of the baseline
+                rounds = [summarize(*await drive(http, make_request, args.requests, args.concurrency))
+                          for _ in range(args.rounds)]
+                results[endpoint] = min(rounds, key=lambda result: result["p95_ms"])
+                results[endpoint]["failures"] = sum(result["failures"] for result in rounds)
+        return results
+    finally:
+        await cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--habits", type=int, default=10, help="habits per user")
+    parser.add_argument("--days", type=int, default=365, help="days of history per habit")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and round")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds per endpoint; the best p95 is kept")
+    parser.add_argument("--storage", choices=("sqlite", "mongo", "mongomock"), default="sqlite")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache enabled")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 increase, e.g. 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args()
+
+    config_key = (f"{args.storage} users={args.users} habits={args.habits} days={args.days} "
+                  f"concurrency={args.concurrency} cache={args.cache}")
+    results = asyncio.run(run(args))
+
+    print(f"\n{config_key}")
+    print(f"{'endpoint':<42} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'fail':>5}")
+    for endpoint, result in results.items():
+        print(f"{endpoint:<42} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+              f"{result['rps']:>8.1f} {result['failures']:>5}")
+
+    baselines = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.update_baseline:
+        baselines[config_key] = results
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(baselines, indent=2, sort_keys=True) + "\n")
+        print(f"\nBaseline stored in {args.baseline}")
+        return
+
+    problems = [f"{endpoint}: {result['failures']} failed request(s)"
+                for endpoint, result in results.items() if result["failures"]]
+    if config_key in baselines:
+        problems += compare(results, baselines[config_key], args.tolerance)
+    else:
+        problems.append(f"no baseline for {config_key!r} in {args.baseline}; run with --update-baseline to store one")
+    if problems:
+        print("\nFAILED:\n  " + "\n  ".join(problems))
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Benchmark the CPU cost of serializing a habit list response.
+
+Compares, for N habits with a year of completion history each:
+
+- ``model``: building HabitWithStats models, FastAPI's response_model
+  validation and serialization, then JSONResponse encoding (the previous path)
+- ``fast``: the plain-dict payload from ``build_habit_with_stats`` encoded
+  by ``fast_json.dumps`` (orjson when installed)
+
+Times are process CPU time per request.
+
+Usage: python backend/benchmarks/serialization.py [--habits N] [--days N]
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+
+import fast_json  # noqa: E402
+import server  # noqa: E402
+from habit_stats import stats_from_history  # noqa: E402
+
+
+def make_habits(habits: int, days: int):
+    today = date.today()
+    rows = []
+    for index in range(habits):
+        history = {(today - timedelta(days=offset)).isoformat(): (offset + index) % 5 != 0
+                   for offset in range(days - 1, -1, -1)}
+        habit = {"id": f"habit-{index}", "name": f"Habit {index}", "description": None, "category": "health",
+                 "icon": "🏃", "color": "bg-blue-100", "created_at": datetime.utcnow()}
+        rows.append((habit, history, stats_from_history(habit["id"], history), today))
+    return rows
+
+
+async def model_path(rows, field) -> bytes:
+    models = [server.HabitWithStats(**server.build_habit_with_stats(*row)) for row in rows]
+    content = await serialize_response(field=field, response_content=models)
+    return JSONResponse(content).body
+
+
+def fast_path(rows) -> bytes:
+    return fast_json.dumps([server.build_habit_with_stats(*row) for row in rows])
+
+
+def cpu_ms(run, number: int) -> float:
+    """Best per-call process CPU time in milliseconds over a few repeats"""
+    best = float("inf")
+    for _ in range(5):
+        started = time.process_time()
+        for _ in range(number):
+            run()
+        best = min(best, (time.process_time() - started) / number)
+    return best * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--habits", type=int, default=100)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--number", type=int, default=10, help="requests per repeat")
+    args = parser.parse_args()
+
+    rows = make_habits(args.habits, args.days)
+    field = create_response_field(name="response", type_=List[server.HabitWithStats])
+    loop = asyncio.new_event_loop()
+    model_body = loop.run_until_complete(model_path(rows, field))
+    fast_body = fast_path(rows)
+
+    model_ms = cpu_ms(lambda: loop.run_until_complete(model_path(rows, field)), args.number)
+    fast_ms = cpu_ms(lambda: fast_path(rows), args.number)
+    encoder = "orjson" if fast_json.orjson is not None else "json"
+    print(f"{args.habits} habits x {args.days} days, {len(fast_body) / 1024:.0f} KiB body ({encoder})")
+    print(f"{'model':>6} {model_ms:>8.2f} ms CPU/request")
+    print(f"{'fast':>6} {fast_ms:>8.2f} ms CPU/request  ({model_ms / fast_ms:.1f}x less)")
+    if len(model_body) != len(fast_body):
+        print(f"note: body sizes differ ({len(model_body)} vs {len(fast_body)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
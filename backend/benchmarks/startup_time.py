@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Measure how fast a new API worker starts and serves its first request.
+
+Two parts:
+
+- import time: runs ``python -X importtime -c "import server"`` in fresh
+  interpreters and reports the median time to import the app, the
+  modules that cost the most, and whether any heavy dependency (NumPy,
+  pandas, pyarrow, boto3, motor) was imported eagerly
+- time to first request: starts ``uvicorn server:app`` and reports when
+  /health first answers (the app is listening), when /ready passes (the
+  warm-up is done) and the latency of the first and second dashboard read
+
+``--storage sqlite`` (the default) starts against a temporary SQLite file,
+so the benchmark needs no database server; ``--storage mongo`` uses
+MONGO_URL and DB_NAME from the environment or backend/.env.
+
+Usage: python backend/benchmarks/startup_time.py [--runs N] [--top N] [--storage sqlite|mongo]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("numpy", "pandas", "pyarrow", "boto3", "motor")
+PORT = 8766
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def storage_env(storage: str, workdir: str) -> dict:
+    env = dict(os.environ, STORAGE_BACKEND=storage, BACKGROUND_JOBS_INTERVAL_SECONDS="0", PURGE_INTERVAL_SECONDS="0")
+    if storage == "sqlite":
+        env["SQLITE_PATH"] = os.path.join(workdir, "startup.sqlite3")
+    return env
+
+
+def import_profile(env: dict) -> dict:
+    """One fresh import of server: its cumulative time in microseconds, the
+    (self us, cumulative us) of each module it imports directly, and the
+    names of every module loaded
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    # A module is listed after the modules it imports, indented one level deeper
+    loaded, children = set(), {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        loaded.add(name)
+        if len(indent) == 3:
+            children[name] = (int(self_us), int(cumulative_us))
+        elif len(indent) == 1:
+            if name == "server":
+                return {"total": int(cumulative_us), "imports": children, "loaded": loaded}
+            children = {}
+    raise RuntimeError("server missing from the -X importtime output")
+
+
+def wait_for(url: str, status: int, deadline: float) -> float:
+    """Poll url until it answers with status; returns the time it did"""
+    while time.perf_counter() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code == status:
+                return time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.01)
+    raise RuntimeError(f"{url} did not answer {status} in time")
+
+
+def first_requests(env: dict) -> dict:
+    """Seconds from spawning a worker to listening, ready and the first reads"""
+    base = f"http://127.0.0.1:{PORT}"
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(PORT), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    try:
+        deadline = started + 60
+        listening = wait_for(f"{base}/health", 200, deadline)
+        ready = wait_for(f"{base}/ready", 200, deadline)
+        latencies = []
+        for _ in range(2):
+            request_started = time.perf_counter()
+            httpx.get(f"{base}/api/habits/stats", headers={"X-User-Id": "startup"}, timeout=30).raise_for_status()
+            latencies.append(time.perf_counter() - request_started)
+        return {
+            "listening": listening - started,
+            "ready": ready - started,
+            "first_ms": latencies[0] * 1000,
+            "second_ms": latencies[1] * 1000,
+        }
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement; medians are reported")
+    parser.add_argument("--top", type=int, default=10, help="most expensive direct imports of server to list")
+    parser.add_argument("--storage", choices=("sqlite", "mongo"), default="sqlite")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = storage_env(args.storage, workdir)
+
+        import_profile(env)  # compile bytecode outside the measurement
+        profiles = [import_profile(env) for _ in range(args.runs)]
+        totals = [profile["total"] / 1000 for profile in profiles]
+        print(f"import server: median {statistics.median(totals):.0f} ms "
+              f"(min {min(totals):.0f}, max {max(totals):.0f}) over {args.runs} run(s)\n")
+
+        # Direct imports of server by cumulative time, in the median run
+        profile = sorted(profiles, key=lambda profile: profile["total"])[len(profiles) // 2]
+        top = sorted(profile["imports"].items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+        print(f"{'imported by server':<28} {'cumulative ms':>14} {'self ms':>8}")
+        for name, (self_us, cumulative_us) in top:
+            print(f"{name:<28} {cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}")
+        eager = [name for name in HEAVY_MODULES if name in profile["loaded"]]
+        print(f"\nHeavy modules imported eagerly: {', '.join(eager) if eager else 'none'}\n")
+
+        runs = [first_requests(env) for _ in range(args.runs)]
+        print(f"{'listening s':>12} {'ready s':>8} {'first read ms':>14} {'second read ms':>15}")
+        print(f"{statistics.median(run['listening'] for run in runs):>12.2f} "
+              f"{statistics.median(run['ready'] for run in runs):>8.2f} "
+              f"{statistics.median(run['first_ms'] for run in runs):>14.1f} "
+              f"{statistics.median(run['second_ms'] for run in runs):>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Count the Mongo commands issued by the habit stats endpoint.
+
+Seeds a throwaway ``<DB_NAME>_bench`` database on MONGO_URL with a growing
+number of habits, calls ``compute_habit_stats`` for each size and reports the
+number of commands sent to Mongo alongside the wall-clock time. The
+command count must not grow with the number of habits: the script exits
+with an error if it differs between sizes.
+
+Usage: python backend/benchmarks/stats_query_count.py [N ...]
+"""
+import asyncio
+import os
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from pymongo import monitoring
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+from motor.motor_asyncio import AsyncIOMotorClient  # noqa: E402
+
+HISTORY_DAYS = 90
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "endSessions", "ping", "dropDatabase", "insert"}
+
+
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        if event.command_name not in IGNORED_COMMANDS:
+            self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+async def seed(db, habit_count: int):
+    today = date.today()
+    habits = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Habit {i}",
+            "category": "health",
+            "icon": "🏃",
+            "color": "#000000",
+            "created_at": datetime.utcnow(),
+            "user_id": server.DEFAULT_USER_ID,
+        }
+        for i in range(habit_count)
+    ]
+    await db.habits.insert_many(habits)
+    completions = [
+        {
+            "id": str(uuid.uuid4()),
+            "habit_id": habit["id"],
+            "date": (today - timedelta(days=offset)).isoformat(),
+            "completed": offset % 3 != 0,
+            "user_id": server.DEFAULT_USER_ID,
+        }
+        for habit in habits
+        for offset in range(HISTORY_DAYS)
+    ]
+    await db.habit_completions.insert_many(completions)
+
+
+async def main(sizes):
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"], event_listeners=[counter])
+    db_name = f"{os.environ['DB_NAME']}_bench"
+    server.use_database(client[db_name])
+
+    print(f"{'habits':>8} {'commands':>9} {'ms':>8}")
+    counts = {}
+    try:
+        for size in sizes:
+            await client.drop_database(db_name)
+            await seed(server.db, size)
+            counter.count = 0
+            started = time.perf_counter()
+            await server.compute_habit_stats(server.DEFAULT_USER_ID, date.today())
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            counts[size] = counter.count
+            print(f"{size:>8} {counter.count:>9} {elapsed_ms:>8.1f}")
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+    if len(set(counts.values())) > 1:
+        sys.exit(f"Command count grows with the number of habits: {counts}")
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 500]
+    asyncio.run(main(sizes))
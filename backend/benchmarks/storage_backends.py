@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Compare the storage backends on the repository operations the API uses.
+
+Seeds the same users x habits x days of completions into each backend,
+then times, per call:
+
+- ``list``: one user's habits
+- ``histories``: a user's completion histories over the last 90 days
+- ``by_day``: completed habits per day over the 30-day stats window
+- ``page``: one 366-day page of a habit's completions
+- ``toggle``: one atomic completion write returning the previous flag
+- ``export``: streaming every completion, per 1000 rows
+
+Backends are ``sqlite`` (a temporary file), ``mongomock`` (needs
+mongomock-motor; in-process, so only a sanity check) and ``mongo`` (a
+throwaway ``<DB_NAME>_storage`` database on MONGO_URL).
+
+Usage: python backend/benchmarks/storage_backends.py [--backends sqlite,mongomock,mongo]
+       [--users N] [--habits N] [--days N] [--repeat N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import server  # noqa: E402
+from load_test import seed, seed_documents  # noqa: E402
+from sqlite_repository import SqliteRepository  # noqa: E402
+
+OPERATIONS = ("list", "histories", "by_day", "page", "toggle", "export")
+
+
+async def open_backend(name: str):
+    """Bind the server to a fresh backend; returns its cleanup coroutine function"""
+    if name == "sqlite":
+        workdir = tempfile.TemporaryDirectory()
+        repository = SqliteRepository(os.path.join(workdir.name, "storage.sqlite3"))
+        server.bind_repository(repository)
+
+        async def cleanup():
+            await repository.close()
+            workdir.cleanup()
+    else:
+        if name == "mongomock":
+            import mongomock_motor
+            client = mongomock_motor.AsyncMongoMockClient()
+        else:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+        db_name = f"{os.environ['DB_NAME']}_storage"
+        await client.drop_database(db_name)
+        server.use_database(client[db_name])
+        if name == "mongo":
+            await server.ensure_indexes()
+
+        async def cleanup():
+            await client.drop_database(db_name)
+    return cleanup
+
+
+async def timed(call, repeat: int) -> float:
+    """Median milliseconds per call"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call()
+        samples.append((time.perf_counter() - started) * 1000)
+    return float(np.median(samples))
+
+
+async def measure(name: str, habit_docs, completion_docs, args) -> dict:
+    cleanup = await open_backend(name)
+    repository = server.repository
+    try:
+        await repository.open()
+        started = time.perf_counter()
+        await seed(repository, habit_docs, completion_docs)
+        result = {"seed": (time.perf_counter() - started) * 1000}
+
+        rng = random.Random(args.seed)
+        today = date.today()
+        user_habits = {}
+        for habit in habit_docs:
+            user_habits.setdefault(habit["user_id"], []).append(habit["id"])
+
+        def pick():
+            user_id = rng.choice(list(user_habits))
+            return user_id, user_habits[user_id]
+
+        def pick_habit():
+            user_id, habit_ids = pick()
+            return user_id, rng.choice(habit_ids)
+
+        async def export():
+            async for _ in repository.iter_completions():
+                pass
+
+        calls = {
+            "list": lambda: repository.list_habits(pick()[0]),
+            "histories": lambda: repository.completion_histories(*pick(), today - timedelta(days=89), today),
+            "by_day": lambda: repository.count_completed_by_day(*pick(), today - timedelta(days=29), today),
+            "page": lambda: repository.completion_page(*pick_habit(), None, None, None, 366),
+            "toggle": lambda: repository.set_completion(*pick_habit(), today.isoformat(), rng.random() < 0.5),
+        }
+        for operation, call in calls.items():
+            result[operation] = await timed(call, args.repeat)
+        result["export"] = await timed(export, 3) / max(1, len(completion_docs) / 1000)
+        return result
+    finally:
+        await cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", default="sqlite,mongomock", help="comma-separated: sqlite, mongomock, mongo")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--habits", type=int, default=10, help="habits per user")
+    parser.add_argument("--days", type=int, default=365, help="days of history per habit")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per operation; the median is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    habit_docs, completion_docs = seed_documents(args.users, args.habits, args.days, args.seed)
+    print(f"{len(habit_docs)} habits x {args.days} days = {len(completion_docs)} completions; "
+          f"median ms per call (export: per 1000 rows)\n")
+    print(f"{'backend':<10} {'seed s':>8}" + "".join(f" {operation:>10}" for operation in OPERATIONS))
+    for name in args.backends.split(","):
+        result = asyncio.run(measure(name, habit_docs, completion_docs, args))
+        print(f"{name:<10} {result['seed'] / 1000:>8.1f}"
+              + "".join(f" {result[operation]:>10.2f}" for operation in OPERATIONS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Benchmark the streak engine on short, medium and very long histories.
+
+For each history length it times the calls the API makes:
+
+- ``ordinals``: converting an ISO-keyed completion history to day ordinals
+- ``rebuild``: ``stats_from_history``, one habit's stats from its history
+- ``batch``: ``stats_from_histories``, the vectorized ``batch_runs`` path
+  used for a user's habits at once, per habit
+- ``toggle``: ``apply_completion`` splitting and re-merging a run mid-history
+- ``current``: ``current_streak`` of a stats document
+
+Usage: python backend/benchmarks/streak_engine.py [--habits N]
+"""
+import argparse
+import random
+import sys
+import timeit
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from habit_stats import apply_completion, current_streak, stats_from_histories, stats_from_history  # noqa: E402
+from streaks import completed_ordinals  # noqa: E402
+
+HISTORY_LENGTHS = [10, 1_000, 100_000]
+
+
+def make_history(days: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    start = date.today() - timedelta(days=days - 1)
+    return {(start + timedelta(days=offset)).isoformat(): rng.random() < 0.85 for offset in range(days)}
+
+
+def best_of(statement, number: int) -> float:
+    """Best per-call time in microseconds over a few repeats"""
+    return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--habits", type=int, default=100, help="habits per batch for the NumPy path")
+    args = parser.parse_args()
+
+    today = date.today().toordinal()
+    print(f"{'days':>8} {'ordinals us':>12} {'rebuild us':>11} {'batch us/habit':>15} {'toggle us':>10} "
+          f"{'current us':>11}")
+    for days in HISTORY_LENGTHS:
+        history = make_history(days, seed=days)
+        histories = {f"habit-{i}": make_history(days, seed=days + i) for i in range(args.habits)}
+        stats = stats_from_history("habit", history)
+        # A completed day in the middle of a run: turning it off splits the run, on merges it back
+        middle = next(date_str for date_str, completed in list(history.items())[days // 2:] if completed)
+        number = max(1, 100_000 // days)
+
+        def toggle():
+            apply_completion(stats, middle, True, False)
+            apply_completion(stats, middle, False, True)
+
+        ordinals_us = best_of(lambda: completed_ordinals(history), number)
+        rebuild_us = best_of(lambda: stats_from_history("habit", history), number)
+        batch_us = best_of(lambda: stats_from_histories(histories), max(1, number // args.habits)) / args.habits
+        toggle_us = best_of(toggle, number * 10) / 2
+        current_us = best_of(lambda: current_streak(stats, today), number * 10)
+        print(f"{days:>8} {ordinals_us:>12.1f} {rebuild_us:>11.1f} {batch_us:>15.1f} {toggle_us:>10.1f} "
+              f"{current_us:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
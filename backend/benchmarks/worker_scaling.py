@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""Measure how API throughput scales with the number of worker processes.
+
+Seeds users x habits x days of completions into a throwaway
+``<DB_NAME>_scaling`` database on MONGO_URL, then for each worker count
+starts ``uvicorn server:app --workers N`` against it and drives a mix of
+list, stats and single-habit reads for ``--duration`` seconds from
+``--clients`` load-generator processes. The response cache and background
+jobs are disabled so every request does the full work.
+
+Reports requests per second, p50/p95 latency, the speedup over one worker
+and the scaling efficiency (speedup / workers). The load generators share
+the machine with the workers: keep ``--clients`` well below the core
+count, or point the server at a Mongo on another host, so the numbers
+measure the API rather than contention with the client or the database.
+
+Needs a real MongoDB; mongomock cannot be shared between processes.
+
+Usage: python backend/benchmarks/worker_scaling.py [--workers 1,2,4] [--duration S]
+       [--clients N] [--concurrency N] [--users N] [--habits N] [--days N]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import server  # noqa: E402
+from load_test import seed, seed_documents  # noqa: E402
+
+PORT = 8765
+
+
+def default_worker_counts() -> str:
+    counts, workers = [], 1
+    while workers < multiprocessing.cpu_count():
+        counts.append(workers)
+        workers *= 2
+    return ",".join(map(str, counts + [multiprocessing.cpu_count()]))
+
+
+async def seed_database(db_name: str, args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    await client.drop_database(db_name)
+    server.use_database(client[db_name])
+    await server.ensure_indexes()
+    habit_docs, completion_docs = seed_documents(args.users, args.habits, args.days, args.seed)
+    await seed(server.repository, habit_docs, completion_docs)
+    client.close()
+    return habit_docs
+
+
+async def drop_database(db_name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+    await client.drop_database(db_name)
+    client.close()
+
+
+def start_server(workers: int, db_name: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DB_NAME=db_name,
+        RESPONSE_CACHE_MAX_ENTRIES="0",
+        BACKGROUND_JOBS_INTERVAL_SECONDS="0",
+        PURGE_INTERVAL_SECONDS="0",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(PORT), "--workers", str(workers),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{PORT}/api/", timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server with {workers} worker(s) did not start")
+
+
+async def generate_load(habit_docs, duration: float, concurrency: int, seed: int):
+    """Issue requests for duration seconds; returns latencies and failures"""
+    rng = random.Random(seed)
+    window_start = (date.today() - timedelta(days=90)).isoformat()
+    latencies, failures = [], 0
+    deadline = time.perf_counter() + duration
+
+    def next_url():
+        habit = rng.choice(habit_docs)
+        url = rng.choice((
+            f"/api/habits?from={window_start}",
+            "/api/habits/stats",
+            f"/api/habits/{habit['id']}?from={window_start}",
+        ))
+        return url, {"X-User-Id": habit["user_id"]}
+
+    async def worker(http):
+        nonlocal failures
+        while time.perf_counter() < deadline:
+            url, headers = next_url()
+            started = time.perf_counter()
+            try:
+                response = await http.get(url, headers=headers)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - started)
+            failures += failed
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=30) as http:
+        await asyncio.gather(*(worker(http) for _ in range(concurrency)))
+    return latencies, failures
+
+
+def load_process(habit_docs, duration: float, concurrency: int, seed: int):
+    return asyncio.run(generate_load(habit_docs, duration, concurrency, seed))
+
+
+def measure(habit_docs, args) -> dict:
+    with multiprocessing.Pool(args.clients) as pool:
+        results = pool.starmap(load_process, [
+            (habit_docs, args.duration, args.concurrency, args.seed + client) for client in range(args.clients)
+        ])
+    latencies = np.concatenate([np.array(latencies) for latencies, _ in results]) * 1000
+    p50, p95 = np.percentile(latencies, [50, 95])
+    return {
+        "rps": len(latencies) / args.duration,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "failures": sum(failures for _, failures in results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default=default_worker_counts(), help="comma-separated worker counts")
+    parser.add_argument("--duration", type=float, default=15, help="seconds of load per worker count")
+    parser.add_argument("--clients", type=int, default=max(1, multiprocessing.cpu_count() // 4),
+                        help="load-generator processes")
+    parser.add_argument("--concurrency", type=int, default=32, help="requests in flight per load generator")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--habits", type=int, default=10, help="habits per user")
+    parser.add_argument("--days", type=int, default=365, help="days of history per habit")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    worker_counts = [int(count) for count in args.workers.split(",")]
+
+    db_name = f"{os.environ['DB_NAME']}_scaling"
+    habit_docs = asyncio.run(seed_database(db_name, args))
+    habit_docs = [{"id": habit["id"], "user_id": habit["user_id"]} for habit in habit_docs]
+    print(f"Seeded {len(habit_docs)} habits x {args.days} days; {args.clients} client process(es) "
+          f"x {args.concurrency} in flight, {args.duration:.0f}s per run\n")
+
+    print(f"{'workers':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8} {'efficiency':>10} {'fail':>5}")
+    baseline = None
+    try:
+        for workers in worker_counts:
+            process = start_server(workers, db_name)
+            try:
+                result = measure(habit_docs, args)
+            finally:
+                process.terminate()
+                process.wait()
+            baseline = baseline or result["rps"]
+            speedup = result["rps"] / baseline
+            print(f"{workers:>7} {result['rps']:>9.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                  f"{speedup:>7.2f}x {speedup / workers * worker_counts[0]:>9.0%} {result['failures']:>5}")
+    finally:
+        asyncio.run(drop_database(db_name))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Bitmap storage format for completion history.
+
+Each habit has one document per calendar year in ``habit_completion_bitmaps``:
+
+    {"habit_id": ..., "user_id": ..., "year": 2025,
+     "recorded": {"1": <int>, ..., "12": <int>},
+     "completed": {"1": <int>, ..., "12": <int>}}
+
+Month keys map to 31-bit integers where bit ``day - 1`` is set when the day
+has a record (``recorded``) and when it was completed (``completed``). A
+recorded day without its completed bit is an explicit "not completed".
+Toggles are single ``$bit`` updates, and a calendar year is one document.
+"""
+from datetime import date
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+def bitmap_position(date_str: str) -> Tuple[int, str, int]:
+    """Year, month key and bit mask of an ISO date"""
+    day = date.fromisoformat(date_str)
+    return day.year, str(day.month), 1 << (day.day - 1)
+
+
+def bitmap_update(date_str: str, completed: bool) -> Tuple[int, Dict]:
+    """Year and $bit update document that record one day's completion"""
+    year, month, mask = bitmap_position(date_str)
+    completed_op = {"or": mask} if completed else {"and": ~mask}
+    return year, {"$bit": {f"recorded.{month}": {"or": mask}, f"completed.{month}": completed_op}}
+
+
+def bitmap_value(bitmap: Optional[Dict], date_str: str) -> Optional[bool]:
+    """A day's completed flag in a bitmap document, or None if unrecorded"""
+    if not bitmap:
+        return None
+    _, month, mask = bitmap_position(date_str)
+    if not bitmap.get("recorded", {}).get(month, 0) & mask:
+        return None
+    return bool(bitmap.get("completed", {}).get(month, 0) & mask)
+
+
+def iter_bitmap_days(bitmap: Dict) -> Iterator[Tuple[str, bool]]:
+    """Yield (ISO date, completed) for every recorded day, in date order"""
+    year = bitmap["year"]
+    recorded = bitmap.get("recorded", {})
+    completed = bitmap.get("completed", {})
+    for month in range(1, 13):
+        recorded_bits = recorded.get(str(month), 0)
+        completed_bits = completed.get(str(month), 0)
+        while recorded_bits:
+            low_bit = recorded_bits & -recorded_bits
+            day = low_bit.bit_length()
+            yield date(year, month, day).isoformat(), bool(completed_bits & low_bit)
+            recorded_bits ^= low_bit
+
+
+def completed_days_between(bitmap: Dict, start: date, end: date) -> Iterator[str]:
+    """Yield the ISO dates of completed days within [start, end]"""
+    start_str, end_str = start.isoformat(), end.isoformat()
+    for date_str, completed in iter_bitmap_days(bitmap):
+        if completed and start_str <= date_str <= end_str:
+            yield date_str
+
+
+def completed_day_offsets(bitmaps: Iterable[Tuple[int, Dict]], start: date, end: date):
+    """(row, day offset from start) arrays of the completed days within [start, end]
+
+    bitmaps are (row, bitmap document) pairs. Months are decoded whole
+    with NumPy rather than bit by bit, so a year of days costs twelve
+    integers per habit.
+    """
+    import numpy as np
+
+    start_ordinal = start.toordinal()
+    rows, month_offsets, completed_bits = [], [], []
+    for row, bitmap in bitmaps:
+        for month, bits in bitmap.get("completed", {}).items():
+            if bits:
+                rows.append(row)
+                month_offsets.append(date(bitmap["year"], int(month), 1).toordinal() - start_ordinal)
+                completed_bits.append(bits)
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    month_index, day = np.nonzero((np.array(completed_bits, dtype=np.int64)[:, None] >> np.arange(31)) & 1)
+    day_offset = np.array(month_offsets, dtype=np.int64)[month_index] + day
+    inside = (day_offset >= 0) & (day_offset <= end.toordinal() - start_ordinal)
+    return np.array(rows, dtype=np.int64)[month_index][inside], day_offset[inside]
+
+
+def encode_history(completions: Iterable[Tuple[str, bool]]) -> Dict[int, Dict]:
+    """Pack (ISO date, completed) pairs into recorded/completed masks per year"""
+    years: Dict[int, Dict] = {}
+    for date_str, completed in completions:
+        year, month, mask = bitmap_position(date_str)
+        bitmap = years.setdefault(year, {"recorded": {}, "completed": {}})
+        bitmap["recorded"][month] = bitmap["recorded"].get(month, 0) | mask
+        bitmap["completed"][month] = bitmap["completed"].get(month, 0) | (mask if completed else 0)
+    return years
+
+
+def window_years(start: date, end: date) -> list:
+    """Calendar years touched by the date window [start, end]"""
+    return list(range(start.year, end.year + 1))
@@ -0,0 +1,90 @@
+"""Streaming encoders for habit and completion exports.
+
+Rows arrive from an async iterator over a Mongo cursor and leave in
+batches. NDJSON and CSV are produced as byte chunks for a streaming
+response or a file; Parquet is written one row group per batch. Only one
+batch is held in memory at a time, whatever the size of the export.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List
+
+EXPORT_COLUMNS = {
+    "habits": ["id", "user_id", "name", "description", "category", "icon", "color", "created_at"],
+    "completions": ["user_id", "habit_id", "date", "completed"],
+}
+EXPORT_FORMATS = ("ndjson", "csv", "parquet")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def encode_value(value):
+    """JSON/CSV-friendly form of a stored value"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+async def batched(rows: AsyncIterator[Dict], size: int) -> AsyncIterator[List[Dict]]:
+    """Group an async row iterator into lists of at most size rows"""
+    batch = []
+    async for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def ndjson_chunks(rows: AsyncIterator[Dict], columns: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    """Encode rows as NDJSON, one chunk per batch"""
+    async for batch in batched(rows, batch_size):
+        yield "".join(
+            json.dumps({column: encode_value(row.get(column)) for column in columns}, ensure_ascii=False) + "\n"
+            for row in batch
+        ).encode()
+
+
+async def csv_chunks(rows: AsyncIterator[Dict], columns: List[str], batch_size: int) -> AsyncIterator[bytes]:
+    """Encode rows as CSV with a header line, one chunk per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue().encode()
+    async for batch in batched(rows, batch_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([encode_value(row.get(column)) for column in columns] for row in batch)
+        yield buffer.getvalue().encode()
+
+
+def parquet_schema(dataset: str):
+    import pyarrow as pa
+
+    types = {"created_at": pa.timestamp("ms"), "date": pa.date32(), "completed": pa.bool_()}
+    return pa.schema([(column, types.get(column, pa.string())) for column in EXPORT_COLUMNS[dataset]])
+
+
+async def write_parquet(rows: AsyncIterator[Dict], dataset: str, path: str, batch_size: int) -> int:
+    """Write rows to a Parquet file, one row group per batch; returns the row count"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow (pip install pyarrow)")
+
+    schema = parquet_schema(dataset)
+    written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        async for batch in batched(rows, batch_size):
+            columns = {}
+            for field in schema:
+                values = [row.get(field.name) for row in batch]
+                if field.type == pa.date32():
+                    values = [date.fromisoformat(value) if isinstance(value, str) else value for value in values]
+                columns[field.name] = pa.array(values, type=field.type)
+            writer.write_table(pa.table(columns, schema=schema))
+            written += len(batch)
+    return written
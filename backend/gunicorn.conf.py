@@ -0,0 +1,42 @@
+"""Gunicorn settings for serving the API with several worker processes.
+
+    cd backend && gunicorn -c gunicorn.conf.py server:app
+
+or ``python manage.py serve``, which uses these settings when gunicorn is
+installed and falls back to uvicorn's own worker manager otherwise.
+
+Each worker is a separate process with its own event loop, Mongo client
+and connection pool, opened by the app's lifespan handler after the fork;
+preloading the app is therefore safe and shares the imported modules
+between workers. A deployment holds up to WEB_CONCURRENCY x
+MONGO_MAX_POOL_SIZE connections, which must fit the server's limit.
+
+A new worker warms up in the background (storage connections, NumPy and
+the analytics modules, per-process caches) before GET /ready passes;
+point the readiness probe at /ready and the liveness probe at /health.
+
+With several workers, set RESPONSE_CACHE_BACKEND=mongo and
+LIVE_UPDATES_BACKEND=mongo so cache invalidation and live events reach
+every worker, and IDEMPOTENCY_BACKEND=mongo so a retried write is
+recognized whichever worker it lands on. Background jobs run in each
+worker; they are idempotent.
+
+Environment: WEB_CONCURRENCY (workers, default: one per CPU), HOST, PORT,
+GUNICORN_TIMEOUT.
+"""
+import multiprocessing
+import os
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '8001')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to bound memory growth; jittered so they do not restart together
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
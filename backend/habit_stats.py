@@ -0,0 +1,135 @@
+"""Materialized per-habit stats, maintained incrementally.
+
+A stats document summarizes a habit's completion history as counters plus
+the sorted list of completed runs, each stored as ``[start, end]`` day
+ordinals (``date.toordinal()``, both ends inclusive). A toggle updates
+only the run it touches: extending the last run is O(1), and toggling a
+day in the middle merges or splits a single run.
+"""
+from bisect import bisect_right
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+from streaks import batch_runs, completed_ordinals, completed_runs, current_run_length, rate
+
+
+def day_ordinal(date_str: str) -> int:
+    """Ordinal of an ISO date string"""
+    return date.fromisoformat(date_str).toordinal()
+
+
+def empty_stats(habit_id: str, user_id: str = "default") -> Dict:
+    """Stats document for a habit with no recorded days"""
+    return {
+        "habit_id": habit_id,
+        "user_id": user_id,
+        "total_days": 0,
+        "completed_days": 0,
+        "best_streak": 0,
+        "runs": [],
+        "version": 0,
+    }
+
+
+def stats_from_runs(habit_id: str, runs: Sequence[Sequence[int]], total_days: int,
+                    completed_days: int, user_id: str = "default") -> Dict:
+    """Build a stats document from precomputed completed runs"""
+    stats = empty_stats(habit_id, user_id)
+    stats["total_days"] = total_days
+    stats["completed_days"] = completed_days
+    stats["runs"] = [[int(start), int(end)] for start, end in runs]
+    stats["best_streak"] = max((end - start + 1 for start, end in stats["runs"]), default=0)
+    return stats
+
+
+def stats_from_history(habit_id: str, completion_history: Dict[str, bool], user_id: str = "default") -> Dict:
+    """Build a stats document from a full completion history"""
+    days = completed_ordinals(completion_history)
+    return stats_from_runs(habit_id, completed_runs(days), len(completion_history), len(days), user_id)
+
+
+def stats_from_histories(histories: Dict[str, Dict[str, bool]], user_id: str = "default") -> List[Dict]:
+    """Build stats documents for many habits with the vectorized run finder"""
+    habit_ids = list(histories)
+    day_arrays = [completed_ordinals(histories[habit_id]) for habit_id in habit_ids]
+    return [
+        stats_from_runs(habit_id, runs, len(histories[habit_id]), len(days), user_id)
+        for habit_id, days, runs in zip(habit_ids, day_arrays, batch_runs(day_arrays))
+    ]
+
+
+def _add_day(stats: Dict, day: int):
+    runs = stats["runs"]
+    # Fast path: extending (or starting after) the most recent run
+    if not runs or day > runs[-1][1]:
+        if runs and runs[-1][1] == day - 1:
+            runs[-1][1] = day
+        else:
+            runs.append([day, day])
+        stats["best_streak"] = max(stats["best_streak"], runs[-1][1] - runs[-1][0] + 1)
+        return
+
+    position = bisect_right(runs, [day, float("inf")])
+    left = runs[position - 1] if position > 0 else None
+    right = runs[position] if position < len(runs) else None
+    if left and left[0] <= day <= left[1]:
+        return
+    joins_left = left is not None and left[1] == day - 1
+    joins_right = right is not None and right[0] == day + 1
+    if joins_left and joins_right:
+        left[1] = right[1]
+        del runs[position]
+        run = left
+    elif joins_left:
+        left[1] = day
+        run = left
+    elif joins_right:
+        right[0] = day
+        run = right
+    else:
+        run = [day, day]
+        runs.insert(position, run)
+    stats["best_streak"] = max(stats["best_streak"], run[1] - run[0] + 1)
+
+
+def _remove_day(stats: Dict, day: int):
+    runs = stats["runs"]
+    position = bisect_right(runs, [day, float("inf")]) - 1
+    if position < 0 or not runs[position][0] <= day <= runs[position][1]:
+        return
+    start, end = runs[position]
+    pieces = [piece for piece in ([start, day - 1], [day + 1, end]) if piece[0] <= piece[1]]
+    runs[position:position + 1] = pieces
+    if end - start + 1 == stats["best_streak"]:
+        stats["best_streak"] = max((e - s + 1 for s, e in runs), default=0)
+
+
+def apply_completion(stats: Dict, date_str: str, previous: Optional[bool], completed: bool) -> Dict:
+    """Apply one completion toggle to a stats document in place
+
+    ``previous`` is the day's completed flag before the write, or None if
+    the day had no record.
+    """
+    day = day_ordinal(date_str)
+    if previous is None:
+        stats["total_days"] += 1
+    elif previous == completed:
+        return stats
+
+    if completed:
+        stats["completed_days"] += 1
+        _add_day(stats, day)
+    elif previous:
+        stats["completed_days"] -= 1
+        _remove_day(stats, day)
+    return stats
+
+
+def current_streak(stats: Dict, today: int) -> int:
+    """Length of the completed run ending today (or yesterday)"""
+    return current_run_length(stats["runs"], today)
+
+
+def completion_rate(stats: Dict) -> int:
+    """Completed days as a whole-number percentage of recorded days"""
+    return rate(stats["completed_days"], stats["total_days"])
@@ -0,0 +1,184 @@
+"""Idempotency keys and coalescing of concurrent writes.
+
+``IdempotencyStore`` remembers the response to each request sent with an
+``Idempotency-Key`` header, per user, so a client retrying after a lost
+response gets the original response back instead of writing again. A
+request arriving while the first one with its key is still running
+waits for that one's response. Reusing a key for a different request is
+rejected. Only successful responses are stored; a failed request can be
+retried with the same key.
+
+Responses are kept in a record backend. ``LocalRecords`` keeps them in
+this process in an LRU bounded by entry count and TTL. ``MongoRecords``
+keeps them in a collection with a TTL index, so a retry that lands on
+another worker is still recognized.
+
+``WriteCoalescer`` merges concurrent writes to the same key: while one
+write is in flight, later callers only leave their value, and a single
+follow-up write applies the last value left, skipped when it matches
+the value just written. Every caller receives the result of the final
+write, so all of them see the last write win.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional, Tuple
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    body: bytes
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different fingerprint"""
+
+
+class LocalRecords:
+    """Stored responses in this process, bounded by entry count and TTL"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 86400):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, Tuple[StoredResponse, float]]" = OrderedDict()
+
+    async def get(self, user_id: str, key: str) -> Optional[StoredResponse]:
+        entry = self._entries.get((user_id, key))
+        if entry is None:
+            return None
+        response, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[(user_id, key)]
+            return None
+        return response
+
+    async def put(self, user_id: str, key: str, response: StoredResponse):
+        # Entries are evicted oldest first: a retry comes soon after its original
+        self._entries[(user_id, key)] = (response, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end((user_id, key))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class MongoRecords:
+    """Stored responses in a Mongo collection, shared by all workers
+
+    The collection's TTL index on created_at removes old records; reads
+    also skip records past ttl_seconds, since the TTL monitor runs only
+    once a minute.
+    """
+
+    def __init__(self, collection, ttl_seconds: float = 86400):
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, user_id: str, key: str) -> Optional[StoredResponse]:
+        doc = await self.collection.find_one({
+            "user_id": user_id, "key": key,
+            "created_at": {"$gt": datetime.utcnow() - timedelta(seconds=self.ttl_seconds)}
+        })
+        if doc is None:
+            return None
+        return StoredResponse(doc["fingerprint"], doc["status_code"], bytes(doc["body"]))
+
+    async def put(self, user_id: str, key: str, response: StoredResponse):
+        # The first response stored under a key stays the one replayed
+        await self.collection.update_one(
+            {"user_id": user_id, "key": key},
+            {"$setOnInsert": {**response._asdict(), "created_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+
+class IdempotencyStore:
+    """Replays stored responses and joins requests in flight under the same key
+
+    The handler runs in its own task, so a caller that disconnects does
+    not cancel it for the requests waiting on it.
+    """
+
+    def __init__(self, records=None):
+        self.records = records or LocalRecords()
+        self._in_flight: Dict[tuple, Tuple[str, asyncio.Task]] = {}
+
+    async def run(self, user_id: str, key: str, fingerprint: str,
+                  handler: Callable[[], Awaitable[Tuple[int, bytes]]]) -> Tuple[StoredResponse, bool]:
+        """The response for a keyed request, running handler only for a new key
+
+        handler returns (status code, body). Returns the response and
+        whether it was replayed rather than produced by this call. Raises
+        IdempotencyKeyReused when the key belongs to a different request.
+        """
+        if (user_id, key) not in self._in_flight:
+            stored = await self.records.get(user_id, key)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    raise IdempotencyKeyReused(key)
+                return stored, True
+
+        # Checked after the lookup: another request may have started meanwhile
+        in_flight = self._in_flight.get((user_id, key))
+        if in_flight is not None:
+            if in_flight[0] != fingerprint:
+                raise IdempotencyKeyReused(key)
+            return await asyncio.shield(in_flight[1]), True
+
+        task = asyncio.create_task(self._handle(user_id, key, fingerprint, handler))
+        self._in_flight[(user_id, key)] = (fingerprint, task)
+        return await asyncio.shield(task), False
+
+    async def _handle(self, user_id: str, key: str, fingerprint: str, handler) -> StoredResponse:
+        try:
+            status_code, body = await handler()
+            response = StoredResponse(fingerprint, status_code, body)
+            if 200 <= status_code < 300:
+                await self.records.put(user_id, key, response)
+            return response
+        finally:
+            del self._in_flight[(user_id, key)]
+
+
+class _PendingWrite:
+    def __init__(self, value: Any):
+        self.value = value
+        self.task: Optional[asyncio.Task] = None
+
+
+_NOTHING_WRITTEN = object()
+
+
+class WriteCoalescer:
+    """Concurrent writes to the same key share as few writes as possible, last write wins
+
+    Writes run in their own task: a cancelled caller neither cancels the
+    write nor drops the values other callers left for it.
+    """
+
+    def __init__(self):
+        self._pending: Dict[Hashable, _PendingWrite] = {}
+
+    async def submit(self, key: Hashable, value: Any, write: Callable[[Any], Awaitable]) -> Any:
+        """Write value under key, or leave it for the write already in flight
+
+        Returns the result of the last write made for the key while this
+        call was waiting.
+        """
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingWrite(value)
+            pending.task = asyncio.create_task(self._write_latest(key, pending, write))
+        else:
+            pending.value = value
+        return await asyncio.shield(pending.task)
+
+    async def _write_latest(self, key: Hashable, pending: _PendingWrite, write) -> Any:
+        try:
+            written = _NOTHING_WRITTEN
+            while pending.value != written:
+                written = pending.value
+                result = await write(written)
+            return result
+        finally:
+            del self._pending[key]
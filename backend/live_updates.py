@@ -0,0 +1,108 @@
+"""Live habit events fanned out to connected clients.
+
+Each connected client holds a bounded ``asyncio.Queue`` registered under
+its user. Publishing an event puts it on every queue of that user; a
+client that falls behind loses its oldest events rather than blocking the
+writer or growing without bound.
+
+``EventBroker`` delivers events within this process. ``ChangeStreamBroker``
+writes events to a Mongo collection instead and delivers them from a
+change stream on that collection, so clients connected to any worker see
+writes made by every worker. Change streams require a replica set.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class EventBroker:
+    """Per-user fan-out of events to subscriber queues in this process"""
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[user_id]
+
+    def subscriber_count(self, user_id: Optional[str] = None) -> int:
+        if user_id is not None:
+            return len(self._subscribers.get(user_id, ()))
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def deliver(self, user_id: str, event: Dict):
+        """Put an event on every queue of the user, dropping the oldest when full"""
+        for queue in self._subscribers.get(user_id, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def publish(self, user_id: str, event: Dict):
+        self.deliver(user_id, event)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class ChangeStreamBroker(EventBroker):
+    """Events shared by all workers through a Mongo change stream"""
+
+    RETRY_SECONDS = 5
+
+    def __init__(self, collection, queue_size: int = 100):
+        super().__init__(queue_size)
+        self.collection = collection
+        self._task: Optional[asyncio.Task] = None
+
+    async def publish(self, user_id: str, event: Dict):
+        # Delivered to local subscribers by the change stream, like any other worker's
+        await self.collection.insert_one({"user_id": user_id, "event": event, "created_at": datetime.utcnow()})
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        resume_token = None
+        while True:
+            try:
+                async with self.collection.watch(
+                    [{"$match": {"operationType": "insert"}}], resume_after=resume_token
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change["fullDocument"]
+                        self.deliver(document["user_id"], document["event"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                # The driver already resumed what it could; start again from now
+                logger.error(f"Live update change stream failed, retrying: {error}")
+                resume_token = None
+                await asyncio.sleep(self.RETRY_SECONDS)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Maintenance commands for the habit tracker database.
+
+Usage: python manage.py --help
+"""
+import asyncio
+import multiprocessing
+import os
+import shutil
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+import typer
+
+import exports
+import server
+
+cli = typer.Typer(help="Habit tracker maintenance commands", no_args_is_help=True)
+
+
+def run_with_storage(coroutine):
+    """Run a command's coroutine with the storage open and, on Mongo, indexed"""
+    async def run():
+        await server.repository.open()
+        try:
+            if server.db is not None:
+                # Leases and upserts rely on the unique indexes
+                await server.ensure_indexes()
+            return await coroutine
+        finally:
+            await server.repository.close()
+    return asyncio.run(run())
+
+
+def require_mongo(command: str):
+    if server.STORAGE_BACKEND != "mongo":
+        typer.echo(f"{command} needs STORAGE_BACKEND=mongo", err=True)
+        raise typer.Exit(1)
+
+
+@cli.callback()
+def main(ctx: typer.Context):
+    """Habit tracker maintenance commands"""
+    if ctx.invoked_subcommand != "serve":
+        server.connect_db()
+
+
+@cli.command("serve")
+def serve(
+    workers: int = typer.Option(int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count())),
+                                help="Worker processes; defaults to WEB_CONCURRENCY or one per CPU"),
+    host: str = typer.Option(os.environ.get("HOST", "0.0.0.0")),
+    port: int = typer.Option(int(os.environ.get("PORT", 8001))),
+):
+    """Serve the API with several worker processes
+    
+    Runs gunicorn with gunicorn.conf.py when it is installed, otherwise
+    uvicorn's worker manager. Each worker opens its own Mongo pool or
+    SQLite connection.
+    """
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    gunicorn = shutil.which("gunicorn")
+    if gunicorn:
+        os.execv(gunicorn, [gunicorn, "-c", "gunicorn.conf.py", "--workers", str(workers),
+                            "--bind", f"{host}:{port}", "server:app"])
+
+    import uvicorn
+    uvicorn.run("server:app", host=host, port=port, workers=workers)
+
+
+@cli.command("rebuild-stats")
+def rebuild_stats(
+    habit_id: Optional[List[str]] = typer.Option(None, "--habit-id", help="Habit to rebuild; repeatable. Defaults to all habits."),
+):
+    """Recompute materialized habit stats from the completion history"""
+    rebuilt = run_with_storage(server.rebuild_stats_for_habits(list(habit_id or []) or None))
+    typer.echo(f"Rebuilt stats for {rebuilt} habit(s)")
+
+
+@cli.command("migrate-to-bitmaps")
+def migrate_to_bitmaps(
+    batch_size: int = typer.Option(500, help="Bitmap documents per bulk write"),
+):
+    """Copy habit_completions into per-year bitmap documents"""
+    require_mongo("migrate-to-bitmaps")
+    written = run_with_storage(server.migrate_completions_to_bitmaps(batch_size))
+    typer.echo(f"Wrote {written} bitmap document(s); set COMPLETION_STORAGE=bitmap to read from them")
+
+
+@cli.command("rollup")
+def rollup():
+    """Run one pass of the background jobs: daily summaries, streak resets and badge awards"""
+    result = run_with_storage(server.run_daily_rollups())
+    typer.echo(f"Rolled up {result['rolled_up']} of {result['users']} user(s)")
+
+
+@cli.command("purge")
+def purge():
+    """Purge deleted habits and accounts now, resuming interrupted purges"""
+    finished = run_with_storage(server.run_purges())
+    typer.echo(f"Finished {finished} purge(s)")
+
+
+@cli.command("export")
+def export(
+    dataset: str = typer.Argument(..., help="habits or completions"),
+    output: str = typer.Option("-", "--output", "-o", help="File to write; - for stdout (ndjson/csv only)"),
+    export_format: str = typer.Option("ndjson", "--format", help="ndjson, csv or parquet"),
+    user_id: Optional[str] = typer.Option(None, help="Export one user; defaults to every user"),
+    from_date: Optional[datetime] = typer.Option(None, "--from", formats=["%Y-%m-%d"], help="First completion date"),
+    to_date: Optional[datetime] = typer.Option(None, "--to", formats=["%Y-%m-%d"], help="Last completion date"),
+    batch_size: int = typer.Option(server.EXPORT_BATCH_SIZE, help="Rows per cursor batch and Parquet row group"),
+):
+    """Stream habits or completions to NDJSON, CSV or Parquet"""
+    if dataset not in exports.EXPORT_COLUMNS:
+        raise typer.BadParameter(f"unknown dataset {dataset!r}", param_hint="DATASET")
+    if export_format not in exports.EXPORT_FORMATS:
+        raise typer.BadParameter("must be ndjson, csv or parquet", param_hint="--format")
+    if export_format == "parquet" and output == "-":
+        raise typer.BadParameter("parquet needs a file", param_hint="--output")
+
+    async def write_rows():
+        rows = server.export_rows(
+            dataset, user_id, from_date and from_date.date(), to_date and to_date.date(), batch_size
+        )
+        if export_format == "parquet":
+            return await exports.write_parquet(rows, dataset, output, batch_size)
+
+        written = 0
+
+        async def counted():
+            nonlocal written
+            async for row in rows:
+                written += 1
+                yield row
+
+        encode = exports.ndjson_chunks if export_format == "ndjson" else exports.csv_chunks
+        stream = sys.stdout.buffer if output == "-" else open(output, "wb")
+        try:
+            async for chunk in encode(counted(), exports.EXPORT_COLUMNS[dataset], batch_size):
+                stream.write(chunk)
+        finally:
+            if stream is not sys.stdout.buffer:
+                stream.close()
+        return written
+
+    written = run_with_storage(write_rows())
+    typer.echo(f"Exported {written} {dataset} row(s)", err=True)
+
+
+if __name__ == "__main__":
+    cli()
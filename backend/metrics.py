@@ -0,0 +1,182 @@
+"""Per-request latency, Mongo command and response size metrics.
+
+``MetricsMiddleware`` times every HTTP request and counts the bytes of its
+response body. ``MongoCommandListener`` is registered on the Mongo client
+and attributes each command to the request that issued it through a
+context variable; Motor copies the context into its executor threads, so
+commands run on behalf of a request land in that request's
+``RequestStats``.
+
+Histograms are labelled by method and route template (``/api/habits/{habit_id}``,
+not the raw path) and rendered in the Prometheus text format by
+``MetricsRegistry.render``.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class RequestStats:
+    """Mongo commands and response bytes of one request"""
+
+    def __init__(self):
+        self.commands: List[Tuple[str, str, float]] = []
+        self.pending: Dict[int, Tuple[str, str]] = {}
+        self.command_count = 0
+        self.response_bytes = 0
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Record Mongo commands against the request that issued them"""
+
+    def started(self, event):
+        stats = current_request.get()
+        if stats is None:
+            return
+        target = event.command.get(event.command_name)
+        stats.command_count += 1
+        stats.pending[event.request_id] = (event.command_name, target if isinstance(target, str) else "")
+
+    def _finished(self, event):
+        stats = current_request.get()
+        if stats is None:
+            return
+        command = stats.pending.pop(event.request_id, None)
+        if command is not None:
+            stats.commands.append((*command, event.duration_micros / 1000))
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values"""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[tuple, list] = {}
+
+    def observe(self, labels: tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            # Per-bucket counts, then sum and count
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            label_text = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label_text}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label_text}}} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """The request histograms exposed on /metrics"""
+
+    def __init__(self):
+        self.latency = Histogram(
+            "http_request_duration_seconds", "Request latency until the last response byte.",
+            ("method", "route", "status"), LATENCY_BUCKETS
+        )
+        self.mongo_commands = Histogram(
+            "http_request_mongo_commands", "Mongo commands issued per request.",
+            ("method", "route"), COMMAND_BUCKETS
+        )
+        self.response_bytes = Histogram(
+            "http_response_bytes", "Serialized response body size.",
+            ("method", "route"), BYTE_BUCKETS
+        )
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        self.latency.observe((method, route, str(status)), seconds)
+        self.mongo_commands.observe((method, route), stats.command_count)
+        self.response_bytes.observe((method, route), stats.response_bytes)
+
+    def render(self) -> str:
+        lines = []
+        for histogram in (self.latency, self.mongo_commands, self.response_bytes):
+            lines.extend(histogram.render())
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request metrics and logging slow requests
+
+    With ``slow_request_seconds`` set, requests slower than it are logged
+    with the Mongo commands they issued.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry, slow_request_seconds: Optional[float] = None):
+        self.app = app
+        self.registry = registry
+        self.slow_request_seconds = slow_request_seconds
+        self._route_paths: Optional[Dict] = None
+
+    def route_template(self, scope) -> str:
+        if self._route_paths is None:
+            self._route_paths = {
+                route.endpoint: route.path for route in scope["app"].routes if hasattr(route, "endpoint")
+            }
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                stats.response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            route = self.route_template(scope)
+            self.registry.observe(scope["method"], route, status, elapsed, stats)
+            if self.slow_request_seconds is not None and elapsed >= self.slow_request_seconds:
+                commands = "".join(f"\n  {name} {target} {ms:.1f}ms" for name, target, ms in stats.commands)
+                logger.warning(
+                    f"Slow request {scope['method']} {scope['path']} ({route}) {elapsed * 1000:.0f}ms, "
+                    f"{stats.command_count} Mongo command(s), {stats.response_bytes} bytes{commands}"
+                )
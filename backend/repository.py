@@ -0,0 +1,770 @@
+"""Storage of habits, completions, materialized stats and user settings.
+
+Route handlers read and write through a repository rather than issuing
+queries themselves, so the API runs on either backend:
+
+- ``MongoRepository``: Motor, with completions kept as one document per
+  habit-day or packed into per-year bitmaps (see completion_bitmaps.py)
+- ``SqliteRepository`` (sqlite_repository.py): one local database file,
+  for single-node deployments, edge installs and benchmarks without a
+  database server
+
+Values cross the interface as plain dicts in the shape of the Mongo
+documents, with dates as ISO strings. Habit reads only return habits that
+have not been deleted. Methods taking ``analytics=True`` may read from a
+replica that lags the primary.
+"""
+import abc
+import asyncio
+import uuid
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+from pymongo import ASCENDING, ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from completion_bitmaps import (
+    bitmap_update, bitmap_value, completed_day_offsets, completed_days_between, iter_bitmap_days, window_years
+)
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Matches habits that have not been deleted; deleted ones keep deleted_at
+# until they are purged
+ACTIVE_HABIT = {"deleted_at": None}
+
+# Collections a Mongo purge job works through, in order
+PURGE_STAGES = ('habit_completions', 'habit_completion_bitmaps', 'habit_stats', 'badge_awards',
+                'daily_summaries', 'user_rollups', 'user_settings', 'habits')
+
+
+def purge_filter(purge: Dict, collection_name: str) -> Optional[Dict]:
+    """Documents a purge removes from a collection, or None to skip it"""
+    user_id = purge['user_id']
+    if collection_name == 'habits':
+        return {"user_id": user_id, "id": {"$in": purge['habit_ids']}, "deleted_at": {"$ne": None}}
+    if collection_name == 'daily_summaries':
+        # Summaries counted the deleted habits; they are rolled up again
+        return {"user_id": user_id}
+    if collection_name in ('user_rollups', 'user_settings'):
+        return {"user_id": user_id} if purge['whole_user'] else None
+    return {"user_id": user_id, "habit_id": {"$in": purge['habit_ids']}}
+
+
+def purge_progress(purge: Dict) -> Tuple[int, int]:
+    """(stages done, stages in total) of a purge job"""
+    stages = [name for name in PURGE_STAGES if purge_filter(purge, name) is not None]
+    if purge['status'] == 'done':
+        return len(stages), len(stages)
+    return (stages.index(purge['stage']) if purge['stage'] in stages else 0), len(stages)
+
+
+def completion_date_key(value) -> str:
+    """Normalize a stored completion date to its ISO string form"""
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    return str(value)
+
+
+def date_range_filter(start: Optional[date], end: Optional[date], after: Optional[str] = None) -> Dict:
+    """Mongo filter on the ISO date field for a window and pagination cursor"""
+    bounds = {}
+    if start:
+        bounds["$gte"] = start.isoformat()
+    if end:
+        bounds["$lte"] = end.isoformat()
+    if after:
+        bounds["$gt"] = after
+    return {"date": bounds} if bounds else {}
+
+
+def in_window(date_str: str, start: Optional[date], end: Optional[date]) -> bool:
+    """Whether an ISO date falls within the optional [start, end] window"""
+    return (not start or date_str >= start.isoformat()) and (not end or date_str <= end.isoformat())
+
+
+class Repository(abc.ABC):
+    """Interface shared by the storage backends"""
+
+    async def open(self):
+        """Prepare the storage; safe to run on every startup"""
+
+    async def close(self):
+        """Release connections"""
+
+    @abc.abstractmethod
+    async def ping(self):
+        """One round trip to the storage; raises if it cannot be reached"""
+
+    # Habits
+    @abc.abstractmethod
+    async def list_habits(self, user_id: str, habit_ids: Optional[Sequence[str]] = None,
+                          fields: Optional[Sequence[str]] = None, analytics: bool = False) -> List[Dict]:
+        """The user's habits, optionally only habit_ids and only some fields, in creation order"""
+
+    @abc.abstractmethod
+    async def find_habit(self, user_id: str, habit_id: str) -> Optional[Dict]:
+        ...
+
+    @abc.abstractmethod
+    async def insert_habit(self, habit: Dict):
+        ...
+
+    @abc.abstractmethod
+    async def update_habit(self, user_id: str, habit_id: str, changes: Dict) -> bool:
+        ...
+
+    @abc.abstractmethod
+    async def delete_habits(self, user_id: str, habit_ids: Sequence[str], deleted_at: datetime) -> int:
+        """Mark habits deleted, hiding them from every read; returns how many were active"""
+
+    @abc.abstractmethod
+    def iter_habit_owners(self, habit_ids: Optional[Sequence[str]] = None) -> AsyncIterator[Tuple[str, str]]:
+        """(user_id, habit_id) of active habits, or only habit_ids, ordered by user"""
+
+    @abc.abstractmethod
+    def iter_habits(self, user_id: Optional[str] = None, batch_size: int = 1000) -> AsyncIterator[Dict]:
+        """Active habits of one user, or of every user, by user and id"""
+
+    @abc.abstractmethod
+    async def list_user_ids(self) -> List[str]:
+        """Users with at least one active habit"""
+
+    # Completions
+    @abc.abstractmethod
+    async def completion_histories(self, user_id: str, habit_ids: Sequence[str], start: Optional[date] = None,
+                                   end: Optional[date] = None) -> Dict[str, Dict[str, bool]]:
+        """{habit_id: {date: completed}} within [start, end], each in date order"""
+
+    @abc.abstractmethod
+    async def completion_page(self, user_id: str, habit_id: str, start: Optional[date], end: Optional[date],
+                              after: Optional[str], limit: int) -> List[Dict]:
+        """Up to limit {date, completed} rows after the after date, in date order"""
+
+    @abc.abstractmethod
+    async def set_completion(self, user_id: str, habit_id: str, date_str: str, completed: bool) -> Optional[bool]:
+        """Record one habit-day atomically; returns its previous flag, or None if unrecorded"""
+
+    @abc.abstractmethod
+    async def set_completions(self, user_id: str, records: Sequence[Tuple[str, str, bool]]) -> Dict[int, str]:
+        """Record many (habit_id, date, completed) rows; returns the errors of failed rows by position"""
+
+    @abc.abstractmethod
+    async def count_completed_by_day(self, user_id: str, habit_ids: Sequence[str], start: date, end: date,
+                                     analytics: bool = False) -> Dict[str, int]:
+        """Number of completed habits per ISO date within [start, end]"""
+
+    @abc.abstractmethod
+    async def completed_day_offsets(self, user_id: str, habit_ids: Sequence[str], start: date, end: date,
+                                    analytics: bool = False) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Completed days within [start, end] as (index into habit_ids, day offset from start) arrays
+
+        Feeds the trend analytics, so it needs NumPy as they do; dates are
+        grouped per habit in the database rather than returned row by row.
+        """
+
+    @abc.abstractmethod
+    def iter_completions(self, user_id: Optional[str] = None, start: Optional[date] = None,
+                         end: Optional[date] = None, batch_size: int = 1000) -> AsyncIterator[Dict]:
+        """{user_id, habit_id, date, completed} rows by user, habit and date"""
+
+    # Materialized stats
+    @abc.abstractmethod
+    async def get_stats(self, user_id: str, habit_ids: Sequence[str]) -> Dict[str, Dict]:
+        ...
+
+    @abc.abstractmethod
+    async def save_stats(self, stats_docs: Sequence[Dict]):
+        """Replace stats documents, creating missing ones"""
+
+    @abc.abstractmethod
+    async def replace_stats(self, stats: Dict, version: int) -> bool:
+        """Replace a stats document only if it is still at version"""
+
+    # Daily summaries
+    @abc.abstractmethod
+    async def daily_summaries(self, user_id: str, start: date, end: date) -> Dict[str, int]:
+        """Completed count of each rolled-up day within [start, end]"""
+
+    @abc.abstractmethod
+    async def stale_daily_summaries(self, user_id: str, start: date, end: date) -> Dict[str, int]:
+        """{date: times marked stale} of the user's stale days within [start, end]"""
+
+    @abc.abstractmethod
+    async def insert_daily_summaries(self, user_id: str, daily_completed: Dict[str, int], total: int) -> List[str]:
+        """Store summaries of days that have none yet; returns the dates inserted
+
+        Existing summaries are left alone, stale ones included: a toggle may
+        have marked the day after it was counted.
+        """
+
+    @abc.abstractmethod
+    async def refresh_daily_summaries(self, user_id: str, daily_completed: Dict[str, int], total: int,
+                                      stale: Dict[str, int]) -> List[str]:
+        """Replace stale summaries not marked again since stale was read; returns the dates replaced"""
+
+    @abc.abstractmethod
+    async def mark_daily_summary_stale(self, user_id: str, date_str: str):
+        """Flag a past day as changed, whether or not it has a summary yet
+
+        Reads count stale days from the completions until the next rollup
+        recounts them.
+        """
+
+    @abc.abstractmethod
+    async def delete_daily_summaries(self, user_id: str, start: Optional[date] = None):
+        """Drop the user's summaries from start on, or all of them"""
+
+    # Badge awards
+    @abc.abstractmethod
+    async def list_badge_awards(self, user_id: str) -> List[Dict]:
+        """{habit_id, badge_id, awarded_at} of the user's awards, newest first"""
+
+    @abc.abstractmethod
+    async def insert_badge_awards(self, awards: Sequence[Dict]) -> List[Dict]:
+        """Store {user_id, habit_id, badge_id, awarded_at} awards; returns those not already made"""
+
+    # Rollup schedule
+    @abc.abstractmethod
+    async def add_rollup_users(self, user_ids: Sequence[str], at: datetime):
+        """Schedule the first rollup of users that have no rollup scheduled"""
+
+    @abc.abstractmethod
+    async def request_rollup(self, user_id: str, at: datetime):
+        """Bring the user's next rollup forward to at, if it is scheduled later"""
+
+    @abc.abstractmethod
+    async def set_next_rollup(self, user_id: str, at: datetime):
+        ...
+
+    @abc.abstractmethod
+    async def due_rollup_users(self, now: datetime) -> List[str]:
+        """Users whose next rollup is at or before now"""
+
+    # Background job leases
+    @abc.abstractmethod
+    async def claim_job(self, name: str, lease_seconds: float) -> bool:
+        """Lease a background job for lease_seconds, unless a worker holds it already"""
+
+    # Purges of deleted habits
+    @abc.abstractmethod
+    async def schedule_purge(self, user_id: str, habit_ids: Sequence[str], whole_user: bool = False) -> Optional[str]:
+        """Purge deleted habits, or a whole user, now or in the background
+
+        Returns the id of the queued purge job, or None when the storage
+        purged them already.
+        """
+
+    @abc.abstractmethod
+    async def get_purge(self, user_id: str, purge_id: str) -> Optional[Dict]:
+        ...
+
+    @abc.abstractmethod
+    async def claim_purge(self) -> Optional[Dict]:
+        """Lease the oldest unfinished purge that no live worker holds"""
+
+    @abc.abstractmethod
+    async def run_purge(self, purge: Dict) -> bool:
+        """Work through a leased purge from its checkpoint
+
+        Returns False if the lease was lost to another worker midway.
+        """
+
+    # User settings
+    @abc.abstractmethod
+    async def get_settings(self, user_id: str) -> Optional[Dict]:
+        ...
+
+    @abc.abstractmethod
+    async def save_settings(self, user_id: str, settings: Dict):
+        ...
+
+
+class MongoRepository(Repository):
+    """Collections of a Motor database
+
+    ``analytics_db`` is the same database with a read preference that may
+    route reads to secondaries; ``completion_storage`` is "documents" or
+    "bitmap".
+
+    Deleted habits are purged in the background: each purge job works
+    through PURGE_STAGES in order, deleting purge_batch_size documents at
+    a time and checkpointing its stage and counts after every batch. A job
+    is leased to one worker at a time; a lease left by a crashed worker
+    expires and the job resumes from its checkpoint.
+    """
+
+    purge_batch_size = 1000
+    purge_batch_pause_seconds = 0.01
+    purge_lease_seconds = 60
+
+    def __init__(self, db, analytics_db=None, completion_storage: str = "documents"):
+        self.db = db
+        self.analytics_db = db if analytics_db is None else analytics_db
+        self.bitmaps = completion_storage == "bitmap"
+
+    def _database(self, analytics: bool):
+        return self.analytics_db if analytics else self.db
+
+    async def ping(self):
+        await self.db.command("ping")
+
+    # Habits
+    async def list_habits(self, user_id, habit_ids=None, fields=None, analytics=False):
+        habit_filter = {"user_id": user_id, **ACTIVE_HABIT}
+        if habit_ids is not None:
+            habit_filter["id"] = {"$in": list(habit_ids)}
+        projection = {"_id": 0, **{field: 1 for field in fields}} if fields else {"_id": 0}
+        return await self._database(analytics).habits.find(habit_filter, projection).to_list(None)
+
+    async def find_habit(self, user_id, habit_id):
+        return await self.db.habits.find_one({"user_id": user_id, "id": habit_id, **ACTIVE_HABIT}, {"_id": 0})
+
+    async def insert_habit(self, habit):
+        await self.db.habits.insert_one(dict(habit))
+
+    async def update_habit(self, user_id, habit_id, changes):
+        result = await self.db.habits.update_one(
+            {"user_id": user_id, "id": habit_id, **ACTIVE_HABIT}, {"$set": changes}
+        )
+        return result.matched_count > 0
+
+    async def delete_habits(self, user_id, habit_ids, deleted_at):
+        result = await self.db.habits.update_many(
+            {"user_id": user_id, "id": {"$in": list(habit_ids)}, **ACTIVE_HABIT},
+            {"$set": {"deleted_at": deleted_at}}
+        )
+        return result.matched_count
+
+    async def iter_habit_owners(self, habit_ids=None):
+        habit_filter = {"id": {"$in": list(habit_ids)}} if habit_ids else {}
+        cursor = self.db.habits.find({**habit_filter, **ACTIVE_HABIT}, {"_id": 0, "id": 1, "user_id": 1}).sort(
+            [("user_id", ASCENDING), ("id", ASCENDING)]
+        )
+        async for habit in cursor:
+            yield habit['user_id'], habit['id']
+
+    async def iter_habits(self, user_id=None, batch_size=1000):
+        habit_filter = {"user_id": user_id} if user_id else {}
+        cursor = self.db.habits.find({**habit_filter, **ACTIVE_HABIT}, {"_id": 0}).sort(
+            [("user_id", ASCENDING), ("id", ASCENDING)]
+        ).batch_size(batch_size)
+        async for habit in cursor:
+            yield habit
+
+    async def list_user_ids(self):
+        return await self.db.habits.distinct("user_id", ACTIVE_HABIT)
+
+    # Completions
+    def _completion_collection(self):
+        return self.db.habit_completion_bitmaps if self.bitmaps else self.db.habit_completions
+
+    def _completion_upsert(self, user_id: str, habit_id: str, date_str: str, completed: bool) -> Tuple[Dict, Dict]:
+        """Filter and update document that set one habit-day completion"""
+        if self.bitmaps:
+            year, update = bitmap_update(date_str, completed)
+            return {"user_id": user_id, "habit_id": habit_id, "year": year}, update
+
+        completion_filter = {"user_id": user_id, "habit_id": habit_id, "date": date_str}
+        update = {
+            "$set": {"completed": completed},
+            "$setOnInsert": {"id": str(uuid.uuid4())}
+        }
+        return completion_filter, update
+
+    async def completion_histories(self, user_id, habit_ids, start=None, end=None):
+        histories: Dict[str, Dict[str, bool]] = {habit_id: {} for habit_id in habit_ids}
+        if not habit_ids:
+            return histories
+
+        if self.bitmaps:
+            bitmap_filter = {"user_id": user_id, "habit_id": {"$in": list(habit_ids)}}
+            if start or end:
+                bitmap_filter["year"] = {"$gte": (start or date.min).year, "$lte": (end or date.max).year}
+            cursor = self.db.habit_completion_bitmaps.find(
+                bitmap_filter, {"_id": 0}
+            ).sort([("user_id", ASCENDING), ("habit_id", ASCENDING), ("year", ASCENDING)])
+            async for bitmap in cursor:
+                history = histories.get(bitmap['habit_id'])
+                if history is not None:
+                    history.update(
+                        (date_str, completed) for date_str, completed in iter_bitmap_days(bitmap)
+                        if in_window(date_str, start, end)
+                    )
+            return histories
+
+        # Sorted on the (user_id, habit_id, date) index so histories come out in date order
+        cursor = self.db.habit_completions.find(
+            {"user_id": user_id, "habit_id": {"$in": list(habit_ids)}, **date_range_filter(start, end)},
+            {"_id": 0, "habit_id": 1, "date": 1, "completed": 1}
+        ).sort([("user_id", ASCENDING), ("habit_id", ASCENDING), ("date", ASCENDING)])
+        async for completion in cursor:
+            history = histories.get(completion['habit_id'])
+            if history is not None:
+                history[completion_date_key(completion['date'])] = completion['completed']
+        return histories
+
+    async def completion_page(self, user_id, habit_id, start, end, after, limit):
+        if self.bitmaps:
+            histories = await self.completion_histories(user_id, [habit_id], start, end)
+            return [
+                {"date": date_str, "completed": completed}
+                for date_str, completed in histories[habit_id].items()
+                if not after or date_str > after
+            ][:limit]
+
+        cursor = self.db.habit_completions.find(
+            {"user_id": user_id, "habit_id": habit_id, **date_range_filter(start, end, after)},
+            {"_id": 0, "date": 1, "completed": 1}
+        ).sort([("user_id", ASCENDING), ("habit_id", ASCENDING), ("date", ASCENDING)]).limit(limit)
+        return [
+            {"date": completion_date_key(completion['date']), "completed": completion['completed']}
+            async for completion in cursor
+        ]
+
+    async def set_completion(self, user_id, habit_id, date_str, completed):
+        completion_filter, update = self._completion_upsert(user_id, habit_id, date_str, completed)
+        collection = self._completion_collection()
+        try:
+            before = await collection.find_one_and_update(
+                completion_filter, update, upsert=True, return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # A concurrent upsert inserted the document first; it now exists, so update it
+            update.pop("$setOnInsert", None)
+            before = await collection.find_one_and_update(
+                completion_filter, update, return_document=ReturnDocument.BEFORE
+            )
+        if self.bitmaps:
+            return bitmap_value(before, date_str)
+        return before['completed'] if before else None
+
+    async def set_completions(self, user_id, records):
+        operations = [
+            UpdateOne(*self._completion_upsert(user_id, habit_id, date_str, completed), upsert=True)
+            for habit_id, date_str, completed in records
+        ]
+        if not operations:
+            return {}
+        try:
+            await self._completion_collection().bulk_write(operations, ordered=False)
+        except BulkWriteError as error:
+            return {e['index']: e['errmsg'] for e in error.details.get('writeErrors', [])}
+        return {}
+
+    async def count_completed_by_day(self, user_id, habit_ids, start, end, analytics=False):
+        database = self._database(analytics)
+        if self.bitmaps:
+            daily_completed: Dict[str, int] = {}
+            cursor = database.habit_completion_bitmaps.find(
+                {"user_id": user_id, "habit_id": {"$in": list(habit_ids)}, "year": {"$in": window_years(start, end)}},
+                {"_id": 0}
+            )
+            async for bitmap in cursor:
+                for date_str in completed_days_between(bitmap, start, end):
+                    daily_completed[date_str] = daily_completed.get(date_str, 0) + 1
+            return daily_completed
+
+        pipeline = [
+            {"$match": {
+                "user_id": user_id,
+                "habit_id": {"$in": list(habit_ids)},
+                "date": {"$gte": start.isoformat(), "$lte": end.isoformat()},
+                "completed": True
+            }},
+            {"$group": {"_id": "$date", "completed": {"$sum": 1}}}
+        ]
+        rows = await database.habit_completions.aggregate(pipeline).to_list(None)
+        return {completion_date_key(row['_id']): row['completed'] for row in rows}
+
+    async def completed_day_offsets(self, user_id, habit_ids, start, end, analytics=False):
+        import numpy as np
+
+        database = self._database(analytics)
+        index_of = {habit_id: index for index, habit_id in enumerate(habit_ids)}
+        if self.bitmaps:
+            cursor = database.habit_completion_bitmaps.find(
+                {"user_id": user_id, "habit_id": {"$in": list(habit_ids)}, "year": {"$in": window_years(start, end)}},
+                {"_id": 0, "habit_id": 1, "year": 1, "completed": 1}
+            )
+            return completed_day_offsets([(index_of[bitmap['habit_id']], bitmap) async for bitmap in cursor],
+                                         start, end)
+
+        # One document per habit instead of one per completed day
+        pipeline = [
+            {"$match": {
+                "user_id": user_id,
+                "habit_id": {"$in": list(habit_ids)},
+                "date": {"$gte": start.isoformat(), "$lte": end.isoformat()},
+                "completed": True
+            }},
+            {"$group": {"_id": "$habit_id", "dates": {"$push": "$date"}}}
+        ]
+        habit_index, day_offset = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        async for group in database.habit_completions.aggregate(pipeline):
+            dates = np.array(group['dates'], dtype='datetime64[D]')
+            day_offset.append((dates - np.datetime64(start)).astype(np.int64))
+            habit_index.append(np.full(len(dates), index_of[group['_id']], dtype=np.int64))
+        return np.concatenate(habit_index), np.concatenate(day_offset)
+
+    async def iter_completions(self, user_id=None, start=None, end=None, batch_size=1000):
+        user_filter = {"user_id": user_id} if user_id else {}
+        if self.bitmaps:
+            bitmap_filter = dict(user_filter)
+            if start or end:
+                bitmap_filter["year"] = {"$gte": (start or date.min).year, "$lte": (end or date.max).year}
+            cursor = self.db.habit_completion_bitmaps.find(bitmap_filter, {"_id": 0}).sort(
+                [("user_id", ASCENDING), ("habit_id", ASCENDING), ("year", ASCENDING)]
+            ).batch_size(batch_size)
+            async for bitmap in cursor:
+                for date_str, completed in iter_bitmap_days(bitmap):
+                    if in_window(date_str, start, end):
+                        yield {"user_id": bitmap['user_id'], "habit_id": bitmap['habit_id'],
+                               "date": date_str, "completed": completed}
+            return
+
+        cursor = self.db.habit_completions.find(
+            {**user_filter, **date_range_filter(start, end)},
+            {"_id": 0, "user_id": 1, "habit_id": 1, "date": 1, "completed": 1}
+        ).sort([("user_id", ASCENDING), ("habit_id", ASCENDING), ("date", ASCENDING)]).batch_size(batch_size)
+        async for completion in cursor:
+            completion['date'] = completion_date_key(completion['date'])
+            yield completion
+
+    # Materialized stats
+    async def get_stats(self, user_id, habit_ids):
+        return {
+            stats['habit_id']: stats
+            async for stats in self.db.habit_stats.find(
+                {"user_id": user_id, "habit_id": {"$in": list(habit_ids)}}, {"_id": 0}
+            )
+        }
+
+    async def save_stats(self, stats_docs):
+        if stats_docs:
+            await self.db.habit_stats.bulk_write(
+                [ReplaceOne({"user_id": stats['user_id'], "habit_id": stats['habit_id']}, stats, upsert=True)
+                 for stats in stats_docs],
+                ordered=False
+            )
+
+    async def replace_stats(self, stats, version):
+        result = await self.db.habit_stats.replace_one(
+            {"user_id": stats['user_id'], "habit_id": stats['habit_id'], "version": version}, stats
+        )
+        return result.modified_count > 0
+
+    # Daily summaries
+    async def daily_summaries(self, user_id, start, end):
+        return {
+            summary['date']: summary['completed']
+            async for summary in self.db.daily_summaries.find(
+                {"user_id": user_id, "date": {"$gte": start.isoformat(), "$lte": end.isoformat()},
+                 "stale": {"$in": [0, None]}},
+                {"_id": 0, "date": 1, "completed": 1}
+            )
+        }
+
+    async def stale_daily_summaries(self, user_id, start, end):
+        return {
+            summary['date']: summary['stale']
+            async for summary in self.db.daily_summaries.find(
+                {"user_id": user_id, "date": {"$gte": start.isoformat(), "$lte": end.isoformat()},
+                 "stale": {"$gt": 0}},
+                {"_id": 0, "date": 1, "stale": 1}
+            )
+        }
+
+    async def insert_daily_summaries(self, user_id, daily_completed, total):
+        dates = sorted(daily_completed)
+        if not dates:
+            return []
+        rolled_up_at = datetime.utcnow()
+        # $setOnInsert leaves summaries another worker wrote, and stale
+        # markers, untouched
+        try:
+            result = await self.db.daily_summaries.bulk_write([
+                UpdateOne(
+                    {"user_id": user_id, "date": date_str},
+                    {"$setOnInsert": {"completed": daily_completed[date_str], "total": total,
+                                      "rolled_up_at": rolled_up_at, "stale": 0}},
+                    upsert=True
+                )
+                for date_str in dates
+            ], ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as error:
+            # Concurrent upserts of the same day: the other one inserted it
+            upserted = {upsert['index'] for upsert in error.details.get('upserted', [])}
+        return [dates[index] for index in sorted(upserted)]
+
+    async def refresh_daily_summaries(self, user_id, daily_completed, total, stale):
+        rolled_up_at = datetime.utcnow()
+        results = await asyncio.gather(*(
+            self.db.daily_summaries.update_one(
+                {"user_id": user_id, "date": date_str, "stale": stale[date_str]},
+                {"$set": {"completed": daily_completed[date_str], "total": total,
+                          "rolled_up_at": rolled_up_at, "stale": 0}}
+            )
+            for date_str in sorted(daily_completed)
+        ))
+        return [date_str for date_str, result in zip(sorted(daily_completed), results) if result.matched_count]
+
+    async def mark_daily_summary_stale(self, user_id, date_str):
+        summary_filter = {"user_id": user_id, "date": date_str}
+        try:
+            await self.db.daily_summaries.update_one(summary_filter, {
+                "$inc": {"stale": 1},
+                "$setOnInsert": {"completed": 0, "total": 0, "rolled_up_at": datetime.utcnow()}
+            }, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent rollup or toggle inserted the day first
+            await self.db.daily_summaries.update_one(summary_filter, {"$inc": {"stale": 1}})
+
+    async def delete_daily_summaries(self, user_id, start=None):
+        summary_filter = {"user_id": user_id}
+        if start is not None:
+            summary_filter["date"] = {"$gte": start.isoformat()}
+        await self.db.daily_summaries.delete_many(summary_filter)
+
+    # Badge awards
+    async def list_badge_awards(self, user_id):
+        return await self.db.badge_awards.find(
+            {"user_id": user_id}, {"_id": 0, "user_id": 0}
+        ).sort("awarded_at", -1).to_list(None)
+
+    async def insert_badge_awards(self, awards):
+        awards = [dict(award) for award in awards]
+        if not awards:
+            return []
+        try:
+            await self.db.badge_awards.insert_many(awards, ordered=False)
+        except BulkWriteError as error:
+            # Another worker awarded some of them first
+            duplicates = {e['index'] for e in error.details.get('writeErrors', [])}
+            awards = [award for index, award in enumerate(awards) if index not in duplicates]
+        for award in awards:
+            award.pop('_id', None)
+        return awards
+
+    # Rollup schedule
+    async def add_rollup_users(self, user_ids, at):
+        if not user_ids:
+            return
+        try:
+            await self.db.user_rollups.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$setOnInsert": {"next_rollup_at": at}}, upsert=True)
+                for user_id in user_ids
+            ], ordered=False)
+        except BulkWriteError:
+            # Concurrent upserts of the same user: the schedule exists either way
+            pass
+
+    async def request_rollup(self, user_id, at):
+        try:
+            await self.db.user_rollups.update_one({"user_id": user_id}, {"$min": {"next_rollup_at": at}}, upsert=True)
+        except DuplicateKeyError:
+            await self.db.user_rollups.update_one({"user_id": user_id}, {"$min": {"next_rollup_at": at}})
+
+    async def set_next_rollup(self, user_id, at):
+        await self.db.user_rollups.update_one({"user_id": user_id}, {"$set": {"next_rollup_at": at}}, upsert=True)
+
+    async def due_rollup_users(self, now):
+        return [
+            rollup['user_id']
+            async for rollup in self.db.user_rollups.find(
+                {"next_rollup_at": {"$lte": now}}, {"_id": 0, "user_id": 1}
+            )
+        ]
+
+    # Background job leases
+    async def claim_job(self, name, lease_seconds):
+        now = datetime.utcnow()
+        try:
+            # Matches only an expired lease; otherwise the upsert collides
+            # with the held lease on the unique name index
+            await self.db.job_leases.update_one(
+                {"name": name, "lease_until": {"$lte": now}},
+                {"$set": {"lease_until": now + timedelta(seconds=lease_seconds)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    # Purges of deleted habits
+    async def schedule_purge(self, user_id, habit_ids, whole_user=False):
+        now = datetime.utcnow()
+        purge = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "habit_ids": list(habit_ids),
+            "whole_user": whole_user,
+            "status": "pending",
+            "stage": None,
+            "deleted": {},
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.db.purge_jobs.insert_one(purge)
+        return purge['id']
+
+    async def get_purge(self, user_id, purge_id):
+        return await self.db.purge_jobs.find_one({"id": purge_id, "user_id": user_id}, {"_id": 0})
+
+    async def claim_purge(self):
+        now = datetime.utcnow()
+        lease = {"status": "running", "lease_id": str(uuid.uuid4()),
+                 "lease_until": now + timedelta(seconds=self.purge_lease_seconds)}
+        purge = await self.db.purge_jobs.find_one_and_update(
+            {"status": {"$in": ["pending", "running"]},
+             "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]},
+            {"$set": lease},
+            sort=[("created_at", ASCENDING)],
+            projection={"_id": 0}
+        )
+        if purge is not None:
+            purge.update(lease)
+        return purge
+
+    async def run_purge(self, purge):
+        lease = {"id": purge['id'], "lease_id": purge['lease_id']}
+        start = PURGE_STAGES.index(purge['stage']) if purge.get('stage') else 0
+        for collection_name in PURGE_STAGES[start:]:
+            stage_filter = purge_filter(purge, collection_name)
+            if stage_filter is None:
+                continue
+            collection = self.db[collection_name]
+            while True:
+                batch = [
+                    doc['_id']
+                    async for doc in collection.find(stage_filter, {"_id": 1}).limit(self.purge_batch_size)
+                ]
+                deleted = (await collection.delete_many({"_id": {"$in": batch}})).deleted_count if batch else 0
+                now = datetime.utcnow()
+                checkpoint = await self.db.purge_jobs.update_one(lease, {
+                    "$set": {"stage": collection_name, "updated_at": now,
+                             "lease_until": now + timedelta(seconds=self.purge_lease_seconds)},
+                    "$inc": {f"deleted.{collection_name}": deleted}
+                })
+                if not checkpoint.matched_count:
+                    return False
+                if len(batch) < self.purge_batch_size:
+                    break
+                # Leave room for live writes between batches
+                await asyncio.sleep(self.purge_batch_pause_seconds)
+
+        now = datetime.utcnow()
+        await self.db.purge_jobs.update_one(lease, {
+            "$set": {"status": "done", "stage": None, "updated_at": now, "finished_at": now},
+            "$unset": {"lease_id": "", "lease_until": ""}
+        })
+        return True
+
+    # User settings
+    async def get_settings(self, user_id):
+        return await self.db.user_settings.find_one({"user_id": user_id}, {"_id": 0, "user_id": 0})
+
+    async def save_settings(self, user_id, settings):
+        await self.db.user_settings.update_one({"user_id": user_id}, {"$set": settings}, upsert=True)
@@ -0,0 +1,108 @@
+"""Per-user in-process response cache with generation-based invalidation.
+
+Cached bodies are keyed by user, request key and the user's current cache
+generation. Any write for a user bumps the generation, so entries built
+before the write can no longer be found and age out of the LRU. Because a
+reader captures the generation before it computes a response, a response
+computed concurrently with a write is stored under the old generation and
+never served afterwards.
+
+Generations live in an invalidation backend. ``LocalInvalidation`` keeps
+them in this process. ``MongoInvalidation`` keeps them in a collection, so
+a write in one worker invalidates the caches of all workers.
+"""
+import hashlib
+import time
+from collections import OrderedDict, defaultdict
+from typing import Hashable, NamedTuple, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+
+class CacheEntry(NamedTuple):
+    etag: str
+    body: bytes
+    expires_at: float
+
+
+class LocalInvalidation:
+    """Generation counters held in this process"""
+
+    def __init__(self):
+        self._generations = defaultdict(int)
+
+    async def generation(self, user_id: str) -> int:
+        return self._generations[user_id]
+
+    async def bump(self, user_id: str):
+        self._generations[user_id] += 1
+
+
+class MongoInvalidation:
+    """Generation counters in a Mongo collection, shared by all workers"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def generation(self, user_id: str) -> int:
+        doc = await self.collection.find_one({"user_id": user_id}, {"_id": 0, "generation": 1})
+        return doc["generation"] if doc else 0
+
+    async def bump(self, user_id: str):
+        try:
+            await self.collection.update_one({"user_id": user_id}, {"$inc": {"generation": 1}}, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent bump inserted the user's counter first; increment it
+            await self.collection.update_one({"user_id": user_id}, {"$inc": {"generation": 1}})
+
+
+class ResponseCache:
+    """LRU of serialized responses bounded by entry count and TTL"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300, invalidation=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.invalidation = invalidation or LocalInvalidation()
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+
+    async def generation(self, user_id: str) -> int:
+        return await self.invalidation.generation(user_id)
+
+    async def invalidate(self, user_id: str):
+        await self.invalidation.bump(user_id)
+
+    def get(self, user_id: str, key: Hashable, generation: int) -> Optional[CacheEntry]:
+        entry_key = (user_id, generation, key)
+        entry = self._entries.get(entry_key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[entry_key]
+            return None
+        self._entries.move_to_end(entry_key)
+        return entry
+
+    def put(self, user_id: str, key: Hashable, generation: int, body: bytes) -> CacheEntry:
+        entry = CacheEntry(entity_tag(body), body, time.monotonic() + self.ttl_seconds)
+        entry_key = (user_id, generation, key)
+        self._entries[entry_key] = entry
+        self._entries.move_to_end(entry_key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        self._entries.clear()
+
+
+def entity_tag(body: bytes) -> str:
+    """Strong ETag of a response body"""
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header value matches the entity tag"""
+    if not if_none_match:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")}
+    return etag in candidates or "*" in candidates
@@ -0,0 +1,94 @@
+"""Periodic background jobs run inside the API process.
+
+``Scheduler`` runs each registered job in its own asyncio task: once at
+startup, then every ``interval`` seconds after the previous run finished.
+A failing run is logged and retried on the next tick; it never stops the
+job or the app. Jobs return a summary of their work, logged when truthy.
+
+Jobs fan their work out with ``run_batched``, which walks the items in
+fixed-size batches and processes each batch with at most ``concurrency``
+coroutines in flight, so a pass over many users never floods the
+database. Jobs must be idempotent: with several workers, each one runs
+its own scheduler.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+async def run_batched(items: Iterable[T], worker: Callable[[T], Awaitable], batch_size: int = 100,
+                      concurrency: int = 8) -> int:
+    """Await worker(item) for every item, concurrency at a time per batch
+
+    Failures are logged per item and do not stop the remaining items.
+    Returns the number of items processed without error.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    succeeded = 0
+
+    async def run(item: T):
+        nonlocal succeeded
+        async with semaphore:
+            try:
+                await worker(item)
+                succeeded += 1
+            except Exception:
+                logger.exception(f"Background job failed for {item!r}")
+
+    batch: List[T] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            await asyncio.gather(*(run(item) for item in batch))
+            batch = []
+    if batch:
+        await asyncio.gather(*(run(item) for item in batch))
+    return succeeded
+
+
+class Scheduler:
+    """Named periodic coroutines tied to the app's startup and shutdown"""
+
+    def __init__(self):
+        self._jobs: Dict[str, tuple] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def add_job(self, name: str, job: Callable[[], Awaitable], interval: float):
+        self._jobs[name] = (job, interval)
+
+    async def run_job(self, name: str):
+        """Run one job now, logging how long it took"""
+        job, _ = self._jobs[name]
+        started = asyncio.get_running_loop().time()
+        result = await job()
+        elapsed = asyncio.get_running_loop().time() - started
+        # Runs that found nothing to do are not worth a log line
+        if result:
+            logger.info(f"Background job {name} finished in {elapsed:.2f}s: {result}")
+        return result
+
+    async def _loop(self, name: str, interval: float):
+        while True:
+            try:
+                await self.run_job(name)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Background job {name} failed")
+            await asyncio.sleep(interval)
+
+    def start(self):
+        for name, (_, interval) in self._jobs.items():
+            if name not in self._tasks:
+                self._tasks[name] = asyncio.create_task(self._loop(name, interval), name=f"job:{name}")
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        self._tasks.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
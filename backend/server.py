@@ -1,27 +1,302 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, ReadPreference, UpdateOne
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from pydantic import BaseModel, Field, ValidationError
+from typing import TYPE_CHECKING, List, Optional, Dict, AsyncIterator, Tuple
 import uuid
-from datetime import datetime, date
-from collections import defaultdict
+import asyncio
+import hashlib
+import importlib
+import json
+import time
+import jwt
+from datetime import datetime, date, timedelta
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from completion_bitmaps import encode_history
+from habit_stats import apply_completion, completion_rate, current_streak, stats_from_histories
+from fast_json import FastJSONResponse, dumps
+from idempotency import IdempotencyKeyReused, IdempotencyStore, LocalRecords, MongoRecords, WriteCoalescer
+from exports import EXPORT_COLUMNS, MEDIA_TYPES, csv_chunks, ndjson_chunks
+from live_updates import ChangeStreamBroker, EventBroker
+from metrics import MetricsMiddleware, MetricsRegistry, MongoCommandListener
+from repository import ACTIVE_HABIT, MongoRepository, completion_date_key, purge_progress
+from response_cache import LocalInvalidation, MongoInvalidation, ResponseCache, entity_tag, etag_matches
+from scheduler import Scheduler, run_batched
+from sqlite_repository import SqliteRepository
+
+# NumPy and the trend analytics built on it are imported on first use, so
+# they stay off the import path of a starting worker; warm_up loads them
+# in the background before the worker reports ready
+if TYPE_CHECKING:
+    import numpy as np
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage: "mongo" (the default) or "sqlite", which keeps everything in
+# the SQLITE_PATH file and needs no database server. Query plans are a
+# Mongo feature; with SQLite, deletes purge at once instead of in the
+# background.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+if STORAGE_BACKEND not in ('mongo', 'sqlite'):
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+SQLITE_PATH = os.environ.get('SQLITE_PATH', str(ROOT_DIR / 'habits.sqlite3'))
+
+# MongoDB connection. Each worker process opens its own client when the
+# app starts (see lifespan), so no client or pool crosses a fork. Pool,
+# timeout and compression settings come from the MONGO_* variables below
+# and otherwise keep the driver defaults.
+mongo_url = os.environ.get('MONGO_URL')
+DB_NAME = os.environ.get('DB_NAME')
+MONGO_CLIENT_SETTINGS = {
+    'maxPoolSize': 'MONGO_MAX_POOL_SIZE',
+    'minPoolSize': 'MONGO_MIN_POOL_SIZE',
+    'maxIdleTimeMS': 'MONGO_MAX_IDLE_TIME_MS',
+    'waitQueueTimeoutMS': 'MONGO_WAIT_QUEUE_TIMEOUT_MS',
+    'connectTimeoutMS': 'MONGO_CONNECT_TIMEOUT_MS',
+    'serverSelectionTimeoutMS': 'MONGO_SERVER_SELECTION_TIMEOUT_MS',
+    'socketTimeoutMS': 'MONGO_SOCKET_TIMEOUT_MS',
+}
+
+def mongo_client_options() -> Dict:
+    """Client keyword arguments for the MONGO_* settings that are set"""
+    options = {option: int(os.environ[name]) for option, name in MONGO_CLIENT_SETTINGS.items() if os.environ.get(name)}
+    if os.environ.get('MONGO_COMPRESSORS'):
+        # e.g. "zstd,snappy,zlib"; the server picks the first one it supports
+        options['compressors'] = os.environ['MONGO_COMPRESSORS']
+    return options
+
+# Trend analytics tolerate replication lag, so they read with
+# MONGO_ANALYTICS_READ_PREFERENCE, keeping that load off the primary; their
+# responses are then not cached (see analytics_reads_may_lag)
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+MONGO_ANALYTICS_READ_PREFERENCE = os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+if MONGO_ANALYTICS_READ_PREFERENCE not in READ_PREFERENCES:
+    raise RuntimeError(f"Unknown MONGO_ANALYTICS_READ_PREFERENCE {MONGO_ANALYTICS_READ_PREFERENCE!r}")
+
+# Set by bind_repository; db and analytics_db (db with the analytics read
+# preference) stay None unless the storage is Mongo
+repository = None
+client = None
+db = None
+analytics_db = None
+
+# Completion storage: "documents" keeps one document per habit-day in
+# habit_completions, "bitmap" packs each habit-year into one document in
+# habit_completion_bitmaps (see completion_bitmaps.py)
+COMPLETION_STORAGE = os.environ.get('COMPLETION_STORAGE', 'documents')
+if COMPLETION_STORAGE not in ('documents', 'bitmap'):
+    raise RuntimeError(f"Unknown COMPLETION_STORAGE {COMPLETION_STORAGE!r}")
+
+# Response cache for the dashboard reads; "mongo" invalidation shares
+# cache generations between workers through the cache_generations collection
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'local')
+if RESPONSE_CACHE_BACKEND not in ('local', 'mongo'):
+    raise RuntimeError(f"Unknown RESPONSE_CACHE_BACKEND {RESPONSE_CACHE_BACKEND!r}")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1024))
+RESPONSE_CACHE_TTL_SECONDS = float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', 300))
+response_cache = None
+
+# Live updates pushed to clients over /api/events; "mongo" fans events out
+# to every worker through a change stream on the habit_events collection
+LIVE_UPDATES_BACKEND = os.environ.get('LIVE_UPDATES_BACKEND', 'local')
+if LIVE_UPDATES_BACKEND not in ('local', 'mongo'):
+    raise RuntimeError(f"Unknown LIVE_UPDATES_BACKEND {LIVE_UPDATES_BACKEND!r}")
+LIVE_UPDATES_QUEUE_SIZE = int(os.environ.get('LIVE_UPDATES_QUEUE_SIZE', 100))
+live_updates = None
+
+# Responses to writes sent with an Idempotency-Key header, replayed when a
+# client retries; "mongo" shares them between workers through the
+# idempotency_keys collection
+IDEMPOTENCY_BACKEND = os.environ.get('IDEMPOTENCY_BACKEND', 'local')
+if IDEMPOTENCY_BACKEND not in ('local', 'mongo'):
+    raise RuntimeError(f"Unknown IDEMPOTENCY_BACKEND {IDEMPOTENCY_BACKEND!r}")
+IDEMPOTENCY_TTL_SECONDS = float(os.environ.get('IDEMPOTENCY_TTL_SECONDS', 86400))
+IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('IDEMPOTENCY_MAX_ENTRIES', 10000))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+idempotency_store = None
+
+if STORAGE_BACKEND == 'sqlite' and 'mongo' in (RESPONSE_CACHE_BACKEND, LIVE_UPDATES_BACKEND, IDEMPOTENCY_BACKEND):
+    raise RuntimeError(
+        "RESPONSE_CACHE_BACKEND, LIVE_UPDATES_BACKEND and IDEMPOTENCY_BACKEND must be local with STORAGE_BACKEND=sqlite"
+    )
+
+def bind_repository(repo, database=None, analytics_database=None):
+    """Bind the app to a repository, with the response cache, live updates
+    and idempotency store
+    
+    database and analytics_database are the Motor databases behind a
+    MongoRepository, used directly by the Mongo-only features.
+    """
+    global repository, db, analytics_db, response_cache, live_updates, idempotency_store
+    repository = repo
+    db = database
+    analytics_db = analytics_database
+    response_cache = ResponseCache(
+        max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+        invalidation=MongoInvalidation(db.cache_generations) if RESPONSE_CACHE_BACKEND == 'mongo' else LocalInvalidation()
+    )
+    live_updates = (
+        ChangeStreamBroker(db.habit_events, LIVE_UPDATES_QUEUE_SIZE) if LIVE_UPDATES_BACKEND == 'mongo'
+        else EventBroker(LIVE_UPDATES_QUEUE_SIZE)
+    )
+    idempotency_store = IdempotencyStore(
+        MongoRecords(db.idempotency_keys, IDEMPOTENCY_TTL_SECONDS) if IDEMPOTENCY_BACKEND == 'mongo'
+        else LocalRecords(IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_TTL_SECONDS)
+    )
+    user_timezones.clear()
+
+def use_database(database):
+    """Bind the app to a Mongo database"""
+    analytics = database.client.get_database(
+        database.name, read_preference=READ_PREFERENCES[MONGO_ANALYTICS_READ_PREFERENCE]
+    )
+    bind_repository(MongoRepository(database, analytics, COMPLETION_STORAGE), database, analytics)
+
+def connect_db():
+    """Open this process's storage: a Mongo client bound to DB_NAME, or the SQLite file
+    
+    The Mongo listener attributes commands to requests for /metrics.
+    """
+    global client
+    if STORAGE_BACKEND == 'sqlite':
+        bind_repository(SqliteRepository(SQLITE_PATH))
+        return
+    if not mongo_url or not DB_NAME:
+        raise RuntimeError("MONGO_URL and DB_NAME must be set with STORAGE_BACKEND=mongo")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener()], **mongo_client_options())
+    use_database(client[DB_NAME])
+
+# Users: requests carry a bearer token signed with JWT_SECRET (user in
+# "sub") or, without JWT_SECRET, an X-User-Id header; anonymous requests
+# use the default user
+DEFAULT_USER_ID = "default"
+MAX_USER_ID_LENGTH = 128
+JWT_SECRET = os.environ.get('JWT_SECRET')
+
+# Users' "today" is their local date in the timezone from their settings;
+# users without one use DEFAULT_TIMEZONE
+DEFAULT_TIMEZONE = os.environ.get('DEFAULT_TIMEZONE', 'UTC')
+try:
+    ZoneInfo(DEFAULT_TIMEZONE)
+except (ZoneInfoNotFoundError, ValueError):
+    raise RuntimeError(f"Unknown DEFAULT_TIMEZONE {DEFAULT_TIMEZONE!r}")
+# Timezones are cached per process; update_settings clears this worker's
+# entry, and other workers pick a change up within USER_TIMEZONE_TTL_SECONDS
+USER_TIMEZONE_TTL_SECONDS = float(os.environ.get('USER_TIMEZONE_TTL_SECONDS', 60))
+USER_TIMEZONE_MAX_ENTRIES = 10000
+user_timezones: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+
+# Request metrics served on /metrics; SLOW_REQUEST_MS logs slower requests
+# together with the Mongo commands they issued
+metrics_registry = MetricsRegistry()
+SLOW_REQUEST_MS = os.environ.get('SLOW_REQUEST_MS')
+
+# Background jobs: every BACKGROUND_JOBS_INTERVAL_SECONDS (0 disables
+# them) one worker leases a pass that rolls up daily summaries, streak
+# resets and badge awards of the users whose local midnight has passed
+# since their last rollup, with at most BACKGROUND_JOBS_CONCURRENCY users
+# in flight
+BACKGROUND_JOBS_INTERVAL_SECONDS = float(os.environ.get('BACKGROUND_JOBS_INTERVAL_SECONDS', 300))
+BACKGROUND_JOBS_CONCURRENCY = int(os.environ.get('BACKGROUND_JOBS_CONCURRENCY', 8))
+scheduler = Scheduler()
+
+# Deleted habits are hidden at once and purged in the background every
+# PURGE_INTERVAL_SECONDS (0 disables the purger; run manage.py purge instead)
+PURGE_INTERVAL_SECONDS = float(os.environ.get('PURGE_INTERVAL_SECONDS', 5))
+
+# Warm-up: each worker primes WARMUP_CONNECTIONS storage connections,
+# imports the lazily loaded modules and fills per-process caches in the
+# background after startup; /ready fails until it is done, so a new worker
+# only takes traffic once its first requests are as fast as later ones
+WARMUP_CONNECTIONS = int(os.environ.get('WARMUP_CONNECTIONS', 4))
+WARMUP_MODULES = ('numpy', 'analytics')
+WARMUP_RETRY_SECONDS = 30
+READY_PING_TIMEOUT_SECONDS = 2
+warmed_up = False
+
+async def warm_up():
+    """Prime this worker for its first requests, retrying until the storage answers
+    
+    Creates the Mongo indexes once the storage answers, so a worker that
+    boots while Mongo is unreachable keeps serving /health and waits. The
+    background jobs start only then: job leases and the rollup schedule
+    rely on the unique indexes.
+    """
+    global warmed_up
+    started = time.perf_counter()
+    delay = 0.5
+    while True:
+        try:
+            # Concurrent round trips each check out their own pooled connection
+            await asyncio.gather(*(repository.ping() for _ in range(max(1, WARMUP_CONNECTIONS))))
+            if db is not None:
+                await ensure_indexes()
+            break
+        except Exception as error:
+            logger.warning(f"Warm-up could not reach the storage, retrying in {delay:.1f}s: {error}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_SECONDS)
+    scheduler.start()
+    
+    for module in WARMUP_MODULES:
+        await asyncio.to_thread(importlib.import_module, module)
+    # First calls build the timezone cache and the NumPy, encoder and
+    # pydantic code paths that the dashboard reads use
+    today = datetime.now(load_timezone(DEFAULT_TIMEZONE)).date()
+    stats = stats_from_histories({"warm-up": {today.isoformat(): True}})[0]
+    habit = {"id": "warm-up", "name": "", "category": "", "icon": "", "color": "", "created_at": datetime.utcnow()}
+    dumps([build_habit_with_stats(habit, {}, stats, today)])
+    HabitStats(total_habits=0, active_streaks=0, today_completed=0, today_total=0, today_percentage=0,
+               weekly_progress=[], monthly_progress=[])
+    warmed_up = True
+    logger.info(f"Worker warmed up in {time.perf_counter() - started:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Per-worker startup and shutdown
+    
+    Runs in every worker process after it is forked or spawned, so each
+    one connects with its own pool. Storage bound beforehand with
+    use_database or bind_repository, as tests and benchmarks do, is kept.
+    """
+    if repository is None:
+        connect_db()
+    await repository.open()
+    await live_updates.start()
+    warm_up_task = asyncio.create_task(warm_up(), name="warm_up")
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await scheduler.stop()
+        await live_updates.stop()
+        await repository.close()
+        if client is not None:
+            client.close()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -36,7 +311,7 @@ class Habit(BaseModel):
     icon: str
     color: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
-    user_id: str = "default"  # For future auth support
+    user_id: str = DEFAULT_USER_ID
 
 class HabitCreate(BaseModel):
     name: str
@@ -52,16 +327,21 @@ class HabitUpdate(BaseModel):
     icon: Optional[str] = None
     color: Optional[str] = None
 
-class HabitCompletion(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+class HabitCompletionToggle(BaseModel):
+    date: date
+    completed: bool
+
+class HabitCompletionRecord(BaseModel):
     habit_id: str
     date: date
     completed: bool = True
-    user_id: str = "default"
 
-class HabitCompletionToggle(BaseModel):
-    date: date
-    completed: bool
+class BulkCompletionResult(BaseModel):
+    received: int
+    written: int
+    failed: int
+    records_per_second: float
+    results: List[Dict]
 
 class HabitStats(BaseModel):
     total_habits: int
@@ -87,6 +367,35 @@ class HabitWithStats(BaseModel):
     completion_history: Dict[str, bool]
     earned_badges: List[str]
 
+class HabitBatch(BaseModel):
+    habits: List[HabitWithStats]
+    not_found: List[str]
+
+class HabitCompletionResult(BaseModel):
+    message: str
+    habit: HabitWithStats
+
+class PurgeStatus(BaseModel):
+    id: str
+    status: str
+    stage: Optional[str] = None
+    stages_done: int
+    stages_total: int
+    habit_ids: List[str]
+    whole_user: bool
+    deleted: Dict[str, int]
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+class UserSettings(BaseModel):
+    timezone: str = DEFAULT_TIMEZONE
+
+class UserSettingsUpdate(BaseModel):
+    timezone: str
+
+STATS_UPDATE_RETRIES = 3
+
 # Badge definitions
 BADGES = {
     'streak-3': {'name': 'Getting Started', 'description': '3 day streak', 'icon': '🌱', 'requirement': 3},
@@ -97,30 +406,66 @@ BADGES = {
 }
 
 # Helper functions
-def calculate_streaks(completion_history: Dict[str, bool]) -> tuple:
-    """Calculate current and best streak from completion history"""
-    if not completion_history:
-        return 0, 0
-    
-    dates = sorted(completion_history.keys(), reverse=True)
-    current_streak = 0
-    best_streak = 0
-    temp_streak = 0
-    
-    # Calculate current streak (from today backwards)
-    for i, date_str in enumerate(dates):
-        if completion_history[date_str]:
-            if i == 0 or current_streak > 0:
-                current_streak += 1
-            temp_streak += 1
-        else:
-            if i == 0:
-                current_streak = 0
-                break
-            temp_streak = 0
-        best_streak = max(best_streak, temp_streak)
+def valid_user_id(user_id) -> str:
+    """Reject user ids that are empty, too long or not strings"""
+    if not isinstance(user_id, str) or not user_id.strip() or len(user_id) > MAX_USER_ID_LENGTH:
+        raise HTTPException(status_code=401, detail="Invalid user")
+    return user_id
+
+async def get_user_id(request: Request) -> str:
+    """Resolve the requesting user from the bearer token or X-User-Id header"""
+    if JWT_SECRET:
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            raise HTTPException(status_code=401, detail="Missing bearer token")
+        try:
+            claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid bearer token")
+        return valid_user_id(claims.get('sub'))
     
-    return current_streak, best_streak
+    header = request.headers.get('x-user-id')
+    if header is None:
+        return DEFAULT_USER_ID
+    return valid_user_id(header)
+
+@lru_cache(maxsize=None)
+def load_timezone(name: str) -> ZoneInfo:
+    """ZoneInfo for an IANA timezone name; raises ValueError if unknown"""
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone {name!r}")
+
+async def get_user_settings(user_id: str) -> UserSettings:
+    """A user's settings, with defaults for anything not stored"""
+    settings = await repository.get_settings(user_id)
+    return UserSettings(**(settings or {}))
+
+async def get_user_timezone(user_id: str) -> str:
+    """The user's timezone name, from the per-process cache when fresh"""
+    now = time.monotonic()
+    cached = user_timezones.get(user_id)
+    if cached is not None and cached[1] > now:
+        user_timezones.move_to_end(user_id)
+        return cached[0]
+    
+    timezone = (await get_user_settings(user_id)).timezone
+    try:
+        load_timezone(timezone)
+    except ValueError:
+        # Saved before settings were validated, or dropped from tzdata since
+        logger.warning(f"User {user_id} has unknown timezone {timezone!r}, using {DEFAULT_TIMEZONE}")
+        timezone = DEFAULT_TIMEZONE
+    user_timezones[user_id] = (timezone, now + USER_TIMEZONE_TTL_SECONDS)
+    user_timezones.move_to_end(user_id)
+    while len(user_timezones) > USER_TIMEZONE_MAX_ENTRIES:
+        user_timezones.popitem(last=False)
+    return timezone
+
+async def get_today(user_id: str = Depends(get_user_id)) -> date:
+    """The requesting user's local date, resolved once per request"""
+    return datetime.now(load_timezone(await get_user_timezone(user_id))).date()
 
 def get_earned_badges(current_streak: int, best_streak: int, completion_rate: int) -> List[str]:
     """Get list of earned badge IDs based on stats"""
@@ -138,46 +483,373 @@ def get_earned_badges(current_streak: int, best_streak: int, completion_rate: in
     
     return earned
 
-async def get_habit_completion_history(habit_id: str) -> Dict[str, bool]:
-    """Get completion history for a habit"""
-    completions = await db.habit_completions.find({"habit_id": habit_id}).to_list(1000)
-    history = {}
-    for completion in completions:
-        date_str = completion['date'].isoformat() if isinstance(completion['date'], datetime) else str(completion['date'])
-        history[date_str] = completion['completed']
-    return history
+async def get_completion_page(user_id: str, habit_id: str, start: Optional[date], end: Optional[date],
+                              after: Optional[str], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """One page of a habit's completions in date order, plus the next cursor
+    
+    The cursor is the ISO date of the last completion returned; the next
+    page starts strictly after it.
+    """
+    page = await repository.completion_page(user_id, habit_id, start, end, after, limit + 1)
+    if len(page) > limit:
+        page = page[:limit]
+        return page, page[-1]['date']
+    return page, None
+
+def build_habit_with_stats(habit: dict, completion_history: Dict[str, bool], stats: Dict, today: date) -> Dict:
+    """Combine a habit document with its materialized stats
+    
+    Returns the HabitWithStats response shape as a plain dict; building
+    the model for every habit costs more than encoding it. today is the
+    user's local date, which anchors the current streak.
+    """
+    rate = completion_rate(stats)
+    streak = current_streak(stats, today.toordinal())
+    earned_badges = get_earned_badges(streak, stats['best_streak'], rate)
+    
+    return {
+        "id": habit['id'],
+        "name": habit['name'],
+        "description": habit.get('description'),
+        "category": habit['category'],
+        "icon": habit['icon'],
+        "color": habit['color'],
+        "created_at": habit['created_at'],
+        "current_streak": streak,
+        "best_streak": stats['best_streak'],
+        "total_days": stats['total_days'],
+        "completion_rate": rate,
+        "completion_history": completion_history,
+        "earned_badges": earned_badges
+    }
+
+async def get_habit_stats_docs(user_id: str, habit_ids: List[str]) -> Dict[str, Dict]:
+    """Get materialized stats for many habits, building any that are missing"""
+    stats_docs = await repository.get_stats(user_id, habit_ids)
+    missing = [habit_id for habit_id in habit_ids if habit_id not in stats_docs]
+    if missing:
+        stats_docs.update(await rebuild_habit_stats(user_id, missing))
+    return stats_docs
+
+async def rebuild_habit_stats(user_id: str, habit_ids: List[str]) -> Dict[str, Dict]:
+    """Recompute materialized stats from the full completion history"""
+    histories = await repository.completion_histories(user_id, habit_ids)
+    stats_docs = stats_from_histories(histories, user_id)
+    await repository.save_stats(stats_docs)
+    return {stats['habit_id']: stats for stats in stats_docs}
+
+async def rebuild_stats_for_habits(habit_ids: Optional[List[str]] = None, batch_size: int = 500) -> int:
+    """Rebuild materialized stats for the given habits, or every habit
+    
+    Habits are processed per user in batches; returns the habit count.
+    """
+    rebuilt = 0
+    user_id, batch = None, []
+    async for owner_id, habit_id in repository.iter_habit_owners(habit_ids):
+        if batch and (owner_id != user_id or len(batch) >= batch_size):
+            rebuilt += len(await rebuild_habit_stats(user_id, batch))
+            batch = []
+        user_id = owner_id
+        batch.append(habit_id)
+    if batch:
+        rebuilt += len(await rebuild_habit_stats(user_id, batch))
+    return rebuilt
+
+async def migrate_completions_to_bitmaps(batch_size: int = 500) -> int:
+    """Pack habit_completions into per-year bitmap documents
+    
+    Months present in habit_completions overwrite the matching bitmap
+    months, so the migration can be re-run. Returns the number of
+    bitmap documents written.
+    """
+    operations = []
+    written = 0
+    
+    def add_habit(habit_id: str, user_id: str, completions: List[Tuple[str, bool]]):
+        for year, bitmap in encode_history(completions).items():
+            fields = {f"recorded.{month}": bits for month, bits in bitmap['recorded'].items()}
+            fields.update({f"completed.{month}": bits for month, bits in bitmap['completed'].items()})
+            operations.append(UpdateOne(
+                {"user_id": user_id, "habit_id": habit_id, "year": year},
+                {"$set": fields},
+                upsert=True
+            ))
+    
+    habit_id, user_id, completions = None, DEFAULT_USER_ID, []
+    cursor = db.habit_completions.find(
+        {}, {"_id": 0, "habit_id": 1, "date": 1, "completed": 1, "user_id": 1}
+    ).sort([("user_id", ASCENDING), ("habit_id", ASCENDING), ("date", ASCENDING)])
+    async for completion in cursor:
+        if completion['habit_id'] != habit_id:
+            if completions:
+                add_habit(habit_id, user_id, completions)
+            habit_id, user_id, completions = completion['habit_id'], completion.get('user_id', DEFAULT_USER_ID), []
+        completions.append((completion_date_key(completion['date']), completion['completed']))
+        if len(operations) >= batch_size:
+            await db.habit_completion_bitmaps.bulk_write(operations, ordered=False)
+            written += len(operations)
+            operations = []
+    if completions:
+        add_habit(habit_id, user_id, completions)
+    if operations:
+        await db.habit_completion_bitmaps.bulk_write(operations, ordered=False)
+        written += len(operations)
+    return written
+
+async def update_habit_stats(user_id: str, habit_id: str, date_str: str,
+                             previous: Optional[bool], completed: bool) -> Dict:
+    """Apply one completion write to the habit's materialized stats"""
+    for _ in range(STATS_UPDATE_RETRIES):
+        stats = (await repository.get_stats(user_id, [habit_id])).get(habit_id)
+        if stats is None:
+            break
+        # Optimistic concurrency: only replace the version we read
+        version = stats['version']
+        apply_completion(stats, date_str, previous, completed)
+        stats['version'] = version + 1
+        if await repository.replace_stats(stats, version):
+            return stats
+    
+    # Missing document or persistent contention: rebuild from the history
+    rebuilt = await rebuild_habit_stats(user_id, [habit_id])
+    return rebuilt[habit_id]
+
+async def find_habit(user_id: str, habit_id: str) -> Optional[Dict]:
+    """One of the user's habit documents, or None"""
+    return await repository.find_habit(user_id, habit_id)
+
+async def get_habits_with_stats(user_id: str, habits: List[dict], today: date, include_history: bool = True,
+                                start: Optional[date] = None, end: Optional[date] = None) -> List[Dict]:
+    """Get stats for many of a user's habit documents using one query per collection
+    
+    Stats always cover the full history; include_history and the
+    [start, end] window only limit the completion_history returned.
+    """
+    habit_ids = [habit['id'] for habit in habits]
+    if include_history:
+        histories, stats_docs = await asyncio.gather(
+            repository.completion_histories(user_id, habit_ids, start, end),
+            get_habit_stats_docs(user_id, habit_ids)
+        )
+    else:
+        histories = {habit_id: {} for habit_id in habit_ids}
+        stats_docs = await get_habit_stats_docs(user_id, habit_ids)
+    return [build_habit_with_stats(habit, histories[habit['id']], stats_docs[habit['id']], today) for habit in habits]
 
-async def get_habit_with_stats(habit_id: str) -> Optional[HabitWithStats]:
+async def get_habit_with_stats(user_id: str, habit_id: str, today: date, include_history: bool = True,
+                               start: Optional[date] = None, end: Optional[date] = None) -> Optional[Dict]:
     """Get habit with calculated stats"""
-    habit = await db.habits.find_one({"id": habit_id})
+    habit = await find_habit(user_id, habit_id)
     if not habit:
         return None
     
-    completion_history = await get_habit_completion_history(habit_id)
-    
-    # Calculate stats
-    total_days = len(completion_history)
-    completed_days = sum(1 for completed in completion_history.values() if completed)
-    completion_rate = int((completed_days / total_days * 100)) if total_days > 0 else 0
-    
-    current_streak, best_streak = calculate_streaks(completion_history)
-    earned_badges = get_earned_badges(current_streak, best_streak, completion_rate)
-    
-    return HabitWithStats(
-        id=habit['id'],
-        name=habit['name'],
-        description=habit.get('description'),
-        category=habit['category'],
-        icon=habit['icon'],
-        color=habit['color'],
-        created_at=habit['created_at'],
-        current_streak=current_streak,
-        best_streak=best_streak,
-        total_days=total_days,
-        completion_rate=completion_rate,
-        completion_history=completion_history,
-        earned_badges=earned_badges
-    )
+    habits_with_stats = await get_habits_with_stats(user_id, [habit], today, include_history, start, end)
+    return habits_with_stats[0]
+
+def check_history_window(start: Optional[date], end: Optional[date]):
+    """Reject windows that end before they start"""
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+def select_fields(habits: List[Dict], fields: Optional[str]) -> List[Dict]:
+    """Limit serialized habits to a comma-separated list of fields"""
+    if not fields:
+        return habits
+    selected = {field.strip() for field in fields.split(',') if field.strip()}
+    unknown = selected - set(HabitWithStats.__fields__)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    selected.add('id')
+    return [{field: value for field, value in habit.items() if field in selected} for habit in habits]
+
+async def cached_response(request: Request, user_id: str, today: date, build, store: bool = True) -> Response:
+    """Serve a user's GET response from the cache, honouring If-None-Match
+    
+    The key covers the path, the query string and the user's local date,
+    since streaks and daily stats roll over at the user's midnight. With
+    store=False the response is built every time and only revalidated;
+    used for responses read from possibly lagging secondaries, which
+    could otherwise be cached under the generation a write just bumped.
+    """
+    if store:
+        key = (request.url.path, str(sorted(request.query_params.multi_items())), today.isoformat())
+        generation = await response_cache.generation(user_id)
+        entry = response_cache.get(user_id, key, generation)
+        if entry is None:
+            entry = response_cache.put(user_id, key, generation, dumps(await build()))
+        body, etag = entry.body, entry.etag
+    else:
+        body = dumps(await build())
+        etag = entity_tag(body)
+    
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+async def invalidate_user_cache(user_id: str):
+    """Drop cached reads after any write to the user's habits"""
+    await response_cache.invalidate(user_id)
+
+async def publish_event(user_id: str, event_type: str, **fields):
+    """Push a compact change event to the user's live update subscribers"""
+    await live_updates.publish(user_id, jsonable_encoder({"type": event_type, **fields}))
+
+COMPLETION_EVENT_FIELDS = ('current_streak', 'best_streak', 'total_days', 'completion_rate', 'earned_badges')
+
+def completion_event_fields(habit: Dict) -> Dict:
+    """Stats a client needs to patch a habit after a completion change"""
+    return {field: habit[field] for field in COMPLETION_EVENT_FIELDS}
+
+async def idempotent_response(request: Request, user_id: str, payload: BaseModel, handler) -> Response:
+    """Run a write once per Idempotency-Key, replaying its response to retries
+    
+    handler returns (status code, JSON body). Without the header the write
+    simply runs. Replays carry Idempotent-Replayed: true.
+    """
+    key = request.headers.get('idempotency-key')
+    if key is None:
+        status_code, body = await handler()
+        return Response(body, status_code=status_code, media_type="application/json")
+    if not key or len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters"
+        )
+    
+    fingerprint = hashlib.sha256(
+        b'\n'.join([request.method.encode(), request.url.path.encode(), dumps(payload.dict())])
+    ).hexdigest()
+    try:
+        stored, replayed = await idempotency_store.run(user_id, key, fingerprint, handler)
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return Response(stored.body, status_code=stored.status_code, media_type="application/json", headers=headers)
+
+# Indexes and query plans
+INDEXES = {
+    'habits': [
+        {'keys': [('user_id', ASCENDING), ('id', ASCENDING)], 'name': 'user_id_id_unique', 'unique': True},
+        # iter_habit_owners looks habits up by id alone, for rebuild-stats --habit-id
+        {'keys': [('id', ASCENDING)], 'name': 'id'},
+    ],
+    'habit_completions': [
+        {'keys': [('user_id', ASCENDING), ('habit_id', ASCENDING), ('date', ASCENDING)],
+         'name': 'user_id_habit_id_date_unique', 'unique': True},
+        {'keys': [('user_id', ASCENDING), ('date', ASCENDING), ('completed', ASCENDING)], 'name': 'user_id_date_completed'},
+    ],
+    'habit_completion_bitmaps': [
+        {'keys': [('user_id', ASCENDING), ('habit_id', ASCENDING), ('year', ASCENDING)],
+         'name': 'user_id_habit_id_year_unique', 'unique': True},
+    ],
+    'habit_stats': [
+        {'keys': [('user_id', ASCENDING), ('habit_id', ASCENDING)], 'name': 'user_id_habit_id_unique', 'unique': True},
+    ],
+    'user_settings': [
+        {'keys': [('user_id', ASCENDING)], 'name': 'user_id_unique', 'unique': True},
+    ],
+    'purge_jobs': [
+        {'keys': [('id', ASCENDING)], 'name': 'id_unique', 'unique': True},
+        {'keys': [('status', ASCENDING), ('created_at', ASCENDING)], 'name': 'status_created_at'},
+        {'keys': [('finished_at', ASCENDING)], 'name': 'finished_at_ttl', 'expireAfterSeconds': 7 * 24 * 3600},
+    ],
+    'daily_summaries': [
+        {'keys': [('user_id', ASCENDING), ('date', ASCENDING)], 'name': 'user_id_date_unique', 'unique': True},
+    ],
+    'badge_awards': [
+        {'keys': [('user_id', ASCENDING), ('habit_id', ASCENDING), ('badge_id', ASCENDING)],
+         'name': 'user_id_habit_id_badge_id_unique', 'unique': True},
+    ],
+    'user_rollups': [
+        {'keys': [('user_id', ASCENDING)], 'name': 'user_id_unique', 'unique': True},
+        {'keys': [('next_rollup_at', ASCENDING)], 'name': 'next_rollup_at'},
+    ],
+    # claim_job relies on the unique name to refuse a held lease
+    'job_leases': [
+        {'keys': [('name', ASCENDING)], 'name': 'name_unique', 'unique': True},
+    ],
+    # Only written with RESPONSE_CACHE_BACKEND=mongo; every cached read
+    # looks up the user's generation, and bumps upsert it
+    'cache_generations': [
+        {'keys': [('user_id', ASCENDING)], 'name': 'user_id_unique', 'unique': True},
+    ],
+    # Only written with LIVE_UPDATES_BACKEND=mongo; events are needed just long enough to fan out
+    'habit_events': [
+        {'keys': [('created_at', ASCENDING)], 'name': 'created_at_ttl', 'expireAfterSeconds': 3600},
+    ],
+    # Only written with IDEMPOTENCY_BACKEND=mongo
+    'idempotency_keys': [
+        {'keys': [('user_id', ASCENDING), ('key', ASCENDING)], 'name': 'user_id_key_unique', 'unique': True},
+        {'keys': [('created_at', ASCENDING)], 'name': 'created_at_ttl', 'expireAfterSeconds': int(IDEMPOTENCY_TTL_SECONDS)},
+    ],
+}
+
+async def ensure_indexes():
+    """Create the collection indexes; safe to run on every startup"""
+    for collection_name, indexes in INDEXES.items():
+        for index in indexes:
+            options = {k: v for k, v in index.items() if k != 'keys'}
+            try:
+                await db[collection_name].create_index(index['keys'], **options)
+            except OperationFailure as error:
+                # e.g. duplicate rows blocking a unique index; keep serving
+                logger.error(f"Could not create index {index['name']} on {collection_name}: {error}")
+
+def hot_queries() -> List[Dict]:
+    """Representative shapes of the queries issued by the API routes"""
+    probe_id = "explain-probe"
+    user_id = DEFAULT_USER_ID
+    today = date.today()
+    return [
+        {"name": "list_habits", "collection": "habits",
+         "filter": {"user_id": user_id, **ACTIVE_HABIT}},
+        {"name": "find_habit", "collection": "habits",
+         "filter": {"user_id": user_id, "id": probe_id, **ACTIVE_HABIT}},
+        {"name": "habit_completions", "collection": "habit_completions",
+         "filter": {"user_id": user_id, "habit_id": {"$in": [probe_id]}}},
+        {"name": "completion_by_day", "collection": "habit_completions",
+         "filter": {"user_id": user_id, "habit_id": probe_id, "date": today.isoformat()}},
+        {"name": "habit_bitmaps", "collection": "habit_completion_bitmaps",
+         "filter": {"user_id": user_id, "habit_id": {"$in": [probe_id]}, "year": {"$in": [today.year]}}},
+        {"name": "habit_stats", "collection": "habit_stats",
+         "filter": {"user_id": user_id, "habit_id": {"$in": [probe_id]}}},
+        {"name": "stats_window", "collection": "habit_completions",
+         "filter": {"user_id": user_id, "habit_id": {"$in": [probe_id]}, "completed": True,
+                    "date": {"$gte": (today - timedelta(days=STATS_WINDOW_DAYS - 1)).isoformat(),
+                             "$lte": today.isoformat()}}},
+    ]
+
+def plan_stages(plan) -> List[str]:
+    """Collect the stage names of an explain() winning plan"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for key, value in plan.items():
+            if key != 'rejectedPlans':
+                stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+async def explain_hot_queries() -> List[Dict]:
+    """Run explain() on every hot query and report the stages it uses"""
+    reports = []
+    for query in hot_queries():
+        explain = await db.command(
+            "explain",
+            {"find": query['collection'], "filter": query['filter']},
+            verbosity="queryPlanner"
+        )
+        stages = plan_stages(explain.get('queryPlanner', {}).get('winningPlan', {}))
+        reports.append({
+            "name": query['name'],
+            "collection": query['collection'],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return reports
 
 # API Routes
 @api_router.get("/")
@@ -186,39 +858,196 @@ async def root():
 
 # Habit CRUD operations
 @api_router.post("/habits", response_model=HabitWithStats)
-async def create_habit(habit_data: HabitCreate):
+async def create_habit(habit_data: HabitCreate, user_id: str = Depends(get_user_id),
+                       today: date = Depends(get_today)):
     """Create a new habit"""
-    habit = Habit(**habit_data.dict())
-    await db.habits.insert_one(habit.dict())
+    habit = Habit(**habit_data.dict(), user_id=user_id)
+    await repository.insert_habit(habit.dict())
+    await repository.request_rollup(user_id, datetime.utcnow())
+    await invalidate_user_cache(user_id)
     
     # Return habit with stats (will be empty initially)
-    return await get_habit_with_stats(habit.id)
+    habit_with_stats = await get_habit_with_stats(user_id, habit.id, today)
+    await publish_event(user_id, "habit_created", habit=habit_with_stats)
+    return FastJSONResponse(habit_with_stats)
 
 @api_router.get("/habits", response_model=List[HabitWithStats])
-async def get_all_habits():
-    """Get all habits with stats"""
-    habits = await db.habits.find({"user_id": "default"}).to_list(1000)
+async def get_all_habits(
+    request: Request,
+    include_history: bool = True,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    fields: Optional[str] = None,
+    user_id: str = Depends(get_user_id),
+    today: date = Depends(get_today)
+):
+    """Get all habits with stats
+    
+    completion_history can be limited to a from/to date window or left out
+    with include_history=false; fields selects a subset of habit fields.
+    """
+    check_history_window(from_date, to_date)
     
-    habits_with_stats = []
-    for habit in habits:
-        habit_stats = await get_habit_with_stats(habit['id'])
-        if habit_stats:
-            habits_with_stats.append(habit_stats)
+    async def build():
+        habits = await repository.list_habits(user_id)
+        habits_with_stats = await get_habits_with_stats(user_id, habits, today, include_history, from_date, to_date)
+        return select_fields(habits_with_stats, fields)
     
-    return habits_with_stats
+    return await cached_response(request, user_id, today, build)
+
+MAX_BATCH_HABITS = 200
+
+def parse_habit_ids(values: List[str]) -> List[str]:
+    """Habit ids from repeated and/or comma-separated values, in first-seen order"""
+    habit_ids = list(dict.fromkeys(
+        habit_id.strip() for value in values for habit_id in value.split(',') if habit_id.strip()
+    ))
+    if not habit_ids:
+        raise HTTPException(status_code=400, detail="ids must list at least one habit id")
+    if len(habit_ids) > MAX_BATCH_HABITS:
+        raise HTTPException(status_code=400, detail=f"ids can list at most {MAX_BATCH_HABITS} habits")
+    return habit_ids
+
+# Registered before /habits/{habit_id} so "batch" is not matched as a habit id
+@api_router.get("/habits/batch", response_model=HabitBatch)
+async def get_habits_batch(
+    request: Request,
+    ids: List[str] = Query([]),
+    include_history: bool = True,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    fields: Optional[str] = None,
+    user_id: str = Depends(get_user_id),
+    today: date = Depends(get_today)
+):
+    """Get several habits with stats in one request
+    
+    ids is a comma-separated list (or repeated parameter) of habit ids.
+    Habits are returned in the requested order; ids that match none of the
+    user's habits are listed in not_found. The other parameters are those
+    of GET /habits.
+    """
+    check_history_window(from_date, to_date)
+    habit_ids = parse_habit_ids(ids)
+    
+    async def build():
+        found = {habit['id']: habit for habit in await repository.list_habits(user_id, habit_ids)}
+        habits = [found[habit_id] for habit_id in habit_ids if habit_id in found]
+        habits_with_stats = await get_habits_with_stats(user_id, habits, today, include_history, from_date, to_date)
+        return {
+            "habits": select_fields(habits_with_stats, fields),
+            "not_found": [habit_id for habit_id in habit_ids if habit_id not in found]
+        }
+    
+    return await cached_response(request, user_id, today, build)
+
+# Statistics and analytics
+STATS_WINDOW_DAYS = 30
+WEEKLY_WINDOW_DAYS = 7
+
+def build_progress_series(daily_completed: Dict[str, int], end_date: date, days: int, total: int) -> List[Dict]:
+    """Build a per-day progress series ending at end_date, oldest first"""
+    series = []
+    for offset in range(days - 1, -1, -1):
+        date_str = (end_date - timedelta(days=offset)).isoformat()
+        completed = daily_completed.get(date_str, 0)
+        series.append({
+            "date": date_str,
+            "completed": completed,
+            "total": total,
+            "percentage": int((completed / total * 100)) if total > 0 else 0
+        })
+    return series
+
+async def load_completed_by_day(user_id: str, habit_ids: List[str], start: date, today: date) -> Dict[str, int]:
+    """Completed habits per day up to today, reading rolled-up days from daily_summaries
+    
+    Days before the first one without an up-to-date summary are lookups;
+    from that day on (usually just today) they are counted from the
+    completions, so a toggle is reflected at once. Both read the primary:
+    toggles mark past summaries stale there, and the result is cached.
+    """
+    summarized = await repository.daily_summaries(user_id, start, today - timedelta(days=1))
+    live_start = start
+    while live_start < today and live_start.isoformat() in summarized:
+        live_start += timedelta(days=1)
+    
+    daily_completed = {date_str: completed for date_str, completed in summarized.items()
+                       if date_str < live_start.isoformat()}
+    daily_completed.update(await repository.count_completed_by_day(user_id, habit_ids, live_start, today))
+    return daily_completed
+
+# Registered before /habits/{habit_id} so "stats" is not matched as a habit id
+@api_router.get("/habits/stats", response_model=HabitStats)
+async def get_habit_stats(request: Request, user_id: str = Depends(get_user_id), today: date = Depends(get_today)):
+    """Get overall habit statistics"""
+    return await cached_response(request, user_id, today, lambda: compute_habit_stats(user_id, today))
+
+async def compute_habit_stats(user_id: str, today: date) -> HabitStats:
+    """Compute a user's overall habit statistics up to their local today"""
+    habits = await repository.list_habits(user_id, fields=["id"])
+    
+    if not habits:
+        return HabitStats(
+            total_habits=0,
+            active_streaks=0,
+            today_completed=0,
+            today_total=0,
+            today_percentage=0,
+            weekly_progress=[],
+            monthly_progress=[]
+        )
+    
+    window_start = today - timedelta(days=STATS_WINDOW_DAYS - 1)
+    habit_ids = [habit['id'] for habit in habits]
+    
+    # Completed counts per day come from the daily summaries, with only
+    # the days not rolled up yet counted from completions; active streaks
+    # come from the materialized per-habit stats
+    daily_completed, stats_docs = await asyncio.gather(
+        load_completed_by_day(user_id, habit_ids, window_start, today),
+        get_habit_stats_docs(user_id, habit_ids)
+    )
+    
+    today_ordinal = today.toordinal()
+    active_streaks = sum(1 for stats in stats_docs.values() if current_streak(stats, today_ordinal) > 0)
+    
+    today_total = len(habits)
+    monthly_progress = build_progress_series(daily_completed, today, STATS_WINDOW_DAYS, today_total)
+    weekly_progress = monthly_progress[-WEEKLY_WINDOW_DAYS:]
+    today_progress = monthly_progress[-1]
+    
+    return HabitStats(
+        total_habits=today_total,
+        active_streaks=active_streaks,
+        today_completed=today_progress['completed'],
+        today_total=today_total,
+        today_percentage=today_progress['percentage'],
+        weekly_progress=weekly_progress,
+        monthly_progress=monthly_progress
+    )
 
 @api_router.get("/habits/{habit_id}", response_model=HabitWithStats)
-async def get_habit(habit_id: str):
+async def get_habit(
+    habit_id: str,
+    include_history: bool = True,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    user_id: str = Depends(get_user_id),
+    today: date = Depends(get_today)
+):
     """Get a specific habit with stats"""
-    habit_stats = await get_habit_with_stats(habit_id)
+    check_history_window(from_date, to_date)
+    habit_stats = await get_habit_with_stats(user_id, habit_id, today, include_history, from_date, to_date)
     if not habit_stats:
         raise HTTPException(status_code=404, detail="Habit not found")
-    return habit_stats
+    return FastJSONResponse(habit_stats)
 
 @api_router.put("/habits/{habit_id}", response_model=HabitWithStats)
-async def update_habit(habit_id: str, habit_data: HabitUpdate):
+async def update_habit(habit_id: str, habit_data: HabitUpdate, user_id: str = Depends(get_user_id),
+                       today: date = Depends(get_today)):
     """Update a habit"""
-    habit = await db.habits.find_one({"id": habit_id})
+    habit = await find_habit(user_id, habit_id)
     if not habit:
         raise HTTPException(status_code=404, detail="Habit not found")
     
@@ -226,168 +1055,593 @@ async def update_habit(habit_id: str, habit_data: HabitUpdate):
     update_data = {k: v for k, v in habit_data.dict().items() if v is not None}
     
     if update_data:
-        await db.habits.update_one(
-            {"id": habit_id},
-            {"$set": update_data}
-        )
+        await repository.update_habit(user_id, habit_id, update_data)
+        await invalidate_user_cache(user_id)
+        await publish_event(user_id, "habit_updated", habit_id=habit_id, changes=update_data)
     
-    return await get_habit_with_stats(habit_id)
+    return FastJSONResponse(await get_habit_with_stats(user_id, habit_id, today))
 
 @api_router.delete("/habits/{habit_id}")
-async def delete_habit(habit_id: str):
-    """Delete a habit and all its completions"""
-    habit = await db.habits.find_one({"id": habit_id})
-    if not habit:
+async def delete_habit(habit_id: str, user_id: str = Depends(get_user_id)):
+    """Delete a habit
+    
+    The habit is hidden at once; its completions, stats and badge awards
+    are removed in the background. Progress is served at /purges/{purge_id}.
+    """
+    if not await repository.delete_habits(user_id, [habit_id], datetime.utcnow()):
         raise HTTPException(status_code=404, detail="Habit not found")
     
-    # Delete habit and all completions
-    await db.habits.delete_one({"id": habit_id})
-    await db.habit_completions.delete_many({"habit_id": habit_id})
+    purge_id = await repository.schedule_purge(user_id, [habit_id])
+    if purge_id is None:
+        # Purged already, with the summaries that counted the habit
+        await repository.request_rollup(user_id, datetime.utcnow())
+    await invalidate_user_cache(user_id)
+    await publish_event(user_id, "habit_deleted", habit_id=habit_id)
+    
+    return {"message": "Habit deleted successfully", "purge_id": purge_id}
+
+@api_router.delete("/account")
+async def delete_account(user_id: str = Depends(get_user_id)):
+    """Delete all of the user's habits and settings, purged like single habits"""
+    habit_ids = [habit['id'] for habit in await repository.list_habits(user_id, fields=["id"])]
+    await repository.delete_habits(user_id, habit_ids, datetime.utcnow())
+    purge_id = await repository.schedule_purge(user_id, habit_ids, whole_user=True)
+    await invalidate_user_cache(user_id)
+    for habit_id in habit_ids:
+        await publish_event(user_id, "habit_deleted", habit_id=habit_id)
     
-    return {"message": "Habit deleted successfully"}
+    return {"message": "Account deleted successfully", "purge_id": purge_id}
+
+# Deleted habits are purged by the repository: at once on SQLite, by
+# leased background jobs on Mongo, checkpointed after every batch
+async def run_purges() -> int:
+    """Run queued purges one at a time until none is left; returns how many finished"""
+    finished = 0
+    while (purge := await repository.claim_purge()) is not None:
+        if await repository.run_purge(purge):
+            if not purge['whole_user']:
+                await repository.request_rollup(purge['user_id'], datetime.utcnow())
+            await invalidate_user_cache(purge['user_id'])
+            finished += 1
+    return finished
+
+if PURGE_INTERVAL_SECONDS > 0:
+    scheduler.add_job("purge_deleted", run_purges, PURGE_INTERVAL_SECONDS)
+
+@api_router.get("/purges/{purge_id}", response_model=PurgeStatus)
+async def get_purge(purge_id: str, user_id: str = Depends(get_user_id)):
+    """Progress of a purge started by deleting a habit or the account"""
+    purge = await repository.get_purge(user_id, purge_id)
+    if not purge:
+        raise HTTPException(status_code=404, detail="Purge not found")
+    stages_done, stages_total = purge_progress(purge)
+    return PurgeStatus(**purge, stages_done=stages_done, stages_total=stages_total)
 
 # Habit completion operations
-@api_router.post("/habits/{habit_id}/completions")
-async def toggle_habit_completion(habit_id: str, completion_data: HabitCompletionToggle):
-    """Toggle habit completion for a specific date"""
-    habit = await db.habits.find_one({"id": habit_id})
-    if not habit:
-        raise HTTPException(status_code=404, detail="Habit not found")
+# Concurrent toggles of the same habit and date in this process share one
+# write; every caller gets the habit as of the last toggle applied
+completion_writes = WriteCoalescer()
+
+async def write_completion(user_id: str, habit: Dict, date_str: str, completed: bool, today: date) -> Dict:
+    """Set one completion and refresh everything derived from it
     
-    # Check if completion already exists
-    existing_completion = await db.habit_completions.find_one({
-        "habit_id": habit_id,
-        "date": completion_data.date
-    })
-    
-    if existing_completion:
-        # Update existing completion
-        await db.habit_completions.update_one(
-            {"habit_id": habit_id, "date": completion_data.date},
-            {"$set": {"completed": completion_data.completed}}
-        )
-    else:
-        # Create new completion
-        completion = HabitCompletion(
-            habit_id=habit_id,
-            date=completion_data.date,
-            completed=completion_data.completed
+    The returned habit's completion_history holds only the toggled date;
+    clients merge it into the history they already have.
+    """
+    habit_id = habit['id']
+    previous = await repository.set_completion(user_id, habit_id, date_str, completed)
+    stats, _ = await asyncio.gather(
+        update_habit_stats(user_id, habit_id, date_str, previous, completed),
+        mark_daily_summary_stale(user_id, date_str, previous, completed, today)
+    )
+    await invalidate_user_cache(user_id)
+    
+    habit_with_stats = build_habit_with_stats(habit, {date_str: completed}, stats, today)
+    await publish_event(
+        user_id, "completion", habit_id=habit_id, date=date_str, completed=completed,
+        **completion_event_fields(habit_with_stats)
+    )
+    if completed:
+        # Badges are earned by completing; the daily rollup only catches up
+        await publish_badge_awards(user_id, await award_badges(user_id, {habit_id: stats}, today))
+    return {
+        "message": "Completion updated successfully",
+        "habit": habit_with_stats
+    }
+
+@api_router.post("/habits/{habit_id}/completions", response_model=HabitCompletionResult)
+async def toggle_habit_completion(habit_id: str, completion_data: HabitCompletionToggle, request: Request,
+                                  user_id: str = Depends(get_user_id), today: date = Depends(get_today)):
+    """Toggle habit completion for a specific date
+    
+    Accepts an Idempotency-Key header; a retry with the same key gets the
+    original response without toggling again.
+    """
+    async def toggle():
+        habit = await find_habit(user_id, habit_id)
+        if not habit:
+            raise HTTPException(status_code=404, detail="Habit not found")
+        
+        date_str = completion_data.date.isoformat()
+        result = await completion_writes.submit(
+            (user_id, habit_id, date_str), completion_data.completed,
+            lambda completed: write_completion(user_id, habit, date_str, completed, today)
         )
-        await db.habit_completions.insert_one(completion.dict())
+        return 200, dumps(result)
     
-    return {"message": "Completion updated successfully"}
+    return await idempotent_response(request, user_id, completion_data, toggle)
+
+# Bulk completion ingest
+BULK_BATCH_SIZE = 1000
+
+async def iter_bulk_records(request: Request) -> AsyncIterator:
+    """Yield raw records from a JSON array body or an NDJSON stream"""
+    if 'ndjson' in request.headers.get('content-type', ''):
+        buffer = b''
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                if line.strip():
+                    yield line
+        if buffer.strip():
+            yield buffer
+        return
+    
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    for item in body:
+        yield item
+
+def chunked(items: List, size: int) -> List[List]:
+    """Split a list into consecutive chunks of at most size items"""
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+def parse_bulk_record(raw) -> HabitCompletionRecord:
+    """Validate one bulk record, decoding NDJSON lines first"""
+    if isinstance(raw, (bytes, str)):
+        raw = json.loads(raw)
+    if not isinstance(raw, dict):
+        raise ValueError("Record must be an object")
+    return HabitCompletionRecord(**raw)
+
+async def write_completion_batch(user_id: str, batch: List[Tuple[int, HabitCompletionRecord]]) -> List[Dict]:
+    """Upsert a batch of a user's completions in one unordered bulk write"""
+    results = []
+    habit_ids = list({record.habit_id for _, record in batch})
+    known_ids = {habit['id'] for habit in await repository.list_habits(user_id, habit_ids, fields=["id"])}
+    
+    records = []
+    operation_indexes = []
+    for index, record in batch:
+        if record.habit_id not in known_ids:
+            results.append({"index": index, "status": "error", "error": "Habit not found"})
+            continue
+        records.append((record.habit_id, record.date.isoformat(), record.completed))
+        operation_indexes.append(index)
+    
+    write_errors = await repository.set_completions(user_id, records)
+    
+    for position, index in enumerate(operation_indexes):
+        if position in write_errors:
+            results.append({"index": index, "status": "error", "error": write_errors[position]})
+        else:
+            results.append({"index": index, "status": "ok"})
+    return results
+
+@api_router.post("/completions/bulk", response_model=BulkCompletionResult)
+async def bulk_upsert_completions(request: Request, user_id: str = Depends(get_user_id)):
+    """Upsert many completions from a JSON array or an NDJSON stream
+    
+    Records are {habit_id, date, completed}; results are reported per
+    record, by position in the input.
+    """
+    started = time.perf_counter()
+    results = []
+    batch = []
+    written_habit_ids = set()
+    written_dates = set()
+    received = 0
+    
+    async def flush(batch):
+        batch_results = await write_completion_batch(user_id, batch)
+        written_indexes = {result['index'] for result in batch_results if result['status'] == 'ok'}
+        written = [record for index, record in batch if index in written_indexes]
+        written_habit_ids.update(record.habit_id for record in written)
+        written_dates.update(record.date for record in written)
+        results.extend(batch_results)
+    
+    async for raw in iter_bulk_records(request):
+        index = received
+        received += 1
+        try:
+            batch.append((index, parse_bulk_record(raw)))
+        except (ValueError, TypeError, ValidationError) as error:
+            results.append({"index": index, "status": "error", "error": str(error)})
+            continue
+        if len(batch) >= BULK_BATCH_SIZE:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    
+    # Materialized stats are rebuilt once per touched habit, not per record
+    for habit_ids in chunked(sorted(written_habit_ids), BULK_BATCH_SIZE):
+        await rebuild_habit_stats(user_id, habit_ids)
+    if written_habit_ids:
+        # Summaries of the written days are rolled up again on the next pass
+        await discard_daily_summaries(user_id, min(written_dates))
+        await invalidate_user_cache(user_id)
+        # Too many days to send as deltas; clients refetch the listed habits
+        await publish_event(user_id, "completions_bulk", habit_ids=sorted(written_habit_ids))
+    
+    results.sort(key=lambda result: result['index'])
+    written = sum(1 for result in results if result['status'] == 'ok')
+    elapsed = time.perf_counter() - started
+    return BulkCompletionResult(
+        received=received,
+        written=written,
+        failed=received - written,
+        records_per_second=round(received / elapsed, 1) if elapsed > 0 else 0.0,
+        results=results
+    )
+
+COMPLETIONS_PAGE_SIZE = 366
+MAX_COMPLETIONS_PAGE_SIZE = 5000
 
 @api_router.get("/habits/{habit_id}/completions")
-async def get_habit_completions(habit_id: str):
-    """Get completion history for a habit"""
-    habit = await db.habits.find_one({"id": habit_id})
+async def get_habit_completions(
+    habit_id: str,
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    cursor: Optional[date] = None,
+    limit: int = Query(COMPLETIONS_PAGE_SIZE, ge=1, le=MAX_COMPLETIONS_PAGE_SIZE),
+    user_id: str = Depends(get_user_id)
+):
+    """Get completion history for a habit, oldest first
+    
+    Pages hold at most limit entries; pass next_cursor back as cursor to
+    fetch the following page.
+    """
+    check_history_window(from_date, to_date)
+    habit = await find_habit(user_id, habit_id)
     if not habit:
         raise HTTPException(status_code=404, detail="Habit not found")
     
-    completions = await db.habit_completions.find({"habit_id": habit_id}).to_list(1000)
+    completions, next_cursor = await get_completion_page(
+        user_id, habit_id, from_date, to_date, cursor.isoformat() if cursor else None, limit
+    )
     return {
         "habit_id": habit_id,
-        "completions": [
-            {
-                "date": completion['date'].isoformat() if isinstance(completion['date'], datetime) else str(completion['date']),
-                "completed": completion['completed']
-            }
-            for completion in completions
-        ]
+        "completions": completions,
+        "next_cursor": next_cursor
     }
 
-# Statistics and analytics
-@api_router.get("/habits/stats", response_model=HabitStats)
-async def get_habit_stats():
-    """Get overall habit statistics"""
-    habits = await db.habits.find({"user_id": "default"}).to_list(1000)
+# Trend analytics
+ANALYTICS_WINDOW_DAYS = 365
+MAX_ANALYTICS_WINDOW_DAYS = 3660
+ANALYTICS_GROUPS = ('category', 'habit', 'none')
+
+def analytics_reads_may_lag() -> bool:
+    """Whether analytics reads may be served by a secondary behind the latest writes"""
+    return STORAGE_BACKEND == 'mongo' and MONGO_ANALYTICS_READ_PREFERENCE != 'primary'
+
+async def compute_trends(user_id: str, window: int, group: str, today: date) -> Dict:
+    """Rolling rates, weekday heatmap and streak distribution per habit group
     
-    if not habits:
-        return HabitStats(
-            total_habits=0,
-            active_streaks=0,
-            today_completed=0,
-            today_total=0,
-            today_percentage=0,
-            weekly_progress=[],
-            monthly_progress=[]
-        )
+    Reads with the analytics read preference, so on a replica set the
+    latest writes may take a moment to show up.
+    """
+    import numpy as np
+    from analytics import completion_matrix, trends
     
-    # Calculate today's stats
-    today = date.today()
-    today_completions = await db.habit_completions.find({
-        "date": today,
-        "completed": True
-    }).to_list(1000)
+    end = today
+    start = end - timedelta(days=window - 1)
+    habits = await repository.list_habits(user_id, fields=["id", "name", "category", "created_at"], analytics=True)
+    habit_ids = [habit['id'] for habit in habits]
     
-    today_completed = len(today_completions)
-    today_total = len(habits)
-    today_percentage = int((today_completed / today_total * 100)) if today_total > 0 else 0
-    
-    # Calculate active streaks
-    active_streaks = 0
-    for habit in habits:
-        completion_history = await get_habit_completion_history(habit['id'])
-        current_streak, _ = calculate_streaks(completion_history)
-        if current_streak > 0:
-            active_streaks += 1
-    
-    # Calculate weekly progress (last 7 days)
-    weekly_progress = []
-    for i in range(7):
-        check_date = date.today()
-        check_date = check_date.replace(day=check_date.day - i)
-        
-        day_completions = await db.habit_completions.find({
-            "date": check_date,
-            "completed": True
-        }).to_list(1000)
-        
-        completed = len(day_completions)
-        percentage = int((completed / today_total * 100)) if today_total > 0 else 0
-        
-        weekly_progress.append({
-            "date": check_date.isoformat(),
-            "completed": completed,
-            "total": today_total,
-            "percentage": percentage
-        })
+    habit_index, day_offset = await repository.completed_day_offsets(user_id, habit_ids, start, end, analytics=True)
+    matrix = completion_matrix(habit_index, day_offset, len(habits), window)
+    created_offset = np.array([(habit['created_at'].date() - start).days for habit in habits], dtype=np.int64)
+    group_keys = [habit['category'] if group == 'category' else habit['id'] if group == 'habit' else 'all'
+                  for habit in habits]
     
-    weekly_progress.reverse()  # Show oldest to newest
+    result = trends(matrix, created_offset, group_keys, start.toordinal())
+    if group == 'habit':
+        names = {habit['id']: habit['name'] for habit in habits}
+        for habit_group in result['groups']:
+            habit_group['name'] = names[habit_group['key']]
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "window": window,
+        "group": group,
+        **result
+    }
+
+@api_router.get("/analytics/trends")
+async def get_trends(
+    request: Request,
+    window: int = Query(ANALYTICS_WINDOW_DAYS, ge=7, le=MAX_ANALYTICS_WINDOW_DAYS),
+    group: str = 'category',
+    user_id: str = Depends(get_user_id),
+    today: date = Depends(get_today)
+):
+    """Completion trends over the last window days, grouped by category or habit
     
-    # Calculate monthly progress (last 30 days)
-    monthly_progress = []
-    for i in range(30):
-        check_date = date.today()
-        check_date = check_date.replace(day=check_date.day - i)
-        
-        day_completions = await db.habit_completions.find({
-            "date": check_date,
-            "completed": True
-        }).to_list(1000)
-        
-        completed = len(day_completions)
-        percentage = int((completed / today_total * 100)) if today_total > 0 else 0
-        
-        monthly_progress.append({
-            "date": check_date.isoformat(),
-            "completed": completed,
-            "total": today_total,
-            "percentage": percentage
-        })
+    Each group has daily, rolling_7 and rolling_30 completion rates (oldest
+    day first), weekday_rates (Monday first) and a histogram of completed
+    run lengths; runs are cut at the window start.
+    """
+    if group not in ANALYTICS_GROUPS:
+        raise HTTPException(status_code=400, detail=f"group must be one of {', '.join(ANALYTICS_GROUPS)}")
+    return await cached_response(
+        request, user_id, today, lambda: compute_trends(user_id, window, group, today),
+        store=not analytics_reads_may_lag()
+    )
+
+# Streaming exports
+EXPORT_BATCH_SIZE = 1000
+
+def export_rows(dataset: str, user_id: Optional[str] = None, start: Optional[date] = None,
+                end: Optional[date] = None, batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[Dict]:
+    """Row iterator for an export dataset"""
+    if dataset == 'habits':
+        return repository.iter_habits(user_id, batch_size)
+    return repository.iter_completions(user_id, start, end, batch_size)
+
+@api_router.get("/export/{dataset}")
+async def export_dataset(
+    dataset: str,
+    export_format: str = Query("ndjson", alias="format"),
+    from_date: Optional[date] = Query(None, alias="from"),
+    to_date: Optional[date] = Query(None, alias="to"),
+    user_id: str = Depends(get_user_id)
+):
+    """Stream the user's habits or completions as NDJSON or CSV
     
-    monthly_progress.reverse()  # Show oldest to newest
+    from/to limit completions to a date window. Parquet is written by the
+    export CLI command (manage.py export), since it needs a seekable file.
+    """
+    if dataset not in EXPORT_COLUMNS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {dataset!r}")
+    if export_format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    check_history_window(from_date, to_date)
     
-    return HabitStats(
-        total_habits=today_total,
-        active_streaks=active_streaks,
-        today_completed=today_completed,
-        today_total=today_total,
-        today_percentage=today_percentage,
-        weekly_progress=weekly_progress,
-        monthly_progress=monthly_progress
+    rows = export_rows(dataset, user_id, from_date, to_date)
+    encode = ndjson_chunks if export_format == 'ndjson' else csv_chunks
+    return StreamingResponse(
+        encode(rows, EXPORT_COLUMNS[dataset], EXPORT_BATCH_SIZE),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="{dataset}.{export_format}"'}
+    )
+
+# Live updates
+SSE_HEARTBEAT_SECONDS = 15
+
+# A browser EventSource cannot send headers, so clients first exchange
+# their credentials for a short-lived stream token passed in the query
+# string. Without JWT_SECRET users are not authenticated and the token
+# only carries the user id.
+EVENTS_TOKEN_TTL_SECONDS = 60
+EVENTS_TOKEN_AUDIENCE = "events"
+EVENTS_TOKEN_SECRET = JWT_SECRET or "unauthenticated live updates stream token"
+
+class EventsToken(BaseModel):
+    token: str
+    expires_in: int
+
+async def get_stream_user_id(request: Request) -> str:
+    """Resolve the user of an event stream from its token, or from the request headers"""
+    token = request.query_params.get('token')
+    if token is None:
+        return await get_user_id(request)
+    try:
+        claims = jwt.decode(token, EVENTS_TOKEN_SECRET, algorithms=["HS256"], audience=EVENTS_TOKEN_AUDIENCE)
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid events token")
+    return valid_user_id(claims.get('sub'))
+
+@api_router.post("/events/token", response_model=EventsToken)
+async def create_events_token(user_id: str = Depends(get_user_id)):
+    """Issue a short-lived token that opens the user's event stream
+    
+    Only checked when the stream connects; an open stream outlives it.
+    """
+    expires_at = datetime.utcnow() + timedelta(seconds=EVENTS_TOKEN_TTL_SECONDS)
+    token = jwt.encode(
+        {"sub": user_id, "aud": EVENTS_TOKEN_AUDIENCE, "exp": expires_at}, EVENTS_TOKEN_SECRET, algorithm="HS256"
+    )
+    return EventsToken(token=token, expires_in=EVENTS_TOKEN_TTL_SECONDS)
+
+@api_router.get("/events")
+async def stream_events(request: Request, user_id: str = Depends(get_stream_user_id)):
+    """Stream the user's habit changes as server-sent events
+    
+    Authenticated by a token from POST /api/events/token in the token
+    query parameter, or by the usual headers. Events are habit_created,
+    habit_updated, habit_deleted, completion and completions_bulk; a
+    comment line is sent as a heartbeat while idle.
+    """
+    queue = live_updates.subscribe(user_id)
+    
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+        finally:
+            live_updates.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
 
+# User settings
+@api_router.get("/settings", response_model=UserSettings)
+async def get_settings(user_id: str = Depends(get_user_id)):
+    """Get the requesting user's settings"""
+    return await get_user_settings(user_id)
+
+@api_router.put("/settings", response_model=UserSettings)
+async def update_settings(settings_data: UserSettingsUpdate, user_id: str = Depends(get_user_id)):
+    """Update the requesting user's settings
+    
+    timezone is an IANA name such as "Europe/Paris"; it sets the local
+    midnight at which the user's streaks and daily stats roll over.
+    """
+    try:
+        load_timezone(settings_data.timezone)
+    except ValueError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    
+    await repository.save_settings(user_id, settings_data.dict())
+    user_timezones.pop(user_id, None)
+    await repository.request_rollup(user_id, next_local_midnight(settings_data.timezone))
+    # Cached reads were keyed on the previous local date
+    await invalidate_user_cache(user_id)
+    return await get_user_settings(user_id)
+
+# Daily summaries and badge awards, rolled up by the background jobs
+ROLLUP_BATCH_SIZE = 100
+# Held for the whole interval, so that each interval runs one pass
+ROLLUP_LEASE_SECONDS = BACKGROUND_JOBS_INTERVAL_SECONDS or 60
+rollup_users_added = False
+
+def next_local_midnight(timezone: str) -> datetime:
+    """The next midnight in a timezone, as a naive UTC datetime like the stored ones"""
+    zone = load_timezone(timezone)
+    tomorrow = datetime.now(zone).date() + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time(), tzinfo=zone).astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
+
+async def mark_daily_summary_stale(user_id: str, date_str: str, previous: Optional[bool], completed: bool,
+                                   today: date):
+    """Flag a past day a toggle changed, so reads count it live until a rollup recounts it
+    
+    A marker rather than an adjusted count: the toggle may land between a
+    rollup counting the day and storing its summary, or it may already be
+    in that count. Either way the rollup's next recount is right.
+    """
+    if bool(previous) != completed and date_str < today.isoformat():
+        await repository.mark_daily_summary_stale(user_id, date_str)
+
+async def discard_daily_summaries(user_id: str, start: Optional[date] = None):
+    """Drop a user's summaries from start on; reads count those days until they are rolled up again"""
+    await repository.delete_daily_summaries(user_id, start)
+    await repository.request_rollup(user_id, datetime.utcnow())
+
+async def roll_up_days(user_id: str, habit_ids: List[str], today: date) -> bool:
+    """Summarize the user's finished days in the stats window that have no summary yet
+    
+    Returns True when this call rolled up yesterday, i.e. it is the first
+    pass since the user's local midnight.
+    """
+    yesterday = today - timedelta(days=1)
+    window_start = today - timedelta(days=STATS_WINDOW_DAYS - 1)
+    summarized = await repository.daily_summaries(user_id, window_start, yesterday)
+    missing = [
+        day for day in (window_start + timedelta(days=offset) for offset in range(STATS_WINDOW_DAYS - 1))
+        if day.isoformat() not in summarized
+    ]
+    if not missing:
+        return False
+    
+    # Read before counting: a day marked stale again after this read keeps
+    # its marker, and the next rollup counts it again
+    stale = await repository.stale_daily_summaries(user_id, missing[0], yesterday)
+    daily_completed = await repository.count_completed_by_day(user_id, habit_ids, missing[0], yesterday)
+    counts = {day.isoformat(): daily_completed.get(day.isoformat(), 0) for day in missing}
+    # Summaries another worker wrote, and days marked since the read, are
+    # left untouched
+    inserted = await repository.insert_daily_summaries(
+        user_id, {date_str: count for date_str, count in counts.items() if date_str not in stale}, len(habit_ids)
+    )
+    refreshed = await repository.refresh_daily_summaries(
+        user_id, {date_str: counts[date_str] for date_str in stale}, len(habit_ids), stale
+    )
+    return missing[-1] == yesterday and yesterday.isoformat() in inserted + refreshed
+
+async def award_badges(user_id: str, stats_docs: Dict[str, Dict], today: date) -> List[Dict]:
+    """Persist badges newly earned by the user's habits; returns the new awards"""
+    today_ordinal = today.toordinal()
+    earned = {
+        (habit_id, badge_id)
+        for habit_id, stats in stats_docs.items()
+        for badge_id in get_earned_badges(current_streak(stats, today_ordinal), stats['best_streak'],
+                                          completion_rate(stats))
+    }
+    if not earned:
+        return []
+    if len(stats_docs) > 1:
+        # A rollup covers all the user's habits, whose badges were mostly
+        # awarded long ago; a toggle's few go straight to the insert
+        earned -= {(award['habit_id'], award['badge_id']) for award in await repository.list_badge_awards(user_id)}
+    # Awards already made, by this or another worker, are left out
+    new_awards = await repository.insert_badge_awards([
+        {"user_id": user_id, "habit_id": habit_id, "badge_id": badge_id, "awarded_at": datetime.utcnow()}
+        for habit_id, badge_id in sorted(earned)
+    ])
+    return [{field: award[field] for field in ('habit_id', 'badge_id', 'awarded_at')} for award in new_awards]
+
+async def publish_badge_awards(user_id: str, awards: List[Dict]):
+    if awards:
+        await publish_event(user_id, "badges_awarded", awards=[
+            {**award, "name": BADGES[award['badge_id']]['name']} for award in awards
+        ])
+
+async def roll_up_user(user_id: str):
+    """Daily summaries, streak resets and badge awards for one user, then
+    schedule the next rollup at the user's next local midnight"""
+    timezone = await get_user_timezone(user_id)
+    today = datetime.now(load_timezone(timezone)).date()
+    habit_ids = [habit['id'] for habit in await repository.list_habits(user_id, fields=["id"])]
+    if not habit_ids:
+        await repository.set_next_rollup(user_id, next_local_midnight(timezone))
+        return
+    stats_docs = await get_habit_stats_docs(user_id, habit_ids)
+    
+    if await roll_up_days(user_id, habit_ids, today):
+        # Streaks last completed the day before yesterday broke at midnight
+        today_ordinal = today.toordinal()
+        broken = sorted(
+            habit_id for habit_id, stats in stats_docs.items()
+            if current_streak(stats, today_ordinal - 1) and not current_streak(stats, today_ordinal)
+        )
+        if broken:
+            await publish_event(user_id, "streaks_reset", habit_ids=broken)
+    
+    await publish_badge_awards(user_id, await award_badges(user_id, stats_docs, today))
+    await repository.set_next_rollup(user_id, next_local_midnight(timezone))
+
+async def run_daily_rollups() -> Dict[str, int]:
+    """One background pass over the users due for a rollup, unless another worker leased this interval's pass"""
+    global rollup_users_added
+    if not await repository.claim_job("daily_rollups", ROLLUP_LEASE_SECONDS):
+        return {"users": 0, "rolled_up": 0}
+    now = datetime.utcnow()
+    if not rollup_users_added:
+        # Users with habits from before rollups were scheduled are due at once
+        await repository.add_rollup_users(await repository.list_user_ids(), now)
+        rollup_users_added = True
+    user_ids = await repository.due_rollup_users(now)
+    rolled_up = await run_batched(user_ids, roll_up_user, ROLLUP_BATCH_SIZE, BACKGROUND_JOBS_CONCURRENCY)
+    return {"users": len(user_ids), "rolled_up": rolled_up}
+
+if BACKGROUND_JOBS_INTERVAL_SECONDS > 0:
+    scheduler.add_job("daily_rollups", run_daily_rollups, BACKGROUND_JOBS_INTERVAL_SECONDS)
+
 @api_router.get("/categories")
 async def get_categories():
     """Get available habit categories"""
@@ -408,6 +1662,43 @@ async def get_badges():
     """Get available badges"""
     return {"badges": BADGES}
 
+@api_router.get("/badges/awards")
+async def get_badge_awards(user_id: str = Depends(get_user_id)):
+    """Badges awarded to the requesting user's habits, newest first"""
+    return {"awards": await repository.list_badge_awards(user_id)}
+
+@api_router.get("/diagnostics/query-plans")
+async def get_query_plans():
+    """Report the winning plan of each hot query and flag collection scans"""
+    if db is None:
+        raise HTTPException(status_code=501, detail="Query plans are only available with STORAGE_BACKEND=mongo")
+    plans = await explain_hot_queries()
+    return {
+        "plans": plans,
+        "collscans": [plan['name'] for plan in plans if plan['collscan']]
+    }
+
+@app.get("/health", include_in_schema=False)
+async def get_health():
+    """Liveness probe: the worker is up and serving"""
+    return {"status": "ok"}
+
+@app.get("/ready", include_in_schema=False)
+async def get_ready():
+    """Readiness probe: the worker has warmed up and its storage answers"""
+    if not warmed_up:
+        return JSONResponse({"status": "warming up"}, status_code=503)
+    try:
+        await asyncio.wait_for(repository.ping(), READY_PING_TIMEOUT_SECONDS)
+    except Exception as error:
+        return JSONResponse({"status": "storage unavailable", "detail": str(error)}, status_code=503)
+    return {"status": "ready"}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Request metrics in the Prometheus text format"""
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -417,6 +1708,13 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Idempotent-Replayed"],
+)
+
+app.add_middleware(
+    MetricsMiddleware,
+    registry=metrics_registry,
+    slow_request_seconds=float(SLOW_REQUEST_MS) / 1000 if SLOW_REQUEST_MS else None
 )
 
 # Configure logging
@@ -426,6 +1724,3 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
@@ -0,0 +1,583 @@
+"""SQLite storage backend: the whole app in one local database file.
+
+Selected with STORAGE_BACKEND=sqlite; no database server is needed. The
+file is opened in WAL mode, so readers never block the writer, and with
+synchronous=NORMAL, which only syncs at checkpoints.
+
+Completions live in a WITHOUT ROWID table clustered on (user_id,
+habit_id, date): that primary key is the covering index for every
+completion query, which reads one contiguous key range per habit and
+never touches a separate table row. Stats documents are stored as JSON
+next to their version, for the same optimistic updates as on Mongo.
+Deleted habits are purged by the deleting request, in one transaction
+right after the soft delete: a local file deletes in milliseconds what
+Mongo purges in background batches. The purge job only sweeps up habits
+left soft-deleted by a worker that died in between.
+
+sqlite3 is blocking, so every statement runs on one dedicated thread;
+that thread owns the connection and serializes this process's access.
+Several worker processes can share a file, with writes queued by
+busy_timeout.
+"""
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from repository import Repository
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS habits (
+    user_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    category TEXT NOT NULL,
+    icon TEXT NOT NULL,
+    color TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    deleted_at TEXT,
+    UNIQUE (user_id, id)
+);
+CREATE INDEX IF NOT EXISTS habits_id ON habits (id);
+CREATE TABLE IF NOT EXISTS completions (
+    user_id TEXT NOT NULL,
+    habit_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    completed INTEGER NOT NULL,
+    PRIMARY KEY (user_id, habit_id, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS habit_stats (
+    user_id TEXT NOT NULL,
+    habit_id TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    stats TEXT NOT NULL,
+    PRIMARY KEY (user_id, habit_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_settings (
+    user_id TEXT PRIMARY KEY,
+    settings TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS daily_summaries (
+    user_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    completed INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    rolled_up_at TEXT NOT NULL,
+    stale INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS badge_awards (
+    user_id TEXT NOT NULL,
+    habit_id TEXT NOT NULL,
+    badge_id TEXT NOT NULL,
+    awarded_at TEXT NOT NULL,
+    PRIMARY KEY (user_id, habit_id, badge_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_rollups (
+    user_id TEXT PRIMARY KEY,
+    next_rollup_at TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS user_rollups_next_rollup_at ON user_rollups (next_rollup_at);
+CREATE TABLE IF NOT EXISTS job_leases (
+    name TEXT PRIMARY KEY,
+    lease_until TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=OFF",
+)
+
+HABIT_COLUMNS = ("id", "user_id", "name", "description", "category", "icon", "color", "created_at", "deleted_at")
+UPDATABLE_HABIT_COLUMNS = {"name", "description", "category", "icon", "color"}
+
+UPSERT_COMPLETION = (
+    "INSERT INTO completions (user_id, habit_id, date, completed) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (user_id, habit_id, date) DO UPDATE SET completed = excluded.completed"
+)
+
+# Stays under SQLITE_MAX_VARIABLE_NUMBER on older builds (999)
+MAX_IN_VARIABLES = 500
+
+
+def chunks(items: Sequence, size: int = MAX_IN_VARIABLES) -> Iterable[List]:
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def placeholders(count: int) -> str:
+    return ",".join("?" * count)
+
+
+def encode_datetime(value) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def purge_deleted(connection: sqlite3.Connection, user_id: str, habit_ids: Sequence[str], whole_user: bool):
+    """Delete soft-deleted habits with their data, or a whole user, in one transaction"""
+    for batch in chunks(habit_ids):
+        marks = placeholders(len(batch))
+        for table in ("completions", "habit_stats", "badge_awards"):
+            connection.execute(f"DELETE FROM {table} WHERE user_id = ? AND habit_id IN ({marks})", [user_id, *batch])
+        connection.execute(
+            f"DELETE FROM habits WHERE user_id = ? AND id IN ({marks}) AND deleted_at IS NOT NULL", [user_id, *batch]
+        )
+    # Summaries counted the deleted habits; they are rolled up again
+    connection.execute("DELETE FROM daily_summaries WHERE user_id = ?", [user_id])
+    if whole_user:
+        connection.execute("DELETE FROM user_rollups WHERE user_id = ?", [user_id])
+        connection.execute("DELETE FROM user_settings WHERE user_id = ?", [user_id])
+
+
+def habit_from_row(row: sqlite3.Row, fields: Optional[Sequence[str]] = None) -> Dict:
+    habit = {column: row[column] for column in HABIT_COLUMNS}
+    habit['created_at'] = datetime.fromisoformat(habit['created_at'])
+    if habit['deleted_at'] is not None:
+        habit['deleted_at'] = datetime.fromisoformat(habit['deleted_at'])
+    if fields:
+        return {field: habit[field] for field in fields}
+    return habit
+
+
+class SqliteRepository(Repository):
+    """Habits, completions, stats, summaries, badge awards and settings in one SQLite file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._connection: Optional[sqlite3.Connection] = None
+
+    async def _run(self, function, *args):
+        """Run function(connection, *args) on the connection's thread"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, self._connection, *args)
+
+    async def _fetch(self, query: str, params: Sequence = ()) -> List[sqlite3.Row]:
+        return await self._run(lambda connection: connection.execute(query, params).fetchall())
+
+    async def _write(self, function, *args):
+        """Run function(connection, *args) in one write transaction"""
+        def transaction(connection, *args):
+            # IMMEDIATE takes the write lock up front, so a read-then-write
+            # cannot interleave with another process's writes
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(connection, *args)
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+            return result
+        return await self._run(transaction, *args)
+
+    async def _keyset(self, query: str, conditions: List[str], params: List, key_columns: Sequence[str],
+                      batch_size: int):
+        """Yield the rows of query page by page, each page resuming after the last key"""
+        after = None
+        order = ", ".join(key_columns)
+        while True:
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if after is not None:
+                page_conditions.append(f"({order}) > ({placeholders(len(key_columns))})")
+                page_params.extend(after)
+            where = f" WHERE {' AND '.join(page_conditions)}" if page_conditions else ""
+            rows = await self._fetch(f"{query}{where} ORDER BY {order} LIMIT ?", [*page_params, batch_size])
+            for row in rows:
+                yield row
+            if len(rows) < batch_size:
+                return
+            after = [rows[-1][column] for column in key_columns]
+
+    async def open(self):
+        def connect(_):
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            connection.row_factory = sqlite3.Row
+            for pragma in PRAGMAS:
+                connection.execute(pragma)
+            connection.executescript(SCHEMA)
+            summary_columns = {row['name'] for row in connection.execute("PRAGMA table_info(daily_summaries)")}
+            if 'stale' not in summary_columns:
+                # Databases created before toggles marked summaries stale
+                connection.execute("ALTER TABLE daily_summaries ADD COLUMN stale INTEGER NOT NULL DEFAULT 0")
+            return connection
+
+        if self._connection is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+            self._connection = await self._run(connect)
+
+    async def close(self):
+        if self._connection is not None:
+            await self._run(lambda connection: connection.close())
+            self._executor.shutdown()
+            self._connection = None
+            self._executor = None
+
+    async def ping(self):
+        await self._fetch("SELECT 1")
+
+    # Habits
+    async def list_habits(self, user_id, habit_ids=None, fields=None, analytics=False):
+        if habit_ids is None:
+            rows = await self._fetch(
+                "SELECT * FROM habits WHERE user_id = ? AND deleted_at IS NULL ORDER BY rowid", [user_id]
+            )
+        else:
+            rows = []
+            for batch in chunks(habit_ids):
+                rows.extend(await self._fetch(
+                    f"SELECT rowid, * FROM habits WHERE user_id = ? AND id IN ({placeholders(len(batch))}) "
+                    "AND deleted_at IS NULL", [user_id, *batch]
+                ))
+            rows.sort(key=lambda row: row['rowid'])
+        return [habit_from_row(row, fields) for row in rows]
+
+    async def find_habit(self, user_id, habit_id):
+        rows = await self._fetch(
+            "SELECT * FROM habits WHERE user_id = ? AND id = ? AND deleted_at IS NULL", [user_id, habit_id]
+        )
+        return habit_from_row(rows[0]) if rows else None
+
+    async def insert_habit(self, habit):
+        values = [encode_datetime(habit.get(column)) for column in HABIT_COLUMNS]
+        await self._write(lambda connection: connection.execute(
+            f"INSERT INTO habits ({', '.join(HABIT_COLUMNS)}) VALUES ({placeholders(len(HABIT_COLUMNS))})", values
+        ))
+
+    async def update_habit(self, user_id, habit_id, changes):
+        unknown = set(changes) - UPDATABLE_HABIT_COLUMNS
+        if unknown:
+            raise ValueError(f"Cannot update habit fields {sorted(unknown)}")
+        if not changes:
+            return await self.find_habit(user_id, habit_id) is not None
+        assignments = ", ".join(f"{column} = ?" for column in changes)
+        cursor = await self._write(lambda connection: connection.execute(
+            f"UPDATE habits SET {assignments} WHERE user_id = ? AND id = ? AND deleted_at IS NULL",
+            [*changes.values(), user_id, habit_id]
+        ))
+        return cursor.rowcount > 0
+
+    async def delete_habits(self, user_id, habit_ids, deleted_at):
+        def delete(connection):
+            deleted = 0
+            for batch in chunks(habit_ids):
+                deleted += connection.execute(
+                    f"UPDATE habits SET deleted_at = ? WHERE user_id = ? AND id IN ({placeholders(len(batch))}) "
+                    "AND deleted_at IS NULL", [encode_datetime(deleted_at), user_id, *batch]
+                ).rowcount
+            return deleted
+        return await self._write(delete)
+
+    async def iter_habit_owners(self, habit_ids=None, batch_size=1000):
+        conditions, params = ["deleted_at IS NULL"], []
+        if habit_ids:
+            # Explicit lists are short: one CLI invocation's --habit-id options
+            conditions.append(f"id IN ({placeholders(len(habit_ids))})")
+            params.extend(habit_ids)
+        async for row in self._keyset("SELECT user_id, id FROM habits", conditions, params,
+                                      ("user_id", "id"), batch_size):
+            yield row['user_id'], row['id']
+
+    async def iter_habits(self, user_id=None, batch_size=1000):
+        conditions, params = ["deleted_at IS NULL"], []
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        async for row in self._keyset("SELECT * FROM habits", conditions, params, ("user_id", "id"), batch_size):
+            yield habit_from_row(row)
+
+    async def list_user_ids(self):
+        rows = await self._fetch("SELECT DISTINCT user_id FROM habits WHERE deleted_at IS NULL ORDER BY user_id")
+        return [row['user_id'] for row in rows]
+
+    # Completions
+    @staticmethod
+    def _window(start: Optional[date], end: Optional[date], conditions: List[str], params: List):
+        if start:
+            conditions.append("date >= ?")
+            params.append(start.isoformat())
+        if end:
+            conditions.append("date <= ?")
+            params.append(end.isoformat())
+
+    async def _completion_rows(self, select: str, user_id: str, habit_ids: Sequence[str], start: Optional[date],
+                               end: Optional[date], extra: str = "") -> List[sqlite3.Row]:
+        rows = []
+        for batch in chunks(habit_ids):
+            conditions = ["user_id = ?", f"habit_id IN ({placeholders(len(batch))})"]
+            params = [user_id, *batch]
+            self._window(start, end, conditions, params)
+            rows.extend(await self._fetch(f"SELECT {select} FROM completions WHERE {' AND '.join(conditions)}{extra}",
+                                          params))
+        return rows
+
+    async def completion_histories(self, user_id, habit_ids, start=None, end=None):
+        histories: Dict[str, Dict[str, bool]] = {habit_id: {} for habit_id in habit_ids}
+        for row in await self._completion_rows("habit_id, date, completed", user_id, habit_ids, start, end,
+                                               " ORDER BY habit_id, date"):
+            histories[row['habit_id']][row['date']] = bool(row['completed'])
+        return histories
+
+    async def completion_page(self, user_id, habit_id, start, end, after, limit):
+        conditions, params = ["user_id = ?", "habit_id = ?"], [user_id, habit_id]
+        self._window(start, end, conditions, params)
+        if after:
+            conditions.append("date > ?")
+            params.append(after)
+        rows = await self._fetch(
+            f"SELECT date, completed FROM completions WHERE {' AND '.join(conditions)} ORDER BY date LIMIT ?",
+            [*params, limit]
+        )
+        return [{"date": row['date'], "completed": bool(row['completed'])} for row in rows]
+
+    async def set_completion(self, user_id, habit_id, date_str, completed):
+        def upsert(connection):
+            before = connection.execute(
+                "SELECT completed FROM completions WHERE user_id = ? AND habit_id = ? AND date = ?",
+                [user_id, habit_id, date_str]
+            ).fetchone()
+            connection.execute(UPSERT_COMPLETION, [user_id, habit_id, date_str, int(completed)])
+            return bool(before['completed']) if before else None
+        return await self._write(upsert)
+
+    async def set_completions(self, user_id, records):
+        rows = [(user_id, habit_id, date_str, int(completed)) for habit_id, date_str, completed in records]
+
+        def upsert(connection):
+            connection.execute("SAVEPOINT completions_batch")
+            try:
+                connection.executemany(UPSERT_COMPLETION, rows)
+                connection.execute("RELEASE completions_batch")
+                return {}
+            except sqlite3.Error:
+                connection.execute("ROLLBACK TO completions_batch")
+                connection.execute("RELEASE completions_batch")
+            # Some row failed: write them one at a time, keeping the others
+            errors = {}
+            for index, row in enumerate(rows):
+                try:
+                    connection.execute(UPSERT_COMPLETION, row)
+                except sqlite3.Error as error:
+                    errors[index] = str(error)
+            return errors
+        return await self._write(upsert) if rows else {}
+
+    async def count_completed_by_day(self, user_id, habit_ids, start, end, analytics=False):
+        daily_completed: Dict[str, int] = {}
+        for row in await self._completion_rows("date, COUNT(*) AS completed", user_id, habit_ids, start, end,
+                                               " AND completed = 1 GROUP BY date"):
+            daily_completed[row['date']] = daily_completed.get(row['date'], 0) + row['completed']
+        return daily_completed
+
+    async def completed_day_offsets(self, user_id, habit_ids, start, end, analytics=False):
+        import numpy as np
+
+        # Offsets are computed and grouped per habit in SQLite, one row per habit
+        rows = await self._completion_rows(
+            f"habit_id, group_concat(CAST(julianday(date) - julianday('{start.isoformat()}') AS INTEGER)) AS offsets",
+            user_id, habit_ids, start, end, " AND completed = 1 GROUP BY habit_id"
+        )
+        index_of = {habit_id: index for index, habit_id in enumerate(habit_ids)}
+        habit_index, day_offset = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.int64)]
+        for row in rows:
+            offsets = np.fromstring(row['offsets'], dtype=np.int64, sep=',')
+            day_offset.append(offsets)
+            habit_index.append(np.full(len(offsets), index_of[row['habit_id']], dtype=np.int64))
+        return np.concatenate(habit_index), np.concatenate(day_offset)
+
+    async def iter_completions(self, user_id=None, start=None, end=None, batch_size=1000):
+        conditions, params = [], []
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        self._window(start, end, conditions, params)
+        async for row in self._keyset("SELECT user_id, habit_id, date, completed FROM completions", conditions,
+                                      params, ("user_id", "habit_id", "date"), batch_size):
+            yield {"user_id": row['user_id'], "habit_id": row['habit_id'], "date": row['date'],
+                   "completed": bool(row['completed'])}
+
+    # Materialized stats
+    async def get_stats(self, user_id, habit_ids):
+        stats_docs = {}
+        for batch in chunks(habit_ids):
+            rows = await self._fetch(
+                f"SELECT habit_id, stats FROM habit_stats WHERE user_id = ? AND habit_id IN ({placeholders(len(batch))})",
+                [user_id, *batch]
+            )
+            stats_docs.update((row['habit_id'], json.loads(row['stats'])) for row in rows)
+        return stats_docs
+
+    async def save_stats(self, stats_docs):
+        if stats_docs:
+            await self._write(lambda connection: connection.executemany(
+                "INSERT OR REPLACE INTO habit_stats (user_id, habit_id, version, stats) VALUES (?, ?, ?, ?)",
+                [(stats['user_id'], stats['habit_id'], stats['version'], json.dumps(stats)) for stats in stats_docs]
+            ))
+
+    async def replace_stats(self, stats, version):
+        cursor = await self._write(lambda connection: connection.execute(
+            "UPDATE habit_stats SET version = ?, stats = ? WHERE user_id = ? AND habit_id = ? AND version = ?",
+            [stats['version'], json.dumps(stats), stats['user_id'], stats['habit_id'], version]
+        ))
+        return cursor.rowcount > 0
+
+    # Daily summaries
+    async def daily_summaries(self, user_id, start, end):
+        rows = await self._fetch(
+            "SELECT date, completed FROM daily_summaries WHERE user_id = ? AND date >= ? AND date <= ? AND stale = 0",
+            [user_id, start.isoformat(), end.isoformat()]
+        )
+        return {row['date']: row['completed'] for row in rows}
+
+    async def stale_daily_summaries(self, user_id, start, end):
+        rows = await self._fetch(
+            "SELECT date, stale FROM daily_summaries WHERE user_id = ? AND date >= ? AND date <= ? AND stale > 0",
+            [user_id, start.isoformat(), end.isoformat()]
+        )
+        return {row['date']: row['stale'] for row in rows}
+
+    async def insert_daily_summaries(self, user_id, daily_completed, total):
+        rolled_up_at = datetime.utcnow().isoformat()
+
+        def insert(connection):
+            return [
+                date_str for date_str in sorted(daily_completed)
+                if connection.execute(
+                    "INSERT OR IGNORE INTO daily_summaries (user_id, date, completed, total, rolled_up_at) "
+                    "VALUES (?, ?, ?, ?, ?)", [user_id, date_str, daily_completed[date_str], total, rolled_up_at]
+                ).rowcount
+            ]
+        return await self._write(insert) if daily_completed else []
+
+    async def refresh_daily_summaries(self, user_id, daily_completed, total, stale):
+        rolled_up_at = datetime.utcnow().isoformat()
+
+        def refresh(connection):
+            return [
+                date_str for date_str in sorted(daily_completed)
+                if connection.execute(
+                    "UPDATE daily_summaries SET completed = ?, total = ?, rolled_up_at = ?, stale = 0 "
+                    "WHERE user_id = ? AND date = ? AND stale = ?",
+                    [daily_completed[date_str], total, rolled_up_at, user_id, date_str, stale[date_str]]
+                ).rowcount
+            ]
+        return await self._write(refresh) if daily_completed else []
+
+    async def mark_daily_summary_stale(self, user_id, date_str):
+        marked_at = datetime.utcnow().isoformat()
+        await self._write(lambda connection: connection.execute(
+            "INSERT INTO daily_summaries (user_id, date, completed, total, rolled_up_at, stale) "
+            "VALUES (?, ?, 0, 0, ?, 1) ON CONFLICT (user_id, date) DO UPDATE SET stale = stale + 1",
+            [user_id, date_str, marked_at]
+        ))
+
+    async def delete_daily_summaries(self, user_id, start=None):
+        await self._write(lambda connection: connection.execute(
+            "DELETE FROM daily_summaries WHERE user_id = ? AND date >= ?",
+            [user_id, start.isoformat() if start else ""]
+        ))
+
+    # Badge awards
+    async def list_badge_awards(self, user_id):
+        rows = await self._fetch(
+            "SELECT habit_id, badge_id, awarded_at FROM badge_awards WHERE user_id = ? ORDER BY awarded_at DESC",
+            [user_id]
+        )
+        return [{"habit_id": row['habit_id'], "badge_id": row['badge_id'],
+                 "awarded_at": datetime.fromisoformat(row['awarded_at'])} for row in rows]
+
+    async def insert_badge_awards(self, awards):
+        def insert(connection):
+            return [
+                dict(award) for award in awards
+                if connection.execute(
+                    "INSERT OR IGNORE INTO badge_awards (user_id, habit_id, badge_id, awarded_at) VALUES (?, ?, ?, ?)",
+                    [award['user_id'], award['habit_id'], award['badge_id'], encode_datetime(award['awarded_at'])]
+                ).rowcount
+            ]
+        return await self._write(insert) if awards else []
+
+    # Rollup schedule
+    async def add_rollup_users(self, user_ids, at):
+        if user_ids:
+            await self._write(lambda connection: connection.executemany(
+                "INSERT OR IGNORE INTO user_rollups (user_id, next_rollup_at) VALUES (?, ?)",
+                [(user_id, at.isoformat()) for user_id in user_ids]
+            ))
+
+    async def request_rollup(self, user_id, at):
+        await self._write(lambda connection: connection.execute(
+            "INSERT INTO user_rollups (user_id, next_rollup_at) VALUES (?, ?) ON CONFLICT (user_id) "
+            "DO UPDATE SET next_rollup_at = MIN(next_rollup_at, excluded.next_rollup_at)",
+            [user_id, at.isoformat()]
+        ))
+
+    async def set_next_rollup(self, user_id, at):
+        await self._write(lambda connection: connection.execute(
+            "INSERT OR REPLACE INTO user_rollups (user_id, next_rollup_at) VALUES (?, ?)", [user_id, at.isoformat()]
+        ))
+
+    async def due_rollup_users(self, now):
+        rows = await self._fetch("SELECT user_id FROM user_rollups WHERE next_rollup_at <= ?", [now.isoformat()])
+        return [row['user_id'] for row in rows]
+
+    # Background job leases
+    async def claim_job(self, name, lease_seconds):
+        now = datetime.utcnow()
+
+        def claim(connection):
+            row = connection.execute("SELECT lease_until FROM job_leases WHERE name = ?", [name]).fetchone()
+            if row is not None and row['lease_until'] > now.isoformat():
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO job_leases (name, lease_until) VALUES (?, ?)",
+                [name, (now + timedelta(seconds=lease_seconds)).isoformat()]
+            )
+            return True
+        return await self._write(claim)
+
+    # Purges of deleted habits
+    async def schedule_purge(self, user_id, habit_ids, whole_user=False):
+        await self._write(purge_deleted, user_id, habit_ids, whole_user)
+        return None
+
+    async def get_purge(self, user_id, purge_id):
+        return None
+
+    async def claim_purge(self):
+        # Purges run inline, but a worker that died between soft-deleting
+        # habits and purging them leaves them behind: sweep those up
+        rows = await self._fetch(
+            "SELECT user_id FROM habits WHERE deleted_at IS NOT NULL ORDER BY user_id LIMIT 1"
+        )
+        if not rows:
+            return None
+        user_id = rows[0]['user_id']
+        rows = await self._fetch(
+            "SELECT id FROM habits WHERE user_id = ? AND deleted_at IS NOT NULL ORDER BY id", [user_id]
+        )
+        return {"id": None, "user_id": user_id, "habit_ids": [row['id'] for row in rows], "whole_user": False}
+
+    async def run_purge(self, purge):
+        await self._write(purge_deleted, purge['user_id'], purge['habit_ids'], purge['whole_user'])
+        return True
+
+    # User settings
+    async def get_settings(self, user_id):
+        rows = await self._fetch("SELECT settings FROM user_settings WHERE user_id = ?", [user_id])
+        return json.loads(rows[0]['settings']) if rows else None
+
+    async def save_settings(self, user_id, settings):
+        def merge(connection):
+            row = connection.execute("SELECT settings FROM user_settings WHERE user_id = ?", [user_id]).fetchone()
+            merged = {**(json.loads(row['settings']) if row else {}), **settings}
+            connection.execute(
+                "INSERT OR REPLACE INTO user_settings (user_id, settings) VALUES (?, ?)", [user_id, json.dumps(merged)]
+            )
+        await self._write(merge)
@@ -0,0 +1,79 @@
+"""Streak engine over compact day-ordinal arrays.
+
+Completed days are held as sorted ``array('I')`` of ``date.toordinal()``
+values. Runs of consecutive calendar days are found in one linear pass,
+so a missing day always breaks a streak. The current streak is anchored
+to ``today``: it is the run that ends today, or yesterday when today has
+not been completed yet.
+
+NumPy is imported on the first batch call rather than with the module,
+which keeps it off the API's import path (see warm_up in server.py).
+"""
+from array import array
+from datetime import date
+from typing import TYPE_CHECKING, Dict, List, Sequence
+
+if TYPE_CHECKING:
+    import numpy as np
+
+
+def completed_ordinals(completion_history: Dict[str, bool]) -> array:
+    """Sorted day ordinals of the completed days in a history"""
+    days = array('I', (date.fromisoformat(date_str).toordinal()
+                       for date_str, completed in completion_history.items() if completed))
+    # Histories are loaded in date order, so sorting is usually skipped
+    if any(days[i] > days[i + 1] for i in range(len(days) - 1)):
+        days = array('I', sorted(days))
+    return days
+
+
+def completed_runs(days: Sequence[int]) -> List[List[int]]:
+    """Runs of consecutive days as [start, end] pairs, from sorted ordinals"""
+    runs: List[List[int]] = []
+    for day in days:
+        if runs and day <= runs[-1][1] + 1:
+            runs[-1][1] = max(runs[-1][1], day)
+        else:
+            runs.append([day, day])
+    return runs
+
+
+def current_run_length(runs: Sequence[Sequence[int]], today: int) -> int:
+    """Length of the run ending today or yesterday, counted up to today"""
+    for start, end in reversed(runs):
+        if start > today:
+            continue
+        if end >= today - 1:
+            return min(end, today) - start + 1
+        break
+    return 0
+
+
+def rate(completed_days: int, total_days: int) -> int:
+    """Completed days as a whole-number percentage of recorded days"""
+    return int((completed_days / total_days * 100)) if total_days > 0 else 0
+
+
+def batch_runs(day_arrays: Sequence[Sequence[int]]) -> List["np.ndarray"]:
+    """Vectorized completed_runs for many habits at once
+
+    Returns one ``(k, 2)`` array of [start, end] rows per habit.
+    """
+    import numpy as np
+
+    lengths = np.fromiter((len(days) for days in day_arrays), dtype=np.int64, count=len(day_arrays))
+    if lengths.sum() == 0:
+        return [np.empty((0, 2), dtype=np.int64) for _ in day_arrays]
+
+    days = np.concatenate([np.asarray(days, dtype=np.int64) for days in day_arrays])
+    owners = np.repeat(np.arange(len(day_arrays)), lengths)
+    # A run starts at each habit's first day and after every calendar gap
+    starts = np.ones(len(days), dtype=bool)
+    starts[1:] = (np.diff(days) != 1) | (owners[1:] != owners[:-1])
+    start_index = np.flatnonzero(starts)
+    end_index = np.append(start_index[1:], len(days)) - 1
+    runs = np.column_stack((days[start_index], days[end_index]))
+
+    run_counts = np.bincount(owners[start_index], minlength=len(day_arrays))
+    return np.split(runs, np.cumsum(run_counts)[:-1])
+
@@ -4,6 +4,7 @@ import { Button } from './ui/button';
 import { Badge } from './ui/badge';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from './ui/tabs';
 import { ChevronLeft, ChevronRight, Calendar, Grid3x3 } from 'lucide-react';
+import { localDateString } from '../lib/utils';
 
 export const CalendarView = ({ habits, onToggle }) => {
   const [currentDate, setCurrentDate] = useState(new Date());
@@ -49,7 +50,7 @@ export const CalendarView = ({ habits, onToggle }) => {
   };
 
   const getDayCompletionData = (date) => {
-    const dateString = date.toISOString().split('T')[0];
+    const dateString = localDateString(date);
     const completedHabits = habits.filter(habit => 
       habit.completion_history && habit.completion_history[dateString]
     );
@@ -233,7 +234,7 @@ export const CalendarView = ({ habits, onToggle }) => {
                   
                   <div className="space-y-1">
                     {habits.map(habit => {
-                      const dateString = date.toISOString().split('T')[0];
+                      const dateString = localDateString(date);
                       const isCompleted = habit.completion_history && habit.completion_history[dateString];
                       
                       return (
@@ -6,9 +6,10 @@ import { Checkbox } from './ui/checkbox';
 import { Progress } from './ui/progress';
 import { MoreHorizontal, Edit, Trash2, Flame, Trophy, Calendar } from 'lucide-react';
 import { DropdownMenu, DropdownMenuContent, DropdownMenuItem, DropdownMenuTrigger } from './ui/dropdown-menu';
+import { localDateString } from '../lib/utils';
 
 export const HabitCard = ({ habit, onToggle, onEdit, onDelete, categories }) => {
-  const today = new Date().toISOString().split('T')[0];
+  const today = localDateString();
   const isCompletedToday = habit.completion_history && habit.completion_history[today] || false;
   const category = categories.find(c => c.id === habit.category);
   
@@ -12,6 +12,38 @@ import { ProgressView } from './ProgressView';
 import { HabitForm } from './HabitForm';
 import { useToast } from '../hooks/use-toast';
 import habitAPI from '../services/api';
+import { localDateString } from '../lib/utils';
+
+// Days of completion history loaded for the calendar and progress views
+const HISTORY_WINDOW_DAYS = 365;
+
+const historyWindowStart = () => {
+  const start = new Date();
+  start.setDate(start.getDate() - HISTORY_WINDOW_DAYS);
+  return localDateString(start);
+};
+
+// Apply a live update event to the habit list
+const applyHabitEvent = (habits, event) => {
+  switch (event.type) {
+    case 'habit_created':
+      return habits.some(h => h.id === event.habit.id) ? habits : [...habits, event.habit];
+    case 'habit_updated':
+      return habits.map(h => h.id === event.habit_id ? { ...h, ...event.changes } : h);
+    case 'habit_deleted':
+      return habits.filter(h => h.id !== event.habit_id);
+    case 'streaks_reset':
+      return habits.map(h => event.habit_ids.includes(h.id) ? { ...h, current_streak: 0 } : h);
+    case 'completion': {
+      const { type, habit_id, date, completed, ...stats } = event;
+      return habits.map(h => h.id === habit_id
+        ? { ...h, ...stats, completion_history: { ...h.completion_history, [date]: completed } }
+        : h);
+    }
+    default:
+      return habits;
+  }
+};
 
 export const HabitTracker = () => {
   const [habits, setHabits] = useState([]);
@@ -30,6 +62,33 @@ export const HabitTracker = () => {
     loadInitialData();
   }, []);
 
+  // Keep habits in sync with changes made in other tabs and devices
+  useEffect(() => {
+    return habitAPI.subscribeToEvents(async (event) => {
+      if (event.type === 'completions_bulk') {
+        const { habits: refreshed } = await habitAPI.getHabitsBatch(
+          event.habit_ids, { from: historyWindowStart() }
+        );
+        const byId = Object.fromEntries(refreshed.map(h => [h.id, h]));
+        setHabits(prevHabits => prevHabits.map(h => byId[h.id] || h));
+        return;
+      }
+      if (event.type === 'badges_awarded') {
+        event.awards.forEach(award => toast({
+          title: "Badge earned!",
+          description: award.name
+        }));
+        return;
+      }
+      setHabits(prevHabits => applyHabitEvent(prevHabits, event));
+    });
+  }, []);
+
+  // Recompute today's progress whenever habits change
+  useEffect(() => {
+    setTodayProgress(habitAPI.getTodayCompletion(habits));
+  }, [habits]);
+
   // Apply theme
   useEffect(() => {
     if (isDarkMode) {
@@ -43,9 +102,12 @@ export const HabitTracker = () => {
     try {
       setLoading(true);
       
+      // Streaks and today's stats are computed for the user's local date
+      await habitAPI.syncTimezone().catch(() => {});
+      
       // Load habits, categories, and badges in parallel
       const [habitsData, categoriesData, badgesData] = await Promise.all([
-        habitAPI.getAllHabits(),
+        habitAPI.getAllHabits({ from: historyWindowStart() }),
         habitAPI.getCategories(),
         habitAPI.getBadges()
       ]);
@@ -72,7 +134,7 @@ export const HabitTracker = () => {
 
   const handleHabitToggle = async (habitId) => {
     try {
-      const today = new Date().toISOString().split('T')[0];
+      const today = localDateString();
       const habit = habits.find(h => h.id === habitId);
       
       if (!habit) return;
@@ -92,17 +154,16 @@ export const HabitTracker = () => {
         })
       );
       
-      // Update backend
-      await habitAPI.toggleHabitCompletion(habitId, today, newCompletedStatus);
-      
-      // Refresh habit data to get updated streaks and stats
-      const updatedHabit = await habitAPI.getHabit(habitId);
-      setHabits(prevHabits => 
-        prevHabits.map(h => h.id === habitId ? updatedHabit : h)
-      );
+      // Update backend; the response carries the habit's updated streaks and stats,
+      // and only the toggled date of its history
+      const { habit: toggled } = await habitAPI.toggleHabitCompletion(habitId, today, newCompletedStatus);
+      const mergeToggled = h => h.id === habitId
+        ? { ...h, ...toggled, completion_history: { ...h.completion_history, ...toggled.completion_history } }
+        : h;
+      setHabits(prevHabits => prevHabits.map(mergeToggled));
       
       // Update today's progress
-      const updatedHabits = habits.map(h => h.id === habitId ? updatedHabit : h);
+      const updatedHabits = habits.map(mergeToggled);
       const progress = habitAPI.getTodayCompletion(updatedHabits);
       setTodayProgress(progress);
       
@@ -6,6 +6,7 @@ import { Progress } from './ui/progress';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from './ui/tabs';
 import { BarChart3, TrendingUp, Calendar, Target, Award, ChevronLeft, ChevronRight } from 'lucide-react';
 import { getWeeklyProgress } from '../mock/data';
+import { localDateString } from '../lib/utils';
 
 export const ProgressView = ({ habits }) => {
   const [selectedPeriod, setSelectedPeriod] = useState('weekly');
@@ -39,7 +40,7 @@ export const ProgressView = ({ habits }) => {
     }
     
     return weekDays.map(date => {
-      const dateString = date.toISOString().split('T')[0];
+      const dateString = localDateString(date);
       const completed = habits.filter(habit => 
         habit.completion_history && habit.completion_history[dateString]
       ).length;
@@ -64,7 +65,7 @@ export const ProgressView = ({ habits }) => {
     
     for (let day = 1; day <= daysInMonth; day++) {
       const date = new Date(currentYear, currentMonth, day);
-      const dateString = date.toISOString().split('T')[0];
+      const dateString = localDateString(date);
       const completed = habits.filter(habit => 
         habit.completion_history && habit.completion_history[dateString]
       ).length;
@@ -1,14 +1,21 @@
 import axios from 'axios';
+import { localDateString } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+const EVENTS_RECONNECT_MS = 3000;
+
+const newIdempotencyKey = () =>
+  window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
 // API service class
 class HabitAPI {
   // Habit CRUD operations
-  async getAllHabits() {
+  // params: { from, to, include_history, fields } limit the returned history
+  async getAllHabits(params = {}) {
     try {
-      const response = await axios.get(`${API}/habits`);
+      const response = await axios.get(`${API}/habits`, { params });
       return response.data;
     } catch (error) {
       console.error('Error fetching habits:', error);
@@ -46,9 +53,9 @@ class HabitAPI {
     }
   }
 
-  async getHabit(habitId) {
+  async getHabit(habitId, params = {}) {
     try {
-      const response = await axios.get(`${API}/habits/${habitId}`);
+      const response = await axios.get(`${API}/habits/${habitId}`, { params });
       return response.data;
     } catch (error) {
       console.error('Error fetching habit:', error);
@@ -56,12 +63,32 @@ class HabitAPI {
     }
   }
 
+  // Several habits in one request: { habits, not_found }
+  async getHabitsBatch(habitIds, params = {}) {
+    try {
+      const response = await axios.get(`${API}/habits/batch`, {
+        params: { ...params, ids: habitIds.join(',') }
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching habits:', error);
+      throw error;
+    }
+  }
+
   // Completion operations
+  // A toggle whose response was lost is retried once under the same
+  // Idempotency-Key, so the server applies it only once
   async toggleHabitCompletion(habitId, date, completed) {
+    const headers = { 'Idempotency-Key': newIdempotencyKey() };
+    const request = () => axios.post(`${API}/habits/${habitId}/completions`, {
+      date: date,
+      completed: completed
+    }, { headers });
     try {
-      const response = await axios.post(`${API}/habits/${habitId}/completions`, {
-        date: date,
-        completed: completed
+      const response = await request().catch(error => {
+        if (error.response) throw error;
+        return request();
       });
       return response.data;
     } catch (error) {
@@ -70,9 +97,10 @@ class HabitAPI {
     }
   }
 
-  async getHabitCompletions(habitId) {
+  // params: { from, to, cursor, limit }; pass next_cursor back as cursor for the next page
+  async getHabitCompletions(habitId, params = {}) {
     try {
-      const response = await axios.get(`${API}/habits/${habitId}/completions`);
+      const response = await axios.get(`${API}/habits/${habitId}/completions`, { params });
       return response.data;
     } catch (error) {
       console.error('Error fetching habit completions:', error);
@@ -91,6 +119,49 @@ class HabitAPI {
     }
   }
 
+  // params: { window, group } with group one of category, habit, none
+  async getTrends(params = {}) {
+    try {
+      const response = await axios.get(`${API}/analytics/trends`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching trends:', error);
+      throw error;
+    }
+  }
+
+  // User settings: { timezone } sets the local midnight streaks roll over at
+  async getSettings() {
+    try {
+      const response = await axios.get(`${API}/settings`);
+      return response.data;
+    } catch (error) {
+      console.error('Error fetching settings:', error);
+      throw error;
+    }
+  }
+
+  async updateSettings(settings) {
+    try {
+      const response = await axios.put(`${API}/settings`, settings);
+      return response.data;
+    } catch (error) {
+      console.error('Error updating settings:', error);
+      throw error;
+    }
+  }
+
+  // Store the browser's timezone when it differs from the saved one
+  async syncTimezone() {
+    const timezone = Intl.DateTimeFormat().resolvedOptions().timeZone;
+    const settings = await this.getSettings();
+    if (timezone && settings.timezone !== timezone) {
+      await this.updateSettings({ timezone });
+      return true;
+    }
+    return false;
+  }
+
   async getCategories() {
     try {
       const response = await axios.get(`${API}/categories`);
@@ -111,14 +182,53 @@ class HabitAPI {
     }
   }
 
+  // Live updates: calls onEvent with each change made to the user's habits,
+  // from this or any other tab or device. Returns a function that closes the stream.
+  // EventSource cannot send headers, so each connection opens with a
+  // short-lived token from /events/token.
+  subscribeToEvents(onEvent) {
+    const eventTypes = [
+      'habit_created', 'habit_updated', 'habit_deleted', 'completion', 'completions_bulk',
+      'streaks_reset', 'badges_awarded'
+    ];
+    let source = null;
+    let closed = false;
+    const reconnect = () => {
+      if (!closed) setTimeout(connect, EVENTS_RECONNECT_MS);
+    };
+    const connect = async () => {
+      try {
+        const { data } = await axios.post(`${API}/events/token`);
+        if (closed) return;
+        source = new EventSource(`${API}/events?token=${encodeURIComponent(data.token)}`);
+        eventTypes.forEach(type => {
+          source.addEventListener(type, message => onEvent(JSON.parse(message.data)));
+        });
+        // EventSource retries a dropped stream itself, but gives up once
+        // its token has expired; fetch a new one then
+        source.onerror = () => {
+          if (source.readyState === EventSource.CLOSED) reconnect();
+        };
+      } catch (error) {
+        console.error('Error opening live updates:', error);
+        reconnect();
+      }
+    };
+    connect();
+    return () => {
+      closed = true;
+      if (source) source.close();
+    };
+  }
+
   // Utility methods
   getTodayCompletion(habits) {
-    const today = new Date().toISOString().split('T')[0];
+    const today = localDateString();
     const completedToday = habits.filter(habit => habit.completion_history && habit.completion_history[today]);
     return {
       completed: completedToday.length,
       total: habits.length,
-      percentage: Math.round((completedToday.length / habits.length) * 100)
+      percentage: habits.length ? Math.round((completedToday.length / habits.length) * 100) : 0
     };
   }
 
@@ -129,7 +239,7 @@ class HabitAPI {
     for (let i = 6; i >= 0; i--) {
       const date = new Date(today);
       date.setDate(date.getDate() - i);
-      weekDays.push(date.toISOString().split('T')[0]);
+      weekDays.push(localDateString(date));
     }
     
     return weekDays.map(date => {
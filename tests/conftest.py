@@ -0,0 +1,36 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend modules import each other as top-level modules
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# Tests that import server run it on SQLite without background jobs; each
+# test binds its own database file
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["PURGE_INTERVAL_SECONDS"] = "0"
+os.environ["BACKGROUND_JOBS_INTERVAL_SECONDS"] = "0"
+
+
+@pytest.fixture
+def anyio_backend():
+    # The server runs on asyncio only
+    return "asyncio"
+
+
+@pytest.fixture
+async def bound_server(tmp_path, monkeypatch):
+    """The server module bound to a fresh SQLite repository, restored afterwards"""
+    import server
+    from sqlite_repository import SqliteRepository
+
+    for name in ("repository", "db", "analytics_db", "response_cache", "live_updates", "idempotency_store"):
+        monkeypatch.setattr(server, name, getattr(server, name))
+    repository = SqliteRepository(str(tmp_path / "server.sqlite3"))
+    await repository.open()
+    server.bind_repository(repository)
+    yield server
+    await repository.close()
+    server.user_timezones.clear()
@@ -0,0 +1,118 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from analytics import ROLLING_WINDOWS, STREAK_BUCKETS, completion_matrix, streak_label, trends
+
+START = date(2024, 2, 20)
+
+
+def random_histories(seed: int, habits: int, days: int):
+    """Completed day offsets per habit, with empty habits, gaps and both window edges"""
+    rng = random.Random(seed)
+    histories = []
+    for _ in range(habits):
+        density = rng.choice([0.0, 0.1, 0.5, 0.9, 1.0])
+        offsets = {offset for offset in range(days) if rng.random() < density}
+        if offsets and rng.random() < 0.5:
+            offsets |= {0, days - 1}
+        histories.append(offsets)
+    created = [rng.choice([-30, 0, rng.randrange(days), days - 1, days + 5]) for _ in range(habits)]
+    keys = [rng.choice("abc") for _ in range(habits)]
+    return histories, created, keys
+
+
+def reference_rate(numerator: int, denominator: int) -> float:
+    return numerator * 100 / denominator if denominator else 0
+
+
+def reference_trends(histories, created, rows, days: int) -> dict:
+    """The trends of some habit rows, day by day"""
+    first_day = {
+        row: min(max(min(created[row], min(histories[row], default=days)), 0), days) for row in rows
+    }
+    completed = [sum(offset in histories[row] for row in rows) for offset in range(days)]
+    active = [sum(first_day[row] <= offset for row in rows) for offset in range(days)]
+    weekdays = [(START + timedelta(days=offset)).weekday() for offset in range(days)]
+    streaks = dict.fromkeys((streak_label(low, high) for low, high in STREAK_BUCKETS), 0)
+    for row in rows:
+        length = 0
+        for offset in range(days + 1):
+            if offset < days and offset in histories[row]:
+                length += 1
+            elif length:
+                label = next(streak_label(low, high) for low, high in STREAK_BUCKETS
+                             if length >= low and (high is None or length <= high))
+                streaks[label] += 1
+                length = 0
+    result = {
+        "habits": len(rows),
+        "completed_days": sum(completed),
+        "active_days": sum(active),
+        "completion_rate": reference_rate(sum(completed), sum(active)),
+        "daily_rate": [reference_rate(done, total) for done, total in zip(completed, active)],
+        "weekday_rates": [
+            reference_rate(sum(done for done, day in zip(completed, weekdays) if day == weekday),
+                           sum(total for total, day in zip(active, weekdays) if day == weekday))
+            for weekday in range(7)
+        ],
+        "streaks": streaks,
+    }
+    for window in ROLLING_WINDOWS:
+        result[f"rolling_{window}"] = [
+            reference_rate(sum(completed[max(0, offset - window + 1):offset + 1]),
+                           sum(active[max(0, offset - window + 1):offset + 1]))
+            for offset in range(days)
+        ]
+    return result
+
+
+def assert_matches(actual: dict, expected: dict):
+    for name, value in expected.items():
+        if isinstance(value, (int, dict)):
+            assert actual[name] == value, name
+        else:
+            # Rates are rounded to one decimal
+            assert actual[name] == pytest.approx(value, abs=0.05 + 1e-9), name
+
+
+def matrix_of(histories, days: int) -> np.ndarray:
+    rows = [row for row, offsets in enumerate(histories) for _ in offsets]
+    offsets = [offset for history in histories for offset in history]
+    return completion_matrix(np.array(rows, dtype=np.int64), np.array(offsets, dtype=np.int64), len(histories), days)
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_trends_match_a_day_by_day_loop(seed):
+    rng = random.Random(seed)
+    days = rng.choice([1, 7, 31, 90, 365])
+    histories, created, keys = random_histories(seed, rng.randrange(1, 40), days)
+
+    result = trends(matrix_of(histories, days), np.array(created), keys, START.toordinal())
+
+    assert_matches(result["overall"], reference_trends(histories, created, range(len(histories)), days))
+    assert [group["key"] for group in result["groups"]] == sorted(set(keys))
+    for group in result["groups"]:
+        rows = [row for row, key in enumerate(keys) if key == group["key"]]
+        assert_matches(group, reference_trends(histories, created, rows, days))
+
+
+def test_trends_of_no_habits():
+    result = trends(np.zeros((0, 30), dtype=bool), np.zeros(0, dtype=np.int64), [], START.toordinal())
+    assert result["groups"] == []
+    assert_matches(result["overall"], reference_trends([], [], [], 30))
+
+
+def test_habits_without_completions_count_from_creation():
+    histories, created = [set(), set()], [10, 40]
+    result = trends(matrix_of(histories, 30), np.array(created), ["a", "b"], START.toordinal())
+    assert [group["active_days"] for group in result["groups"]] == [20, 0]
+    assert result["overall"]["completed_days"] == 0
+    assert result["overall"]["streaks"] == dict.fromkeys(result["overall"]["streaks"], 0)
+
+
+def test_completion_matrix_drops_days_outside_the_window():
+    matrix = completion_matrix(np.array([0, 0, 1, 1]), np.array([-1, 0, 29, 30]), 2, 30)
+    assert np.argwhere(matrix).tolist() == [[0, 0], [1, 29]]
@@ -0,0 +1,95 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from completion_bitmaps import (
+    bitmap_update, bitmap_value, completed_day_offsets, completed_days_between, encode_history, iter_bitmap_days,
+    window_years
+)
+
+
+def random_history(seed: int, days: int = 800):
+    rng = random.Random(seed)
+    start = date(2024, 11, 15)
+    return {
+        (start + timedelta(days=offset)).isoformat(): rng.random() < 0.5
+        for offset in range(days) if rng.random() < 0.7
+    }
+
+
+def apply_bit(doc, update):
+    """Apply a $bit update document the way the server does"""
+    for path, operation in update["$bit"].items():
+        field, month = path.split(".")
+        value = doc.setdefault(field, {}).get(month, 0)
+        if "or" in operation:
+            value |= operation["or"]
+        if "and" in operation:
+            value &= operation["and"]
+        doc[field][month] = value
+
+
+def decode(bitmaps):
+    return {date_str: completed for bitmap in bitmaps for date_str, completed in iter_bitmap_days(bitmap)}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_encode_decode_round_trip(seed):
+    history = random_history(seed)
+    years = encode_history(history.items())
+    assert decode({"year": year, **bitmap} for year, bitmap in years.items()) == history
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_bit_updates_match_encoding(seed):
+    history = random_history(seed)
+    docs = {}
+    rng = random.Random(seed)
+    toggled = {}
+    retoggles = [(date_str, rng.random() < 0.5) for date_str in rng.sample(sorted(history), 50)]
+    for date_str, completed in list(history.items()) + retoggles:
+        year, update = bitmap_update(date_str, completed)
+        apply_bit(docs.setdefault(year, {"year": year}), update)
+        toggled[date_str] = completed
+    assert decode(docs.values()) == toggled
+    for date_str, completed in toggled.items():
+        assert bitmap_value(docs[int(date_str[:4])], date_str) is completed
+
+
+def test_unrecorded_day_is_none():
+    _, update = bitmap_update("2025-03-10", False)
+    doc = {"year": 2025}
+    apply_bit(doc, update)
+    assert bitmap_value(doc, "2025-03-10") is False
+    assert bitmap_value(doc, "2025-03-11") is None
+    assert bitmap_value(None, "2025-03-10") is None
+
+
+def test_completed_days_between_and_window_years():
+    history = {"2025-12-30": True, "2025-12-31": False, "2026-01-01": True}
+    bitmaps = [{"year": year, **bitmap} for year, bitmap in encode_history(history.items()).items()]
+    window = [d for bitmap in bitmaps for d in completed_days_between(bitmap, date(2025, 12, 31), date(2026, 1, 1))]
+    assert window == ["2026-01-01"]
+    assert window_years(date(2025, 12, 31), date(2026, 1, 1)) == [2025, 2026]
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_completed_day_offsets_match_the_day_by_day_decode(seed):
+    start, end = date(2025, 2, 20), date(2026, 1, 10)
+    rows = [(row, {"year": year, **bitmap})
+            for row in range(3)
+            for year, bitmap in encode_history(random_history(seed * 3 + row).items()).items()]
+
+    habit_index, day_offset = completed_day_offsets(rows, start, end)
+
+    expected = sorted(
+        (row, (date.fromisoformat(date_str) - start).days)
+        for row, bitmap in rows for date_str in completed_days_between(bitmap, start, end)
+    )
+    assert sorted(zip(habit_index.tolist(), day_offset.tolist())) == expected
+
+
+def test_completed_day_offsets_without_completions():
+    habit_index, day_offset = completed_day_offsets([], date(2025, 1, 1), date(2025, 12, 31))
+    assert habit_index.tolist() == [] and day_offset.tolist() == []
@@ -0,0 +1,88 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from habit_stats import apply_completion, completion_rate, current_streak, stats_from_history, stats_from_histories
+
+START = date(2025, 1, 1)
+
+
+def day(offset: int) -> str:
+    return (START + timedelta(days=offset)).isoformat()
+
+
+def comparable(stats):
+    return {key: value for key, value in stats.items() if key != "version"}
+
+
+def toggle(stats, history, date_str, completed):
+    apply_completion(stats, date_str, history.get(date_str), completed)
+    history[date_str] = completed
+
+
+def test_extends_last_run():
+    history = {day(0): True, day(1): True}
+    stats = stats_from_history("h", history)
+    toggle(stats, history, day(2), True)
+    assert stats["runs"] == [[START.toordinal(), START.toordinal() + 2]]
+    assert stats["best_streak"] == 3
+    assert comparable(stats) == comparable(stats_from_history("h", history))
+
+
+def test_fills_gap_merges_runs():
+    history = {day(0): True, day(1): False, day(2): True}
+    stats = stats_from_history("h", history)
+    toggle(stats, history, day(1), True)
+    assert len(stats["runs"]) == 1
+    assert stats["best_streak"] == 3
+    assert comparable(stats) == comparable(stats_from_history("h", history))
+
+
+def test_unchecking_middle_splits_run_and_lowers_best_streak():
+    history = {day(offset): True for offset in range(5)}
+    stats = stats_from_history("h", history)
+    toggle(stats, history, day(2), False)
+    assert len(stats["runs"]) == 2
+    assert stats["best_streak"] == 2
+    assert stats["completed_days"] == 4 and stats["total_days"] == 5
+    assert comparable(stats) == comparable(stats_from_history("h", history))
+
+
+def test_repeated_toggle_is_a_no_op():
+    history = {day(0): True}
+    stats = stats_from_history("h", history)
+    toggle(stats, history, day(0), True)
+    assert comparable(stats) == comparable(stats_from_history("h", history))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_toggles_match_full_rebuild(seed):
+    rng = random.Random(seed)
+    history = {day(offset): rng.random() < 0.6 for offset in range(60) if rng.random() < 0.8}
+    stats = stats_from_history("h", history)
+    for _ in range(200):
+        toggle(stats, history, day(rng.randrange(70)), rng.random() < 0.5)
+        assert comparable(stats) == comparable(stats_from_history("h", history))
+
+
+def test_batch_build_matches_single_build():
+    rng = random.Random(1)
+    histories = {
+        f"h{index}": {day(offset): rng.random() < 0.5 for offset in range(rng.randrange(100))}
+        for index in range(10)
+    }
+    batch = stats_from_histories(histories)
+    assert [comparable(stats) for stats in batch] == [
+        comparable(stats_from_history(habit_id, history)) for habit_id, history in histories.items()
+    ]
+
+
+def test_current_streak_and_rate():
+    history = {day(0): True, day(1): False, day(2): True, day(3): True}
+    stats = stats_from_history("h", history)
+    today = START.toordinal() + 3
+    assert current_streak(stats, today) == 2
+    assert current_streak(stats, today + 1) == 2
+    assert current_streak(stats, today + 2) == 0
+    assert completion_rate(stats) == 75
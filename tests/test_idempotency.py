@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyKeyReused, IdempotencyStore, LocalRecords, WriteCoalescer
+
+pytestmark = pytest.mark.anyio
+
+
+class Recorder:
+    """A slow write that records the values it was called with"""
+
+    def __init__(self, delay: float = 0.01):
+        self.delay = delay
+        self.values = []
+
+    async def __call__(self, value):
+        self.values.append(value)
+        await asyncio.sleep(self.delay)
+        return value
+
+
+async def start_then_submit(coalescer, write, first, *later):
+    """Submit first, then the later values once its write is under way"""
+    tasks = [asyncio.create_task(coalescer.submit("k", first, write))]
+    while not write.values:
+        await asyncio.sleep(0)
+    tasks += [asyncio.create_task(coalescer.submit("k", value, write)) for value in later]
+    return tasks
+
+
+async def test_callers_queued_together_share_one_write():
+    coalescer, write = WriteCoalescer(), Recorder()
+    results = await asyncio.gather(*(coalescer.submit("k", value, write) for value in [True, False, True, False]))
+    assert write.values == [False]
+    assert results == [False] * 4
+
+
+async def test_writes_during_a_write_coalesce_to_last_value():
+    coalescer, write = WriteCoalescer(), Recorder()
+    results = await asyncio.gather(*await start_then_submit(coalescer, write, True, False, True, False))
+    assert write.values == [True, False]
+    assert results == [False] * 4
+
+
+async def test_follow_up_write_skipped_when_last_value_was_written():
+    coalescer, write = WriteCoalescer(), Recorder()
+    results = await asyncio.gather(*await start_then_submit(coalescer, write, True, False, True))
+    assert write.values == [True]
+    assert results == [True] * 3
+
+
+async def test_keys_are_independent():
+    coalescer, write = WriteCoalescer(), Recorder()
+    assert await asyncio.gather(coalescer.submit("a", 1, write), coalescer.submit("b", 2, write)) == [1, 2]
+    assert sorted(write.values) == [1, 2]
+
+
+async def test_cancelled_first_caller_does_not_cancel_the_write():
+    coalescer, write = WriteCoalescer(), Recorder()
+    first, second = await start_then_submit(coalescer, write, True, False)
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second is False
+    assert write.values == [True, False]
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+async def test_write_error_reaches_every_caller():
+    coalescer = WriteCoalescer()
+
+    async def fail(value):
+        await asyncio.sleep(0.01)
+        raise ValueError(value)
+
+    results = await asyncio.gather(coalescer.submit("k", 1, fail), coalescer.submit("k", 2, fail),
+                                   return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert await coalescer.submit("k", 3, Recorder()) == 3
+
+
+class Handler:
+    def __init__(self, status_code: int = 200, delay: float = 0.01):
+        self.status_code = status_code
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.status_code, b'{"calls": %d}' % self.calls
+
+
+async def test_retry_replays_stored_response():
+    store, handler = IdempotencyStore(), Handler()
+    response, replayed = await store.run("u", "key", "f", handler)
+    assert not replayed
+    replay, replayed = await store.run("u", "key", "f", handler)
+    assert replayed and replay == response
+    assert handler.calls == 1
+
+
+async def test_concurrent_requests_share_one_run():
+    store, handler = IdempotencyStore(), Handler()
+    results = await asyncio.gather(*(store.run("u", "key", "f", handler) for _ in range(3)))
+    assert handler.calls == 1
+    assert len({response for response, _ in results}) == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+
+
+async def test_reused_key_is_rejected():
+    store, handler = IdempotencyStore(), Handler()
+    await store.run("u", "key", "f", handler)
+    with pytest.raises(IdempotencyKeyReused):
+        await store.run("u", "key", "other", handler)
+
+
+async def test_keys_are_per_user():
+    store, handler = IdempotencyStore(), Handler()
+    await store.run("u", "key", "f", handler)
+    _, replayed = await store.run("v", "key", "f", handler)
+    assert not replayed and handler.calls == 2
+
+
+async def test_failures_are_not_stored():
+    store = IdempotencyStore()
+    await store.run("u", "key", "f", Handler(status_code=500))
+    handler = Handler()
+    response, replayed = await store.run("u", "key", "f", handler)
+    assert not replayed and response.status_code == 200
+
+    async def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        await store.run("u", "other", "f", fail)
+    _, replayed = await store.run("u", "other", "f", Handler())
+    assert not replayed
+
+
+async def test_cancelled_caller_does_not_cancel_waiting_requests():
+    store, handler = IdempotencyStore(), Handler()
+    first = asyncio.create_task(store.run("u", "key", "f", handler))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(store.run("u", "key", "f", handler))
+    await asyncio.sleep(0)
+    first.cancel()
+    response, replayed = await second
+    assert replayed and response.status_code == 200
+    assert handler.calls == 1
+    assert (await store.run("u", "key", "f", handler))[0] == response
+
+
+async def test_local_records_are_bounded():
+    store, handler = IdempotencyStore(LocalRecords(max_entries=2)), Handler(delay=0)
+    for key in ("a", "b", "c"):
+        await store.run("u", key, "f", handler)
+    _, replayed = await store.run("u", "a", "f", handler)
+    assert not replayed
@@ -0,0 +1,71 @@
+import asyncio
+from datetime import date, datetime, timedelta
+
+import pytest
+from typer.testing import CliRunner
+
+import manage
+import server
+from sqlite_repository import SqliteRepository
+
+
+@pytest.fixture
+def sqlite_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "habits.sqlite3")
+    monkeypatch.setattr(server, "SQLITE_PATH", path)
+    monkeypatch.setattr(server, "rollup_users_added", False)
+    return path
+
+
+def seed(path: str):
+    async def write():
+        repository = SqliteRepository(path)
+        await repository.open()
+        try:
+            for habit_id in ("h1", "h2"):
+                await repository.insert_habit({
+                    "id": habit_id, "user_id": "alice", "name": habit_id, "description": None,
+                    "category": "health", "icon": "x", "color": "c", "created_at": datetime(2024, 1, 1),
+                    "deleted_at": None,
+                })
+            today = date.today()
+            await repository.set_completions("alice", [
+                ("h1", (today - timedelta(days=offset)).isoformat(), True) for offset in range(1, 8)
+            ])
+            await repository.delete_habits("alice", ["h2"], datetime.utcnow())
+        finally:
+            await repository.close()
+    asyncio.run(write())
+
+
+def invoke(*args):
+    result = CliRunner().invoke(manage.cli, list(args))
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_rollup_and_purge_on_sqlite(sqlite_path):
+    seed(sqlite_path)
+
+    assert "Rolled up 1 of 1 user(s)" in invoke("rollup")
+    # h2 was soft-deleted without being purged, as by a worker that died
+    assert "Finished 1 purge(s)" in invoke("purge")
+    assert "Finished 0 purge(s)" in invoke("purge")
+    assert "Rebuilt stats for 1 habit(s)" in invoke("rebuild-stats")
+
+    async def read():
+        repository = SqliteRepository(sqlite_path)
+        await repository.open()
+        try:
+            return await repository.list_badge_awards("alice"), await repository.claim_purge()
+        finally:
+            await repository.close()
+    awards, leftover = asyncio.run(read())
+    assert {award['badge_id'] for award in awards} >= {"streak-3", "streak-7"}
+    assert leftover is None
+
+
+def test_migrate_to_bitmaps_needs_mongo(sqlite_path):
+    result = CliRunner().invoke(manage.cli, ["migrate-to-bitmaps"])
+    assert result.exit_code == 1
+    assert "needs STORAGE_BACKEND=mongo" in result.output
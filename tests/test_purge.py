@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+import repository as repository_module
+from repository import MongoRepository, purge_progress
+
+pytestmark = pytest.mark.anyio
+
+COMPLETIONS = 5
+
+
+@pytest.fixture
+async def mongo():
+    db = AsyncMongoMockClient()["test"]
+    repository = MongoRepository(db, db, "documents")
+    repository.purge_batch_size = 2
+    repository.purge_batch_pause_seconds = 0
+    for user_id in ("alice", "bob"):
+        for habit_id in ("h1", "h2"):
+            await db.habits.insert_one({"id": habit_id, "user_id": user_id, "name": habit_id,
+                                        "deleted_at": datetime(2024, 1, 2) if habit_id == "h1" else None})
+            await db.habit_completions.insert_many([
+                {"user_id": user_id, "habit_id": habit_id, "date": f"2024-01-{day:02}", "completed": True}
+                for day in range(1, COMPLETIONS + 1)
+            ])
+            await db.habit_stats.insert_one({"user_id": user_id, "habit_id": habit_id, "version": 1})
+            await db.badge_awards.insert_one({"user_id": user_id, "habit_id": habit_id, "badge_id": "streak-3"})
+        await db.daily_summaries.insert_many([
+            {"user_id": user_id, "date": f"2024-01-{day:02}", "completed": 2, "total": 2} for day in range(1, 4)
+        ])
+        await db.user_rollups.insert_one({"user_id": user_id, "next_rollup_at": datetime(2024, 1, 3)})
+        await db.user_settings.insert_one({"user_id": user_id, "timezone": "UTC"})
+    return repository
+
+
+async def remaining(repository, user_id: str) -> dict:
+    return {
+        name: await repository.db[name].count_documents({"user_id": user_id})
+        for name in ("habits", "habit_completions", "habit_stats", "badge_awards", "daily_summaries",
+                     "user_rollups", "user_settings")
+    }
+
+
+async def expire_lease(repository, purge_id: str):
+    await repository.db.purge_jobs.update_one(
+        {"id": purge_id}, {"$set": {"lease_until": datetime.utcnow() - timedelta(seconds=1)}}
+    )
+
+
+async def test_purge_resumes_from_its_checkpoint_after_a_crash(mongo, monkeypatch):
+    purge_id = await mongo.schedule_purge("alice", ["h1"])
+
+    async def crash(delay):
+        raise RuntimeError("worker died")
+
+    monkeypatch.setattr(repository_module.asyncio, "sleep", crash)
+    with pytest.raises(RuntimeError):
+        await mongo.run_purge(await mongo.claim_purge())
+    monkeypatch.undo()
+
+    purge = await mongo.get_purge("alice", purge_id)
+    assert (purge['status'], purge['stage'], purge['deleted']) == ("running", "habit_completions",
+                                                                   {"habit_completions": 2})
+    # The crashed worker's lease still holds the job until it expires
+    assert await mongo.claim_purge() is None
+    await expire_lease(mongo, purge_id)
+    resumed = await mongo.claim_purge()
+    assert resumed['lease_id'] != purge.get('lease_id') and resumed['stage'] == "habit_completions"
+    assert await mongo.run_purge(resumed)
+
+    purge = await mongo.get_purge("alice", purge_id)
+    assert purge['status'] == "done"
+    assert purge['deleted'] == {"habit_completions": COMPLETIONS, "habit_completion_bitmaps": 0, "habit_stats": 1,
+                                "badge_awards": 1, "daily_summaries": 3, "habits": 1}
+    assert purge_progress(purge) == (6, 6)
+    assert await remaining(mongo, "alice") == {"habits": 1, "habit_completions": COMPLETIONS, "habit_stats": 1,
+                                               "badge_awards": 1, "daily_summaries": 0, "user_rollups": 1,
+                                               "user_settings": 1}
+    assert await mongo.db.habit_completions.count_documents({"user_id": "alice", "habit_id": "h2"}) == COMPLETIONS
+    assert await mongo.db.habits.count_documents({"user_id": "alice", "id": "h1"}) == 0
+
+
+async def test_worker_that_lost_its_lease_stops_without_counting_again(mongo):
+    purge_id = await mongo.schedule_purge("alice", ["h1"])
+    stalled = await mongo.claim_purge()
+    await expire_lease(mongo, purge_id)
+    taken_over = await mongo.claim_purge()
+    assert taken_over['id'] == purge_id and taken_over['lease_id'] != stalled['lease_id']
+
+    assert await mongo.run_purge(taken_over)
+    assert not await mongo.run_purge(stalled)
+
+    purge = await mongo.get_purge("alice", purge_id)
+    assert purge['status'] == "done"
+    assert purge['deleted']['habit_completions'] == COMPLETIONS
+    assert purge['deleted']['habits'] == 1
+    assert await mongo.claim_purge() is None
+
+
+async def test_whole_user_purge_clears_every_stage(mongo):
+    await mongo.delete_habits("alice", ["h2"], datetime(2024, 1, 2))
+    purge_id = await mongo.schedule_purge("alice", ["h1", "h2"], whole_user=True)
+    purge = await mongo.claim_purge()
+    assert purge_progress(purge) == (0, 8)
+    assert await mongo.run_purge(purge)
+
+    purge = await mongo.get_purge("alice", purge_id)
+    assert purge_progress(purge) == (8, 8)
+    assert purge['deleted']['user_rollups'] == 1 and purge['deleted']['user_settings'] == 1
+    assert await remaining(mongo, "alice") == dict.fromkeys(await remaining(mongo, "alice"), 0)
+    assert await remaining(mongo, "bob") == {"habits": 2, "habit_completions": 2 * COMPLETIONS, "habit_stats": 2,
+                                             "badge_awards": 2, "daily_summaries": 3, "user_rollups": 1,
+                                             "user_settings": 1}
@@ -0,0 +1,111 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import DuplicateKeyError
+
+from response_cache import MongoInvalidation, ResponseCache, etag_matches
+from server import INDEXES
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_write_bumps_generation_and_hides_entries():
+    cache = ResponseCache()
+    generation = await cache.generation("u")
+    entry = cache.put("u", "key", generation, b'{"a": 1}')
+    assert cache.get("u", "key", generation) == entry
+
+    await cache.invalidate("u")
+    assert await cache.generation("u") == generation + 1
+    assert cache.get("u", "key", await cache.generation("u")) is None
+
+
+async def test_response_built_during_write_is_not_served():
+    cache = ResponseCache()
+    generation = await cache.generation("u")
+    await cache.invalidate("u")
+    cache.put("u", "key", generation, b"stale")
+    assert cache.get("u", "key", await cache.generation("u")) is None
+
+
+async def test_invalidation_is_per_user():
+    cache = ResponseCache()
+    cache.put("u", "key", 0, b"u")
+    cache.put("v", "key", 0, b"v")
+    await cache.invalidate("u")
+    assert cache.get("v", "key", await cache.generation("v")).body == b"v"
+
+
+@pytest.fixture
+async def generations():
+    collection = AsyncMongoMockClient()["test"]["cache_generations"]
+    for index in INDEXES["cache_generations"]:
+        await collection.create_index(index["keys"], name=index["name"], unique=index.get("unique", False))
+    return collection
+
+
+async def test_mongo_generations_keep_one_document_per_user(generations):
+    invalidation = MongoInvalidation(generations)
+    assert await invalidation.generation("u") == 0
+    await invalidation.bump("u")
+    await invalidation.bump("u")
+    assert await invalidation.generation("u") == 2
+    assert await generations.count_documents({"user_id": "u"}) == 1
+    with pytest.raises(DuplicateKeyError):
+        await generations.insert_one({"user_id": "u", "generation": 0})
+
+
+async def test_mongo_bump_retries_after_a_concurrent_insert(generations):
+    class RacingCollection:
+        """Lets another worker insert the counter just before our upsert"""
+
+        def __init__(self):
+            self.raced = False
+
+        def __getattr__(self, name):
+            return getattr(generations, name)
+
+        async def update_one(self, query, update, upsert=False):
+            if upsert and not self.raced:
+                self.raced = True
+                await generations.insert_one({"user_id": query["user_id"], "generation": 1})
+                raise DuplicateKeyError("user_id_unique")
+            return await generations.update_one(query, update, upsert=upsert)
+
+    invalidation = MongoInvalidation(RacingCollection())
+    await invalidation.bump("u")
+    assert await invalidation.generation("u") == 2
+
+
+def test_lru_bound_and_ttl(monkeypatch):
+    cache = ResponseCache(max_entries=2, ttl_seconds=10)
+    now = [100.0]
+    monkeypatch.setattr("response_cache.time.monotonic", lambda: now[0])
+    cache.put("u", "a", 0, b"a")
+    cache.put("u", "b", 0, b"b")
+    cache.get("u", "a", 0)
+    cache.put("u", "c", 0, b"c")
+    assert cache.get("u", "b", 0) is None
+    assert cache.get("u", "a", 0).body == b"a"
+
+    now[0] += 10
+    assert cache.get("u", "a", 0) is None
+
+
+def test_etag_follows_body():
+    cache = ResponseCache()
+    first = cache.put("u", "a", 0, b"same")
+    second = cache.put("u", "b", 0, b"same")
+    third = cache.put("u", "c", 0, b"other")
+    assert first.etag == second.etag != third.etag
+    assert first.etag.startswith('"') and first.etag.endswith('"')
+
+
+def test_etag_matches():
+    etag = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"x", "abc"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"x"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('', etag)
@@ -0,0 +1,111 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+TODAY = date(2024, 3, 10)
+DAY = (TODAY - timedelta(days=2)).isoformat()
+
+
+async def add_habit(server, habit_id: str = "h1"):
+    await server.repository.insert_habit({
+        "id": habit_id, "user_id": "alice", "name": habit_id, "description": None, "category": "health",
+        "icon": "x", "color": "c", "created_at": datetime(2024, 1, 1), "deleted_at": None,
+    })
+
+
+async def toggle(server, completed: bool):
+    """A completion write's repository calls, as write_completion makes them"""
+    previous = await server.repository.set_completion("alice", "h1", DAY, completed)
+    await server.mark_daily_summary_stale("alice", DAY, previous, completed, TODAY)
+
+
+async def counted(server) -> int:
+    start = TODAY - timedelta(days=6)
+    return (await server.load_completed_by_day("alice", ["h1"], start, TODAY)).get(DAY, 0)
+
+
+async def test_toggle_between_count_and_insert_is_not_lost(bound_server, monkeypatch):
+    server = bound_server
+    await add_habit(server)
+    count_completed_by_day = server.repository.count_completed_by_day
+
+    async def count_then_toggle(*args, **kwargs):
+        daily_completed = await count_completed_by_day(*args, **kwargs)
+        monkeypatch.setattr(server.repository, "count_completed_by_day", count_completed_by_day)
+        await toggle(server, True)
+        return daily_completed
+
+    monkeypatch.setattr(server.repository, "count_completed_by_day", count_then_toggle)
+    await server.roll_up_days("alice", ["h1"], TODAY)
+
+    assert DAY not in await server.repository.daily_summaries("alice", TODAY - timedelta(days=6), TODAY)
+    assert await counted(server) == 1
+    await server.roll_up_days("alice", ["h1"], TODAY)
+    assert (await server.repository.daily_summaries("alice", TODAY - timedelta(days=6), TODAY))[DAY] == 1
+
+
+async def test_toggle_counted_before_its_marker_is_not_counted_twice(bound_server, monkeypatch):
+    server = bound_server
+    await add_habit(server)
+    await server.repository.set_completion("alice", "h1", DAY, True)
+    insert_daily_summaries = server.repository.insert_daily_summaries
+
+    async def insert_then_mark(*args):
+        inserted = await insert_daily_summaries(*args)
+        await server.mark_daily_summary_stale("alice", DAY, False, True, TODAY)
+        return inserted
+
+    monkeypatch.setattr(server.repository, "insert_daily_summaries", insert_then_mark)
+    await server.roll_up_days("alice", ["h1"], TODAY)
+    assert await counted(server) == 1
+
+    monkeypatch.setattr(server.repository, "insert_daily_summaries", insert_daily_summaries)
+    await server.roll_up_days("alice", ["h1"], TODAY)
+    assert (await server.repository.daily_summaries("alice", TODAY - timedelta(days=6), TODAY))[DAY] == 1
+    assert await counted(server) == 1
+
+
+async def test_stale_day_marked_again_during_a_rollup_stays_stale(bound_server, monkeypatch):
+    server = bound_server
+    await add_habit(server)
+    await server.roll_up_days("alice", ["h1"], TODAY)
+    await toggle(server, True)
+    count_completed_by_day = server.repository.count_completed_by_day
+
+    async def count_then_toggle(*args, **kwargs):
+        daily_completed = await count_completed_by_day(*args, **kwargs)
+        monkeypatch.setattr(server.repository, "count_completed_by_day", count_completed_by_day)
+        await toggle(server, False)
+        return daily_completed
+
+    monkeypatch.setattr(server.repository, "count_completed_by_day", count_then_toggle)
+    await server.roll_up_days("alice", ["h1"], TODAY)
+    assert await counted(server) == 0
+
+    await server.roll_up_days("alice", ["h1"], TODAY)
+    assert (await server.repository.daily_summaries("alice", TODAY - timedelta(days=6), TODAY))[DAY] == 0
+
+
+async def test_toggles_of_today_leave_summaries_alone(bound_server):
+    server = bound_server
+    await server.mark_daily_summary_stale("alice", TODAY.isoformat(), False, True, TODAY)
+    await server.mark_daily_summary_stale("alice", DAY, True, True, TODAY)
+    assert await server.repository.stale_daily_summaries("alice", TODAY - timedelta(days=6), TODAY) == {}
+
+
+async def test_toggle_awards_badges_without_listing_them(bound_server, monkeypatch):
+    from habit_stats import stats_from_history
+
+    server = bound_server
+    history = {(TODAY - timedelta(days=offset)).isoformat(): True for offset in range(3)}
+    stats = stats_from_history("h1", history)
+
+    async def list_badge_awards(user_id):
+        raise AssertionError("a toggle inserts its earned badges directly")
+
+    monkeypatch.setattr(server.repository, "list_badge_awards", list_badge_awards)
+    first = await server.award_badges("alice", {"h1": stats}, TODAY)
+    assert [award['badge_id'] for award in first] == ["consistent", "streak-3"]
+    assert await server.award_badges("alice", {"h1": stats}, TODAY) == []
@@ -0,0 +1,148 @@
+from datetime import date, datetime
+
+import pytest
+
+from sqlite_repository import SqliteRepository
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def repository(tmp_path):
+    repository = SqliteRepository(str(tmp_path / "habits.sqlite3"))
+    await repository.open()
+    yield repository
+    await repository.close()
+
+
+def habit(habit_id: str, user_id: str = "alice") -> dict:
+    return {"id": habit_id, "user_id": user_id, "name": habit_id, "description": None, "category": "health",
+            "icon": "x", "color": "c", "created_at": datetime(2024, 1, 1), "deleted_at": None}
+
+
+async def test_set_completions_reports_failed_rows_and_keeps_the_rest(repository):
+    errors = await repository.set_completions("alice", [
+        ("h1", "2024-01-01", True),
+        (None, "2024-01-02", True),
+        ("h1", "2024-01-03", False),
+    ])
+
+    assert list(errors) == [1]
+    assert "NOT NULL" in errors[1]
+    histories = await repository.completion_histories("alice", ["h1"])
+    assert histories == {"h1": {"2024-01-01": True, "2024-01-03": False}}
+
+
+async def test_set_completions_without_errors(repository):
+    assert await repository.set_completions("alice", [("h1", "2024-01-01", True)]) == {}
+    assert await repository.set_completions("alice", []) == {}
+
+
+async def test_daily_summaries_insert_only_missing_days(repository):
+    assert await repository.insert_daily_summaries("alice", {"2024-01-01": 1, "2024-01-02": 0}, 2) == [
+        "2024-01-01", "2024-01-02"
+    ]
+    assert await repository.insert_daily_summaries("alice", {"2024-01-02": 2, "2024-01-03": 2}, 2) == ["2024-01-03"]
+
+    assert await repository.daily_summaries("alice", date(2024, 1, 1), date(2024, 1, 2)) == {
+        "2024-01-01": 1, "2024-01-02": 0
+    }
+    await repository.delete_daily_summaries("alice", date(2024, 1, 2))
+    assert await repository.daily_summaries("alice", date(2024, 1, 1), date(2024, 1, 3)) == {"2024-01-01": 1}
+    await repository.delete_daily_summaries("alice")
+    assert await repository.daily_summaries("alice", date(2024, 1, 1), date(2024, 1, 3)) == {}
+
+
+async def test_stale_daily_summaries_are_refreshed_once_unchanged(repository):
+    await repository.insert_daily_summaries("alice", {"2024-01-01": 1}, 2)
+    await repository.mark_daily_summary_stale("alice", "2024-01-01")
+    await repository.mark_daily_summary_stale("alice", "2024-01-02")
+    window = (date(2024, 1, 1), date(2024, 1, 2))
+
+    assert await repository.daily_summaries("alice", *window) == {}
+    stale = await repository.stale_daily_summaries("alice", *window)
+    assert stale == {"2024-01-01": 1, "2024-01-02": 1}
+    assert await repository.insert_daily_summaries("alice", {"2024-01-02": 1}, 2) == []
+
+    await repository.mark_daily_summary_stale("alice", "2024-01-02")
+    assert await repository.refresh_daily_summaries("alice", {"2024-01-01": 2, "2024-01-02": 1}, 2, stale) == [
+        "2024-01-01"
+    ]
+    assert await repository.daily_summaries("alice", *window) == {"2024-01-01": 2}
+    assert await repository.stale_daily_summaries("alice", *window) == {"2024-01-02": 2}
+
+
+async def test_badge_awards_skip_duplicates(repository):
+    first = {"user_id": "alice", "habit_id": "h1", "badge_id": "streak-3", "awarded_at": datetime(2024, 1, 1)}
+    later = {"user_id": "alice", "habit_id": "h1", "badge_id": "streak-7", "awarded_at": datetime(2024, 1, 7)}
+    assert await repository.insert_badge_awards([first]) == [first]
+    assert await repository.insert_badge_awards([first, later]) == [later]
+
+    assert await repository.list_badge_awards("alice") == [
+        {"habit_id": "h1", "badge_id": "streak-7", "awarded_at": datetime(2024, 1, 7)},
+        {"habit_id": "h1", "badge_id": "streak-3", "awarded_at": datetime(2024, 1, 1)},
+    ]
+
+
+async def test_schedule_purge_removes_deleted_habits_at_once(repository):
+    for habit_id in ("h1", "h2"):
+        await repository.insert_habit(habit(habit_id))
+    await repository.set_completions("alice", [("h1", "2024-01-01", True), ("h2", "2024-01-01", True)])
+    await repository.insert_badge_awards([
+        {"user_id": "alice", "habit_id": "h1", "badge_id": "streak-3", "awarded_at": datetime(2024, 1, 1)}
+    ])
+    await repository.insert_daily_summaries("alice", {"2024-01-01": 2}, 2)
+    await repository.delete_habits("alice", ["h1"], datetime(2024, 1, 2))
+
+    assert await repository.schedule_purge("alice", ["h1"]) is None
+
+    assert await repository.completion_histories("alice", ["h1", "h2"]) == {"h1": {}, "h2": {"2024-01-01": True}}
+    assert await repository.list_badge_awards("alice") == []
+    assert await repository.daily_summaries("alice", date(2024, 1, 1), date(2024, 1, 1)) == {}
+    assert await repository.list_user_ids() == ["alice"]
+    assert await repository.claim_purge() is None
+
+
+async def test_purge_sweeps_up_habits_left_soft_deleted(repository):
+    for habit_id in ("h1", "h2"):
+        await repository.insert_habit(habit(habit_id))
+    await repository.insert_habit(habit("h1", user_id="bob"))
+    await repository.set_completions("alice", [("h1", "2024-01-01", True), ("h2", "2024-01-01", True)])
+    await repository.delete_habits("alice", ["h1"], datetime(2024, 1, 2))
+
+    purge = await repository.claim_purge()
+    assert purge == {"id": None, "user_id": "alice", "habit_ids": ["h1"], "whole_user": False}
+    assert await repository.run_purge(purge)
+
+    assert await repository.completion_histories("alice", ["h1", "h2"]) == {"h1": {}, "h2": {"2024-01-01": True}}
+    assert await repository.claim_purge() is None
+    assert [owner async for owner in repository.iter_habit_owners()] == [("alice", "h2"), ("bob", "h1")]
+
+
+async def test_habit_owners_by_id_use_the_id_index(repository):
+    for user_id in ("alice", "bob"):
+        for habit_id in ("h1", "h2"):
+            await repository.insert_habit(habit(habit_id, user_id))
+    owners = [owner async for owner in repository.iter_habit_owners(["h2"])]
+    assert owners == [("alice", "h2"), ("bob", "h2")]
+
+    plan = await repository._fetch("EXPLAIN QUERY PLAN SELECT user_id, id FROM habits WHERE id IN (?)", ["h2"])
+    assert any("habits_id" in row['detail'] for row in plan)
+
+
+async def test_claim_job_refuses_a_held_lease(repository):
+    assert await repository.claim_job("daily_rollups", 60)
+    assert not await repository.claim_job("daily_rollups", 60)
+    assert await repository.claim_job("other", 60)
+
+
+async def test_rollup_schedule(repository):
+    midnight = datetime(2024, 1, 2)
+    await repository.set_next_rollup("alice", midnight)
+    await repository.add_rollup_users(["alice", "bob"], datetime(2024, 1, 1, 12))
+    assert await repository.due_rollup_users(datetime(2024, 1, 1, 12)) == ["bob"]
+
+    await repository.request_rollup("alice", datetime(2024, 1, 3))
+    assert sorted(await repository.due_rollup_users(midnight)) == ["alice", "bob"]
+    await repository.request_rollup("alice", datetime(2024, 1, 1))
+    assert sorted(await repository.due_rollup_users(datetime(2024, 1, 1, 12))) == ["alice", "bob"]
@@ -0,0 +1,55 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+def freeze(server, monkeypatch, instant: datetime):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return instant.astimezone(tz)
+
+    monkeypatch.setattr(server, "datetime", FrozenDatetime)
+
+
+@pytest.mark.parametrize("instant, expected", [
+    (datetime(2024, 3, 10, 23, 30, tzinfo=timezone.utc),
+     {"UTC": date(2024, 3, 10), "Asia/Tokyo": date(2024, 3, 11), "America/Los_Angeles": date(2024, 3, 10)}),
+    (datetime(2024, 3, 11, 0, 30, tzinfo=timezone.utc),
+     {"UTC": date(2024, 3, 11), "Asia/Tokyo": date(2024, 3, 11), "America/Los_Angeles": date(2024, 3, 10)}),
+])
+async def test_today_is_the_users_local_date_either_side_of_utc_midnight(bound_server, monkeypatch, instant,
+                                                                         expected):
+    server = bound_server
+    freeze(server, monkeypatch, instant)
+    for zone in expected:
+        await server.repository.save_settings(zone, {"timezone": zone})
+    assert {zone: await server.get_today(zone) for zone in expected} == expected
+
+
+async def test_missing_or_unknown_timezone_falls_back_to_utc(bound_server, monkeypatch):
+    server = bound_server
+    freeze(server, monkeypatch, datetime(2024, 3, 10, 23, 30, tzinfo=timezone.utc))
+    await server.repository.save_settings("bob", {"timezone": "Mars/Olympus_Mons"})
+    assert await server.get_today("alice") == date(2024, 3, 10)
+    assert await server.get_today("bob") == date(2024, 3, 10)
+    assert await server.get_user_timezone("bob") == "UTC"
+
+
+async def test_settings_update_clears_the_cached_timezone(bound_server, monkeypatch):
+    server = bound_server
+    freeze(server, monkeypatch, datetime(2024, 3, 10, 23, 30, tzinfo=timezone.utc))
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    assert await server.get_today("alice") == date(2024, 3, 10)
+
+    # Written behind this worker's back, as another worker would: cached until the TTL
+    await server.repository.save_settings("alice", {"timezone": "Asia/Tokyo"})
+    assert await server.get_today("alice") == date(2024, 3, 10)
+    now[0] += server.USER_TIMEZONE_TTL_SECONDS
+    assert await server.get_today("alice") == date(2024, 3, 11)
+
+    await server.update_settings(server.UserSettingsUpdate(timezone="America/Los_Angeles"), user_id="alice")
+    assert await server.get_today("alice") == date(2024, 3, 10)
@@ -0,0 +1,34 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_background_jobs_start_after_the_indexes(bound_server, monkeypatch):
+    server = bound_server
+    scheduler = Scheduler()
+    scheduler.add_job("daily_rollups", lambda: asyncio.sleep(0), 60)
+    monkeypatch.setattr(server, "scheduler", scheduler)
+    monkeypatch.setattr(server, "db", object())
+    monkeypatch.setattr(server, "warmed_up", False)
+    attempts = []
+
+    async def ensure_indexes():
+        assert not scheduler._tasks, "jobs started before the indexes existed"
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise ConnectionError("storage unreachable")
+
+    monkeypatch.setattr(server, "ensure_indexes", ensure_indexes)
+    sleep = asyncio.sleep
+    monkeypatch.setattr(server.asyncio, "sleep", lambda delay: sleep(0))
+    try:
+        await server.warm_up()
+        assert len(attempts) == 2
+        assert list(scheduler._tasks) == ["daily_rollups"]
+        assert server.warmed_up
+    finally:
+        await scheduler.stop()